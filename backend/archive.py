@@ -0,0 +1,256 @@
+"""
+Tiering of old or inactive threads to compressed cold storage.
+
+Archiving writes a thread's messages to a gzipped JSONL blob in the
+``archive`` storage (private S3 in production, MEDIA_ROOT/archive in
+development), deletes them from the hot table and leaves the thread row in
+place as a stub: its title and denormalised activity fields stay
+queryable. The first request that needs the messages rehydrates them,
+original ids and timestamps included.
+
+Blob layout: a header line describing the thread, then one line per
+message with the message's concrete field values. Every archive run writes
+a blob under a new name, so a run that loses a race to archive the thread
+only ever deletes its own blob, never one a committed stub points at.
+Runs also claim the thread in the shared cache for ARCHIVE_CLAIM_TIMEOUT
+seconds, so overlapping runs do not write the same thread twice.
+"""
+import gzip
+import json
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import storages
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models.signals import post_delete
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from search.indexing import index_messages
+
+ARCHIVE_FORMAT = 1
+
+
+class ArchiveError(Exception):
+    """Raised when a thread cannot be archived or rehydrated"""
+    pass
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """Keeps full microsecond precision, which DjangoJSONEncoder rounds off"""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def get_archive_storage():
+    return storages['archive']
+
+
+class ThreadArchiver:
+    """
+    Archives threads of ``thread_model`` whose messages are the
+    ``message_model`` rows pointing at them through ``thread``. The thread
+    model needs ``archived_at`` and ``archive_path`` fields.
+    """
+    thread_model = None
+    message_model = None
+    kind = None
+    chunk_size = 2000
+
+    def blob_name(self, thread) -> str:
+        return f'{self.kind}/{thread.user_id}/{thread.pk}-{uuid.uuid4().hex}.jsonl.gz'
+
+    def claim_key(self, thread) -> str:
+        return f'archive:{self.kind}:{thread.pk}'
+
+    def candidates(self, older_than_days: int):
+        """Unarchived threads that are inactive or idle for older_than_days"""
+        cutoff = timezone.now() - timedelta(days=older_than_days)
+        return self.thread_model.objects.filter(archived_at__isnull=True).filter(
+            models.Q(is_active=False) | models.Q(updated_at__lt=cutoff)
+        )
+
+    def _encode(self, instance) -> dict:
+        return {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+
+    def _decode(self, model, data: dict):
+        values = {}
+        for field in model._meta.concrete_fields:
+            if field.attname not in data:
+                continue
+            value = data[field.attname]
+            if isinstance(field, models.DateTimeField) and value is not None:
+                value = parse_datetime(value)
+            values[field.attname] = value
+        return model(**values)
+
+    def _write_blob(self, thread):
+        """Stream the thread's messages into a compressed temporary file"""
+        encoder = ArchiveEncoder()
+        spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        written = 0
+        with gzip.GzipFile(fileobj=spool, mode='wb') as gz:
+            header = {'format': ARCHIVE_FORMAT, 'kind': self.kind, 'thread': self._encode(thread)}
+            gz.write(encoder.encode(header).encode() + b'\n')
+            messages = self.message_model.objects.filter(thread=thread).order_by('pk')
+            for message in messages.iterator(chunk_size=self.chunk_size):
+                gz.write(encoder.encode(self._encode(message)).encode() + b'\n')
+                written += 1
+        spool.seek(0)
+        return spool, written
+
+    def archive(self, thread) -> bool:
+        """
+        Move a thread's messages to cold storage. Returns False, leaving the
+        thread untouched, if another run is archiving it, it was archived
+        meanwhile or its messages changed while the blob was being written.
+        """
+        claim = self.claim_key(thread)
+        if not cache.add(claim, 1, settings.ARCHIVE_CLAIM_TIMEOUT):
+            return False
+        try:
+            if self.thread_model.objects.filter(pk=thread.pk, archived_at__isnull=False).exists():
+                return False
+            return self._archive(thread)
+        finally:
+            cache.delete(claim)
+
+    def _archive(self, thread) -> bool:
+        storage = get_archive_storage()
+        name = self.blob_name(thread)
+        spool, written = self._write_blob(thread)
+        try:
+            name = storage.save(name, File(spool, name=name))
+        finally:
+            spool.close()
+
+        with transaction.atomic():
+            locked = self.thread_model.objects.select_for_update().get(pk=thread.pk)
+            messages = self.message_model.objects.filter(thread=locked)
+            # Counting rather than comparing ids also catches messages that
+            # committed late with a lower id than the last one written
+            if locked.archived_at is not None or messages.count() != written:
+                # The blob is this run's own and nothing references it
+                storage.delete(name)
+                return False
+            messages.delete()
+            archived_at = timezone.now()
+            self.thread_model.objects.filter(pk=thread.pk).update(archived_at=archived_at, archive_path=name)
+        thread.archived_at = archived_at
+        thread.archive_path = name
+        return True
+
+    def _read_blob(self, name):
+        storage = get_archive_storage()
+        with storage.open(name, 'rb') as f, gzip.GzipFile(fileobj=f, mode='rb') as gz:
+            header = json.loads(gz.readline())
+            if header.get('format') != ARCHIVE_FORMAT:
+                raise ArchiveError(f"Unsupported archive format in {name}")
+            for line in gz:
+                yield self._decode(self.message_model, json.loads(line))
+
+    def iter_archived_messages(self, thread):
+        """Unsaved message instances read back from an archived thread's blob"""
+        return self._read_blob(thread.archive_path)
+
+    def rehydrate(self, thread) -> int:
+        """Restore an archived thread's messages; returns how many were restored"""
+        if thread.archived_at is None:
+            return 0
+        restored = 0
+        with transaction.atomic():
+            locked = self.thread_model.objects.select_for_update().get(pk=thread.pk)
+            if locked.archived_at is None:
+                thread.archived_at = None
+                thread.archive_path = ''
+                return 0
+            name = locked.archive_path
+            try:
+                batch = []
+                for message in self._read_blob(name):
+                    batch.append(message)
+                    if len(batch) >= self.chunk_size:
+                        restored += self._restore(batch)
+                        batch = []
+                if batch:
+                    restored += self._restore(batch)
+            except ArchiveError:
+                raise
+            except Exception as e:
+                raise ArchiveError(f"Failed to rehydrate thread {thread.pk}: {str(e)}")
+            self.thread_model.objects.filter(pk=thread.pk).update(archived_at=None, archive_path='')
+            transaction.on_commit(lambda: get_archive_storage().delete(name))
+        thread.archived_at = None
+        thread.archive_path = ''
+        return restored
+
+    def _restore(self, messages) -> int:
+        created = self.message_model.objects.bulk_create(messages)
+        index_messages(created)
+        return len(created)
+
+    def ensure_hot(self, thread):
+        """Rehydrate the thread first if it is archived"""
+        if thread.archived_at is not None:
+            self.rehydrate(thread)
+        return thread
+
+    def discard(self, sender, instance, **kwargs):
+        """post_delete receiver removing a deleted thread's blob"""
+        if instance.archive_path:
+            name = instance.archive_path
+            transaction.on_commit(lambda: get_archive_storage().delete(name))
+
+    def connect(self):
+        post_delete.connect(self.discard, sender=self.thread_model, weak=False,
+                            dispatch_uid=f'archive_discard_{self.kind}')
+
+
+class ArchiveThreadsCommand(BaseCommand):
+    """
+    Base for the per-app archive commands. Threads are archived one at a
+    time in pk order, each in its own transaction, so an interrupted run
+    resumes where it stopped when started again.
+    """
+    archiver = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--limit', type=int, default=None, help='Stop after archiving this many threads')
+
+    def handle(self, *args, **options):
+        days = options['older_than_days']
+        if days is None:
+            days = settings.ARCHIVE_AFTER_DAYS
+        candidates = self.archiver.candidates(days)
+        total = candidates.count()
+        if options['limit'] is not None:
+            total = min(total, options['limit'])
+        archived = skipped = 0
+        last_pk = 0
+        while archived < total:
+            batch = list(candidates.filter(pk__gt=last_pk).order_by('pk')[:options['batch_size']])
+            if not batch:
+                break
+            for thread in batch:
+                if archived >= total:
+                    break
+                if self.archiver.archive(thread):
+                    archived += 1
+                else:
+                    skipped += 1
+                last_pk = thread.pk
+            self.stdout.write(f'{archived}/{total} threads archived')
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived} {self.archiver.kind} threads ({skipped} skipped)'
+        ))
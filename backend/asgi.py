@@ -1,7 +1,39 @@
 import os
 
+from asgiref.sync import sync_to_async
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, since consumers import models
+from backend.websocket import WebSocketRouter  # noqa: E402
+from chat.consumers import ChatThreadConsumer  # noqa: E402
+from langchain_chat.consumers import LangChainThreadConsumer  # noqa: E402
+from backend.warmup import warmup  # noqa: E402
+
+websocket_application = WebSocketRouter([
+    (r'^/ws/chat/threads/(?P<thread_id>\d+)/$', ChatThreadConsumer),
+    (r'^/ws/langchain/threads/(?P<thread_id>\d+)/$', LangChainThreadConsumer),
+])
+
+
+async def lifespan(scope, receive, send):
+    """Warm up before the server accepts connections"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await sync_to_async(warmup.run)()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    if scope['type'] == 'lifespan':
+        return await lifespan(scope, receive, send)
+    return await django_application(scope, receive, send)
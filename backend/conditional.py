@@ -0,0 +1,65 @@
+import hashlib
+
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+
+def thread_version(thread):
+    """Version of a thread and its messages, as used in thread ETags"""
+    return f'{thread.updated_at.timestamp()}-{thread.message_count}'
+
+
+def thread_flight_key(kind, thread, request):
+    """
+    single_flight key for a thread representation: tabs opening the same
+    version of a thread with the same query string share one serialization.
+    """
+    return f'{kind}:thread:{thread.pk}:{thread_version(thread)}:{request.get_full_path()}'
+
+
+def thread_condition(get_state):
+    """
+    Conditional GET (ETag / Last-Modified) for thread views.
+
+    ``get_state(request, *args, **kwargs)`` returns ``(version, last_modified)``
+    for the requested thread, or None when it does not exist for this user. It
+    should be a single cheap query; it runs once per request and nothing is
+    serialized when the client's copy is still current.
+    """
+    def _state(request, *args, **kwargs):
+        if not hasattr(request, '_thread_state'):
+            request._thread_state = get_state(request, *args, **kwargs)
+        return request._thread_state
+
+    def etag_func(request, *args, **kwargs):
+        state = _state(request, *args, **kwargs)
+        if state is None:
+            return None
+        # The representation also depends on the query string (?fields=) and
+        # the negotiated renderer.
+        key = '|'.join([
+            str(state[0]),
+            request.get_full_path(),
+            request.META.get('HTTP_ACCEPT', ''),
+        ])
+        return '"%s"' % hashlib.md5(key.encode()).hexdigest()
+
+    def last_modified_func(request, *args, **kwargs):
+        state = _state(request, *args, **kwargs)
+        return state[1] if state else None
+
+    def decorator(func):
+        conditional = condition(etag_func=etag_func, last_modified_func=last_modified_func)(func)
+
+        def inner(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                # Clients may keep a copy but must revalidate before using it
+                patch_cache_control(response, private=True, no_cache=True)
+                patch_vary_headers(response, ('Accept',))
+            return response
+        inner.__name__ = func.__name__
+        inner.__doc__ = func.__doc__
+        return inner
+
+    return decorator
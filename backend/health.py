@@ -0,0 +1,23 @@
+"""
+Probes for load balancers and orchestrators. Plain Django views: they
+skip DRF's authentication, throttling and content negotiation.
+"""
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+from .warmup import warmup
+
+
+@require_GET
+def healthz(request):
+    """Liveness: the process is serving requests"""
+    return JsonResponse({'status': 'ok'})
+
+
+@require_GET
+def readyz(request):
+    """Readiness: 503 until this worker has warmed up (which a probe starts if nothing else has)"""
+    if not warmup.ready:
+        warmup.start()
+    status = warmup.status()
+    return JsonResponse(status, status=200 if status['ready'] else 503)
@@ -0,0 +1,161 @@
+"""
+Request hedging for upstream model calls.
+
+A hedged call starts the request and, if it has produced nothing within
+the hedge delay, starts a duplicate; whichever produces its first item
+first is used and the other is cancelled. The delay is the HEDGE_PERCENTILE
+of recent first-item latencies for the same key (usually a model name),
+kept in the shared cache so every worker hedges on the same observations.
+Duplicates are capped per key at HEDGE_BUDGET of the calls made in each
+HEDGE_BUDGET_WINDOW, so a slow upstream is not hit with twice the load.
+
+    for chunk in hedged_iter(lambda: llm.stream(messages), 'gpt-4o-mini'):
+        ...
+
+Both attempts run in daemon threads and must not touch the database. A
+cancelled attempt stops at its next item and its iterator is closed,
+which for the OpenAI clients closes the HTTP response; one still waiting
+for its first byte is only abandoned, bounded by the client's timeout.
+"""
+import queue
+import threading
+import time
+from typing import Callable, Iterator, TypeVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+T = TypeVar('T')
+
+SAMPLES_KEY = 'hedge:samples:{}'
+BUDGET_KEY = 'hedge:{}:{}:{}'
+
+_ITEM, _DONE, _ERROR = 'item', 'done', 'error'
+
+
+def record_latency(key: str, seconds: float) -> None:
+    """Add a first-item latency to the key's recent samples"""
+    cache_key = SAMPLES_KEY.format(key)
+    samples = cache.get(cache_key) or []
+    samples.append(round(seconds, 4))
+    cache.set(cache_key, samples[-settings.HEDGE_SAMPLE_SIZE:], settings.HEDGE_SAMPLES_TTL)
+
+
+def hedge_delay(key: str) -> float:
+    """How long to wait for a first item before sending a duplicate"""
+    samples = cache.get(SAMPLES_KEY.format(key)) or []
+    if len(samples) < settings.HEDGE_MIN_SAMPLES:
+        return settings.HEDGE_DEFAULT_DELAY
+    samples = sorted(samples)
+    index = min(len(samples) - 1, int(len(samples) * settings.HEDGE_PERCENTILE / 100))
+    return max(samples[index], settings.HEDGE_MIN_DELAY)
+
+
+def _budget_key(kind: str, key: str) -> str:
+    return BUDGET_KEY.format(kind, key, int(time.time() // settings.HEDGE_BUDGET_WINDOW))
+
+
+def _incr(cache_key: str) -> int:
+    cache.add(cache_key, 0, settings.HEDGE_BUDGET_WINDOW * 2)
+    try:
+        return cache.incr(cache_key)
+    except ValueError:
+        # Expired between add and incr
+        cache.set(cache_key, 1, settings.HEDGE_BUDGET_WINDOW * 2)
+        return 1
+
+
+def note_call(key: str) -> None:
+    """Count a call that may be hedged towards the key's budget"""
+    _incr(_budget_key('calls', key))
+
+
+def try_spend(key: str) -> bool:
+    """Take one duplicate request from the key's budget, if any is left"""
+    calls = cache.get(_budget_key('calls', key), 0)
+    hedges_key = _budget_key('hedges', key)
+    # Each concurrent caller gets its own count back from incr, so no more
+    # than the budget can succeed
+    if _incr(hedges_key) > calls * settings.HEDGE_BUDGET:
+        try:
+            cache.decr(hedges_key)
+        except ValueError:
+            pass
+        return False
+    return True
+
+
+class _Attempt(threading.Thread):
+    def __init__(self, start: Callable[[], Iterator], results: queue.Queue):
+        super().__init__(daemon=True)
+        self.start_call = start
+        self.results = results
+        self.cancelled = threading.Event()
+
+    def run(self):
+        iterator = None
+        try:
+            iterator = self.start_call()
+            for item in iterator:
+                if self.cancelled.is_set():
+                    return
+                self.results.put((self, _ITEM, item))
+            self.results.put((self, _DONE, None))
+        except Exception as e:
+            if not self.cancelled.is_set():
+                self.results.put((self, _ERROR, e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+def hedged_iter(start: Callable[[], Iterator[T]], key: str) -> Iterator[T]:
+    """
+    Iterate over start(), calling it a second time if the first item is
+    late and the key's budget allows. Errors are raised once no attempt
+    is left running; they are not retried here.
+    """
+    note_call(key)
+    results = queue.Queue()
+    attempts = [_Attempt(start, results)]
+    attempts[0].start()
+    started = time.monotonic()
+    deadline = started + hedge_delay(key)
+    may_hedge = True
+    winner = None
+    try:
+        while winner is None:
+            timeout = max(0, deadline - time.monotonic()) if may_hedge else None
+            try:
+                attempt, kind, value = results.get(timeout=timeout)
+            except queue.Empty:
+                may_hedge = False
+                if try_spend(key):
+                    attempts.append(_Attempt(start, results))
+                    attempts[-1].start()
+                continue
+            if kind == _ERROR:
+                attempt.cancel()
+                if all(other.cancelled.is_set() for other in attempts):
+                    raise value
+                continue
+            winner = attempt
+            record_latency(key, time.monotonic() - started)
+            for other in attempts:
+                if other is not winner:
+                    other.cancel()
+
+        while kind == _ITEM:
+            yield value
+            attempt, kind, value = results.get()
+            while attempt is not winner:
+                attempt, kind, value = results.get()
+        if kind == _ERROR:
+            raise value
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
@@ -0,0 +1,151 @@
+"""
+Idempotency-Key support for POST views that start an LLM run.
+
+Clients on flaky networks retry requests whose response they never saw.
+A retry carrying the same ``Idempotency-Key`` header as the original does
+not run the view again:
+
+- while the original is still running, the retry waits for it (up to
+  IDEMPOTENCY_WAIT_TIMEOUT) and gets its response;
+- once the original has succeeded, its response is replayed, with an
+  ``Idempotent-Replayed: true`` header;
+- if the original failed, the retry runs as a new attempt.
+
+Keys are scoped to the user and the view, and remembered in the shared
+cache for IDEMPOTENCY_KEY_TTL seconds. Reusing a key for a different
+request body is rejected with 422.
+
+The key is looked up before the view's throttles and concurrency slots
+(backend.throttling), so a retry that waits for or replays the original
+spends neither. While the original runs its claim is renewed, so a long
+turn does not let a retry start a second run.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotentResponse(Exception):
+    """Carries the response to a request that is answered without running the view"""
+
+    def __init__(self, response):
+        self.response = response
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.path}|{body}'.encode()).hexdigest()
+
+
+def _replay(record):
+    response = Response(record['data'], status=record['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _renew_until(cache_key, stop):
+    while not stop.wait(settings.IDEMPOTENCY_RUNNING_TIMEOUT / 3):
+        cache.touch(cache_key, settings.IDEMPOTENCY_RUNNING_TIMEOUT)
+
+
+class IdempotencyMixin:
+    """
+    Honours the Idempotency-Key header on a DRF view's idempotency_methods.
+    List it before ConcurrencyLimitMixin. Only successful responses are
+    stored, so failures and throttled attempts can be retried.
+    """
+    idempotency_scope = None
+    idempotency_methods = ('POST',)
+
+    def get_idempotency_scope(self, request):
+        if request.method in self.idempotency_methods:
+            return self.idempotency_scope
+        return None
+
+    def initial(self, request, *args, **kwargs):
+        self._idempotency = None
+        scope = self.get_idempotency_scope(request)
+        key = request.headers.get(HEADER) if scope else None
+        if key:
+            self.perform_authentication(request)
+            self.check_permissions(request)
+            self._claim(request, scope, key)
+        super().initial(request, *args, **kwargs)
+
+    def _claim(self, request, scope, key):
+        """Claim the key for this request, or raise IdempotentResponse with the answer"""
+        if len(key) > MAX_KEY_LENGTH:
+            raise IdempotentResponse(Response(
+                {'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters.'},
+                status=status.HTTP_400_BAD_REQUEST
+            ))
+
+        cache_key = f'idempotency:{scope}:{request.user.pk}:{hashlib.sha256(key.encode()).hexdigest()}'
+        fingerprint = _fingerprint(request)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+        while not cache.add(
+            cache_key, {'state': 'running', 'fingerprint': fingerprint},
+            settings.IDEMPOTENCY_RUNNING_TIMEOUT
+        ):
+            record = cache.get(cache_key)
+            if record is None:
+                # The original failed or expired meanwhile; try to run
+                continue
+            if record['fingerprint'] != fingerprint:
+                raise IdempotentResponse(Response(
+                    {'error': f'This {HEADER} was already used for a different request.'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                ))
+            if record['state'] == 'done':
+                raise IdempotentResponse(_replay(record))
+            if time.monotonic() > deadline:
+                raise IdempotentResponse(Response(
+                    {'error': f'A request with this {HEADER} is still in progress.'},
+                    status=status.HTTP_409_CONFLICT
+                ))
+            time.sleep(settings.IDEMPOTENCY_POLL)
+
+        stop = threading.Event()
+        renewer = threading.Thread(target=_renew_until, args=(cache_key, stop), daemon=True)
+        renewer.start()
+        self._idempotency = (cache_key, fingerprint, stop, renewer)
+
+    def _finish(self, response):
+        """Store a successful response for replay, or give the key up"""
+        if not getattr(self, '_idempotency', None):
+            return
+        cache_key, fingerprint, stop, renewer = self._idempotency
+        self._idempotency = None
+        stop.set()
+        renewer.join()
+        if response is not None and status.is_success(response.status_code):
+            cache.set(cache_key, {
+                'state': 'done',
+                'fingerprint': fingerprint,
+                'status': response.status_code,
+                'data': response.data,
+            }, settings.IDEMPOTENCY_KEY_TTL)
+        else:
+            cache.delete(cache_key)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, IdempotentResponse):
+            return exc.response
+        try:
+            return super().handle_exception(exc)
+        except BaseException:
+            self._finish(None)
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        self._finish(response)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,116 @@
+"""
+Per-thread turn queue.
+
+A conversation turn must not start while another is running on the same
+thread: the OpenAI Assistants API rejects a message added while a run is
+active, and two LangChain turns would each read the history without the
+other's reply. thread_turn() is a FIFO ticket lock in the shared cache, so
+it holds across workers: each turn takes the next ticket of its thread and
+waits until the thread is serving that ticket. Turns on different threads
+never wait for each other.
+
+The holder of a ticket keeps a lease key alive, renewing it every third of
+TURN_QUEUE_LEASE seconds while its turn runs. Once the lease of the ticket
+being served is gone for longer than TURN_QUEUE_GRACE (the time its owner
+may take to notice its turn came up), or a waiter gave up before its turn,
+the ticket is skipped: a worker that died mid-turn holds up its thread for
+at most one lease.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class TurnQueueTimeout(Exception):
+    """Raised when a turn waited TURN_QUEUE_TIMEOUT seconds without its ticket being served"""
+
+
+class TicketLock:
+    def __init__(self, key, timeout=None, lease=None, poll=None, grace=None):
+        self.key = key
+        self.timeout = settings.TURN_QUEUE_TIMEOUT if timeout is None else timeout
+        self.lease = settings.TURN_QUEUE_LEASE if lease is None else lease
+        self.grace = settings.TURN_QUEUE_GRACE if grace is None else grace
+        self.poll = settings.TURN_QUEUE_POLL if poll is None else poll
+        self.ticket = None
+
+    def _key(self, name, ticket=None):
+        key = f'turn-queue:{self.key}:{name}'
+        return key if ticket is None else f'{key}:{ticket}'
+
+    def _incr(self, key, initial):
+        """Increment a counter, creating it at initial first; returns the new value"""
+        ttl = settings.TURN_QUEUE_KEY_TTL
+        cache.add(key, initial - 1, ttl)
+        try:
+            value = cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.add(key, initial, ttl)
+            value = initial
+        cache.touch(key, ttl)
+        return value
+
+    def _advance(self, served):
+        """Move the queue past ticket served, once however many callers try"""
+        if cache.add(self._key('done', served), 1, settings.TURN_QUEUE_KEY_TTL):
+            self._incr(self._key('serving'), served + 1)
+
+    def acquire(self):
+        self.ticket = ticket = self._incr(self._key('next'), 1)
+        cache.add(self._key('serving'), ticket, settings.TURN_QUEUE_KEY_TTL)
+        deadline = time.monotonic() + self.timeout
+        # When each ticket ahead of ours was first seen unheld
+        unheld_since = {}
+        while True:
+            serving = cache.get(self._key('serving'))
+            if serving is None:
+                # Expired while idle; the queue restarts at the oldest waiter
+                cache.add(self._key('serving'), ticket, settings.TURN_QUEUE_KEY_TTL)
+                continue
+            if serving >= ticket:
+                cache.set(self._key('lease', ticket), 1, self.lease)
+                return
+            if cache.get(self._key('lease', serving)) is None:
+                first_seen = unheld_since.setdefault(serving, time.monotonic())
+                if cache.get(self._key('abandoned', serving)) or time.monotonic() - first_seen > self.grace:
+                    self._advance(serving)
+                    continue
+            else:
+                unheld_since.pop(serving, None)
+            if time.monotonic() > deadline:
+                cache.set(self._key('abandoned', ticket), 1, self.lease)
+                self.ticket = None
+                raise TurnQueueTimeout("Another message in this thread is still being answered.")
+            time.sleep(self.poll)
+
+    def renew_until(self, stop):
+        """Keep the lease of the held ticket alive until stop is set"""
+        lease_key = self._key('lease', self.ticket)
+        while not stop.wait(self.lease / 3):
+            cache.touch(lease_key, self.lease)
+
+    def release(self):
+        if self.ticket is None:
+            return
+        cache.delete(self._key('lease', self.ticket))
+        if cache.get(self._key('serving')) == self.ticket:
+            self._advance(self.ticket)
+        self.ticket = None
+
+
+@contextmanager
+def thread_turn(kind, thread_id):
+    """Run the body as the thread's only turn, after the turns queued before it"""
+    lock = TicketLock(f'{kind}:{thread_id}')
+    lock.acquire()
+    stop = threading.Event()
+    threading.Thread(target=lock.renew_until, args=(stop,), daemon=True).start()
+    try:
+        yield
+    finally:
+        stop.set()
+        lock.release()
@@ -0,0 +1,93 @@
+import re
+
+from django.conf import settings
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.messages import middleware as message_middleware
+from django.contrib.sessions import middleware as session_middleware
+from django.middleware import csrf
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+re_accepts_brotli = re.compile(r'\bbr\b')
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compresses JSON-like responses larger than COMPRESSION_MIN_SIZE bytes.
+    Brotli is preferred when the client accepts it and the ``brotli`` package
+    is installed; otherwise gzip is used. Other content types (admin HTML with
+    CSRF tokens) are left alone.
+    """
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in settings.COMPRESSION_CONTENT_TYPES:
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is None or response.streaming or not re_accepts_brotli.search(accept_encoding):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed_content = brotli.compress(
+            response.content, quality=settings.COMPRESSION_BROTLI_QUALITY
+        )
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+
+def uses_full_stack(path):
+    """
+    Whether a request path needs the session-based middleware. Paths under
+    MIDDLEWARE_SLIM_PREFIXES authenticate with JWTs only and skip it, except
+    those under MIDDLEWARE_FULL_PREFIXES (social auth keeps its OAuth state in
+    the session).
+    """
+    if path.startswith(tuple(settings.MIDDLEWARE_FULL_PREFIXES)):
+        return True
+    return not path.startswith(tuple(settings.MIDDLEWARE_SLIM_PREFIXES))
+
+
+class RouteMiddlewareMixin:
+    """Runs the middleware it is mixed into only for paths that use the full stack"""
+
+    def __call__(self, request):
+        if uses_full_stack(request.path_info):
+            return super().__call__(request)
+        return self.get_response(request)
+
+
+class SessionMiddleware(RouteMiddlewareMixin, session_middleware.SessionMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(RouteMiddlewareMixin, csrf.CsrfViewMiddleware):
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if uses_full_stack(request.path_info):
+            return super().process_view(request, view_func, view_args, view_kwargs)
+        return None
+
+
+class AuthenticationMiddleware(RouteMiddlewareMixin, auth_middleware.AuthenticationMiddleware):
+    pass
+
+
+class MessageMiddleware(RouteMiddlewareMixin, message_middleware.MessageMiddleware):
+    pass
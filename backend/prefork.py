@@ -0,0 +1,81 @@
+"""
+Support for preforking servers (see gunicorn.conf.py).
+
+With the application preloaded, the master imports and builds everything
+workers share before forking (backend.warmup), so those pages stay shared
+copy-on-write. freeze() moves it all out of the garbage collector's reach,
+since a collection writes to every object it visits and would copy the
+pages.
+
+Anything holding sockets or threads must not cross a fork: the master
+closes its database connections before forking, and reset_after_fork()
+drops cached clients in each new worker so they are recreated there.
+"""
+import gc
+import sys
+
+from django.db import connections
+
+# (module, attribute) of cached factories whose products hold connections
+CLIENT_CACHES = [
+    ('chat.services', 'get_client'),
+    ('langchain_chat.chains', 'get_llm'),
+    ('langchain_chat.retrieval', 'get_embeddings'),
+    ('langchain_chat.retrieval', 'get_chroma_client'),
+    ('backend.pubsub', 'get_broker'),
+]
+
+
+def freeze():
+    """
+    Exempt every object from future collections. There is deliberately no
+    collection first: freed objects would leave holes in the shared pages
+    that workers then fill, copying the pages anyway
+    """
+    gc.freeze()
+
+
+def close_connections():
+    """Close the database connections of the calling thread before a fork"""
+    connections.close_all()
+
+
+def reset_after_fork():
+    """Forget clients inherited from the master; they are rebuilt on first use"""
+    for module_name, attribute in CLIENT_CACHES:
+        module = sys.modules.get(module_name)
+        if module is not None:
+            getattr(module, attribute).cache_clear()
+    # Never use an inherited connection, but don't close it: the socket is
+    # the master's too
+    for connection in connections.all(initialized_only=True):
+        connection.connection = None
+
+
+def memory_usage(pid='self'):
+    """
+    Resident, proportional and private memory of a process in kB, from
+    /proc (Linux). PSS divides shared pages among the processes sharing
+    them, so summing it over workers gives their real footprint.
+    """
+    usage = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                    usage[key] = int(value.split()[0])
+    except OSError:
+        return {}
+    return {
+        'rss': usage.get('Rss', 0),
+        'pss': usage.get('Pss', 0),
+        'private': usage.get('Private_Clean', 0) + usage.get('Private_Dirty', 0),
+    }
+
+
+def format_memory_usage(pid='self'):
+    usage = memory_usage(pid)
+    if not usage:
+        return 'memory usage unavailable'
+    return ' '.join(f'{key}={value / 1024:.1f}MB' for key, value in usage.items())
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def thread_channel(kind: str, user_id: int, thread_id: int) -> str:
+    """Channel carrying live events for one of a user's threads"""
+    return f'user:{user_id}:{kind}:{thread_id}'
+
+
+class Subscription:
+    def __init__(self, broker, channel: str, loop: asyncio.AbstractEventLoop):
+        self.broker = broker
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """
+    Fans events out to every subscriber in this process. publish() is thread
+    safe and may be called from sync code running in worker threads; events
+    are handed to each subscriber's event loop.
+
+    Only reaches subscribers in the same process. Deployments with several
+    ASGI workers should point CHAT_PUBSUB_BACKEND at a broker-backed
+    implementation of the same subscribe/unsubscribe/publish interface.
+    """
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel: str) -> Subscription:
+        """Subscribe the running event loop to a channel"""
+        subscription = Subscription(self, channel, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel: str, event: dict):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, event)
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                self.unsubscribe(subscription)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(settings.CHAT_PUBSUB_BACKEND)()
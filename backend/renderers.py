@@ -0,0 +1,40 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSON renderer backed by orjson, falling back to DRF's stdlib renderer when
+    orjson is not installed or an option orjson cannot express is requested
+    (indented or ASCII-only output).
+
+    Datetimes and other non-native values are passed through DRF's
+    JSONEncoder so the output is byte-for-byte the same format.
+    """
+    options = 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        renderer_context = renderer_context or {}
+        indent = self.get_indent(accepted_media_type, renderer_context)
+        if orjson is None or self.ensure_ascii or not self.compact or indent is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        options = self.options | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Match JSONRenderer, which escapes these so the output stays a
+        # strict javascript subset.
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
@@ -0,0 +1,23 @@
+class SparseFieldsetMixin:
+    """
+    Lets clients request a subset of serializer fields with ``?fields=a,b,c``.
+    Unknown names are ignored; if none of the requested names match, the full
+    representation is returned.
+    """
+    fields_query_param = 'fields'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None:
+            return
+
+        requested = request.query_params.get(self.fields_query_param)
+        if not requested:
+            return
+
+        wanted = {name.strip() for name in requested.split(',') if name.strip()}
+        if not wanted & set(self.fields):
+            return
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
@@ -1,5 +1,6 @@
 import sys
 import dj_database_url
+from corsheaders.defaults import default_headers
 from os import getenv, path
 from pathlib import Path
 from django.core.management.utils import get_random_secret_key
@@ -45,19 +46,28 @@ INSTALLED_APPS = [
     'users',
     'chat',
     'langchain_chat',
+    'search',
+    'exports',
 ]
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    "backend.middleware.CompressionMiddleware",
+    "backend.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
+    "backend.middleware.CsrfViewMiddleware",
+    "backend.middleware.AuthenticationMiddleware",
+    "backend.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# JWT-only API routes skip the session, CSRF, authentication and messages
+# middleware (backend.middleware.uses_full_stack); /admin/ and social auth
+# keep the full stack
+MIDDLEWARE_SLIM_PREFIXES = ['/api/']
+MIDDLEWARE_FULL_PREFIXES = ['/api/o/']
+
 ROOT_URLCONF = "backend.urls"
 
 TEMPLATES = [
@@ -77,6 +87,27 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "backend.wsgi.application"
+ASGI_APPLICATION = "backend.asgi.application"
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Throttling and concurrency limits keep their counters here, so production
+# needs a cache shared by every worker.
+
+if getenv('REDIS_URL', None) is not None:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
 
 
 # Database
@@ -151,6 +182,14 @@ if DEVELOPMENT_MODE is True:
     STATIC_ROOT = BASE_DIR / 'static'
     MEDIA_URL = 'media/'
     MEDIA_ROOT = BASE_DIR / 'media'
+    STORAGES = {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        'archive': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': MEDIA_ROOT / 'archive', 'base_url': None},
+        },
+    }
 else:
     AWS_S3_ACCESS_KEY_ID = getenv('AWS_S3_ACCESS_KEY_ID')
     AWS_S3_SECRET_ACCESS_KEY = getenv('AWS_S3_SECRET_ACCESS_KEY')
@@ -166,7 +205,12 @@ else:
     AWS_S3_CUSTOM_DOMAIN = getenv('AWS_S3_CUSTOM_DOMAIN')
     STORAGES = {
         'default': {'BACKEND': 'custom_storages.CustomS3Boto3Storage'},
-        'staticfiles': {'BACKEND': 'storages.backends.s3boto3.S3StaticStorage'}
+        'staticfiles': {'BACKEND': 'storages.backends.s3boto3.S3StaticStorage'},
+        # Archived conversations must never be public
+        'archive': {
+            'BACKEND': 'custom_storages.CustomS3Boto3Storage',
+            'OPTIONS': {'location': 'archive', 'default_acl': 'private', 'querystring_auth': True},
+        },
     }
 
 AUTHENTICATION_BACKENDS = [
@@ -180,9 +224,88 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'backend.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'backend.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'chat_message': getenv('CHAT_MESSAGE_THROTTLE_RATE', '30/min'),
+        'langchain_message': getenv('LANGCHAIN_MESSAGE_THROTTLE_RATE', '30/min'),
+    }
 }
 
+# Maximum number of message requests a user may have in flight at once
+CHAT_MAX_CONCURRENT_REQUESTS = int(getenv('CHAT_MAX_CONCURRENT_REQUESTS', '2'))
+# Seconds before a leaked concurrency slot expires
+CHAT_CONCURRENCY_SLOT_TIMEOUT = int(getenv('CHAT_CONCURRENCY_SLOT_TIMEOUT', '300'))
+# Retry-After value (seconds) sent when the concurrency limit is hit
+CHAT_CONCURRENCY_RETRY_AFTER = int(getenv('CHAT_CONCURRENCY_RETRY_AFTER', '5'))
+
+# Idempotency-Key handling for message POSTs (backend.idempotency)
+# Seconds a successful response is kept for replay
+IDEMPOTENCY_KEY_TTL = int(getenv('IDEMPOTENCY_KEY_TTL', '86400'))
+# Seconds before the claim of a request whose worker died expires; renewed
+# while the request runs
+IDEMPOTENCY_RUNNING_TIMEOUT = int(getenv('IDEMPOTENCY_RUNNING_TIMEOUT', '60'))
+# Seconds a retry waits for the original request to finish
+IDEMPOTENCY_WAIT_TIMEOUT = float(getenv('IDEMPOTENCY_WAIT_TIMEOUT', '120'))
+IDEMPOTENCY_POLL = float(getenv('IDEMPOTENCY_POLL', '0.1'))
+
+# Pre-created OpenAI threads for new chats (chat.pool), topped up by the
+# refill_openai_thread_pool command
+CHAT_THREAD_POOL_SIZE = int(getenv('CHAT_THREAD_POOL_SIZE', '20'))
+# Days before an unused pooled thread is replaced; OpenAI may delete idle threads
+CHAT_THREAD_POOL_MAX_AGE_DAYS = int(getenv('CHAT_THREAD_POOL_MAX_AGE_DAYS', '30'))
+
+# Request coalescing (backend.singleflight)
+# Seconds a caller in another process may hold a flight before waiters run it themselves
+SINGLE_FLIGHT_LOCK_TIMEOUT = float(getenv('SINGLE_FLIGHT_LOCK_TIMEOUT', '30'))
+# Seconds a finished flight's result stays available to the callers that waited for it
+SINGLE_FLIGHT_RESULT_TTL = int(getenv('SINGLE_FLIGHT_RESULT_TTL', '10'))
+SINGLE_FLIGHT_POLL = float(getenv('SINGLE_FLIGHT_POLL', '0.02'))
+# Seconds OpenAI assistant listings and details are cached
+ASSISTANT_CACHE_TTL = int(getenv('ASSISTANT_CACHE_TTL', '300'))
+
+# Per-thread turn queue (backend.locks.thread_turn)
+# Seconds a turn waits for the ones queued before it on its thread
+TURN_QUEUE_TIMEOUT = float(getenv('TURN_QUEUE_TIMEOUT', '120'))
+# Seconds before the turn of a worker that died while holding it is skipped;
+# renewed while the turn runs, so it must be shorter than TURN_QUEUE_TIMEOUT
+TURN_QUEUE_LEASE = float(getenv('TURN_QUEUE_LEASE', '30'))
+# Seconds a served ticket may go without a lease before its owner is presumed gone
+TURN_QUEUE_GRACE = float(getenv('TURN_QUEUE_GRACE', '2'))
+TURN_QUEUE_POLL = float(getenv('TURN_QUEUE_POLL', '0.05'))
+TURN_QUEUE_KEY_TTL = int(getenv('TURN_QUEUE_KEY_TTL', '86400'))
+if TURN_QUEUE_LEASE >= TURN_QUEUE_TIMEOUT:
+    raise Exception('TURN_QUEUE_LEASE must be shorter than TURN_QUEUE_TIMEOUT')
+
+# Stop generating a reply when the WebSocket that asked for it disconnects,
+# saving the partial text with metadata {'truncated': True}
+CHAT_CANCEL_ON_DISCONNECT = getenv('CHAT_CANCEL_ON_DISCONNECT', 'True') == 'True'
+# Seconds between OpenAI run status checks while cancelling a run, and the
+# longest a disconnected stream looks for the run it has to cancel
+OPENAI_RUN_POLL_INTERVAL = float(getenv('OPENAI_RUN_POLL_INTERVAL', '0.5'))
+OPENAI_RUN_CANCEL_TIMEOUT = float(getenv('OPENAI_RUN_CANCEL_TIMEOUT', '10'))
+
+# Pub/sub layer fanning live thread events out to WebSocket connections
+CHAT_PUBSUB_BACKEND = getenv('CHAT_PUBSUB_BACKEND', 'backend.pubsub.InProcessBroker')
+
+# Response compression (backend.middleware.CompressionMiddleware)
+COMPRESSION_MIN_SIZE = int(getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_BROTLI_QUALITY = int(getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+COMPRESSION_CONTENT_TYPES = [
+    'application/json',
+    # Streaming exports; compressed chunk by chunk
+    'application/x-ndjson',
+    'text/csv',
+]
+
 DJOSER = {
     'PASSWORD_RESET_CONFIRM_URL': 'password-reset/{uid}/{token}',
     'SEND_ACTIVATION_EMAIL': True,
@@ -223,6 +346,8 @@ CORS_ALLOWED_ORIGINS = getenv(
     'http://localhost:3000,http://127.0.0.1:3000'
 ).split(',')
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -236,6 +361,80 @@ AUTH_USER_MODEL = 'users.UserAccount'
 # APIs
 OPENAI_API_KEY = getenv('OPENAI_API_KEY')
 
+# Retrieval-augmented generation (langchain_chat.retrieval)
+RAG_CHROMA_PATH = getenv('RAG_CHROMA_PATH', str(BASE_DIR / 'chroma'))
+RAG_EMBEDDINGS = getenv('RAG_EMBEDDINGS', 'langchain_chat.retrieval.openai_embeddings')
+RAG_EMBEDDING_MODEL = getenv('RAG_EMBEDDING_MODEL', 'text-embedding-3-small')
+RAG_EMBEDDING_BATCH_SIZE = int(getenv('RAG_EMBEDDING_BATCH_SIZE', '64'))
+RAG_CHUNK_SIZE = int(getenv('RAG_CHUNK_SIZE', '1000'))
+RAG_CHUNK_OVERLAP = int(getenv('RAG_CHUNK_OVERLAP', '150'))
+RAG_UPLOAD_READ_SIZE = int(getenv('RAG_UPLOAD_READ_SIZE', str(64 * 1024)))
+RAG_MAX_UPLOAD_SIZE = int(getenv('RAG_MAX_UPLOAD_SIZE', str(50 * 1024 * 1024)))
+
+# Model routing (langchain_chat.routing). Candidates cheapest and fastest
+# first; each is used for prompts up to max_input_tokens, unless its
+# observed time to first token is above the SLO (seconds)
+MODEL_ROUTER_ENABLED = getenv('MODEL_ROUTER_ENABLED', 'True') == 'True'
+MODEL_ROUTER_MODELS = [
+    {'name': 'gpt-4o-mini', 'max_input_tokens': 2000},
+    {'name': 'gpt-3.5-turbo', 'max_input_tokens': 12000},
+    {'name': 'gpt-4o', 'max_input_tokens': 120000},
+]
+MODEL_ROUTER_LATENCY_SLO = float(getenv('MODEL_ROUTER_LATENCY_SLO', '4'))
+MODEL_ROUTER_EWMA_ALPHA = float(getenv('MODEL_ROUTER_EWMA_ALPHA', '0.2'))
+MODEL_ROUTER_LATENCY_TTL = int(getenv('MODEL_ROUTER_LATENCY_TTL', '600'))
+MODEL_ROUTER_PROBE_RATE = float(getenv('MODEL_ROUTER_PROBE_RATE', '0.02'))
+# Per attempt; a timed-out or failed call moves on to the fallback model
+MODEL_ROUTER_TIMEOUT = float(getenv('MODEL_ROUTER_TIMEOUT', '30'))
+MODEL_ROUTER_MAX_RETRIES = int(getenv('MODEL_ROUTER_MAX_RETRIES', '1'))
+MODEL_ROUTER_TOKEN_ENCODING = getenv('MODEL_ROUTER_TOKEN_ENCODING', 'cl100k_base')
+# Where the encoding's BPE file is kept; the first worker to need it downloads
+# it there. Set MODEL_ROUTER_TOKEN_OFFLINE in images that ran
+# fetch_token_encodings at build time: a missing file is then never
+# downloaded, and workers are not ready without it
+MODEL_ROUTER_TOKEN_CACHE_DIR = getenv('MODEL_ROUTER_TOKEN_CACHE_DIR', str(BASE_DIR / 'tiktoken_cache'))
+MODEL_ROUTER_TOKEN_OFFLINE = getenv('MODEL_ROUTER_TOKEN_OFFLINE', 'False') == 'True'
+
+# Request hedging (backend.hedging). Opt-in: a call with no first token
+# after the HEDGE_PERCENTILE of recent first-token latencies (or the default
+# delay, until HEDGE_MIN_SAMPLES are in) is duplicated, within a budget of
+# HEDGE_BUDGET extra requests per call per model and window (seconds)
+HEDGE_ENABLED = getenv('HEDGE_ENABLED', 'False') == 'True'
+HEDGE_PERCENTILE = float(getenv('HEDGE_PERCENTILE', '95'))
+HEDGE_DEFAULT_DELAY = float(getenv('HEDGE_DEFAULT_DELAY', '2'))
+HEDGE_MIN_DELAY = float(getenv('HEDGE_MIN_DELAY', '0.25'))
+HEDGE_MIN_SAMPLES = int(getenv('HEDGE_MIN_SAMPLES', '20'))
+HEDGE_SAMPLE_SIZE = int(getenv('HEDGE_SAMPLE_SIZE', '200'))
+HEDGE_SAMPLES_TTL = int(getenv('HEDGE_SAMPLES_TTL', '3600'))
+HEDGE_BUDGET = float(getenv('HEDGE_BUDGET', '0.05'))
+HEDGE_BUDGET_WINDOW = int(getenv('HEDGE_BUDGET_WINDOW', '60'))
+
+# Worker warm-up (backend.warmup). With WARM_UP_OPENAI, each worker opens
+# its OpenAI connections on boot (one models.list call, bounded by the timeout)
+WARM_UP_OPENAI = getenv('WARM_UP_OPENAI', 'True') == 'True'
+WARM_UP_TIMEOUT = float(getenv('WARM_UP_TIMEOUT', '5'))
+
+# Thread archival (backend.archive): threads inactive or idle for this many
+# days are moved to the 'archive' storage by the archive_*_threads commands
+ARCHIVE_AFTER_DAYS = int(getenv('ARCHIVE_AFTER_DAYS', '180'))
+# Seconds an archive run holds its claim on a thread while writing the blob
+ARCHIVE_CLAIM_TIMEOUT = int(getenv('ARCHIVE_CLAIM_TIMEOUT', '3600'))
+
+# Streaming exports (exports.streaming): rows fetched per database round trip
+EXPORT_CHUNK_SIZE = int(getenv('EXPORT_CHUNK_SIZE', '2000'))
+
+# Bulk imports (exports.importing): messages written per bulk_create and transaction
+IMPORT_BATCH_SIZE = int(getenv('IMPORT_BATCH_SIZE', '1000'))
+
+# Semantic search over past conversations (search.semantic); embeddings come
+# from RAG_EMBEDDINGS
+SEMANTIC_INDEX_PATH = getenv('SEMANTIC_INDEX_PATH', str(BASE_DIR / 'semantic_index'))
+SEMANTIC_INDEX_BATCH_SIZE = int(getenv('SEMANTIC_INDEX_BATCH_SIZE', '256'))
+SEMANTIC_MAX_TEXT_LENGTH = int(getenv('SEMANTIC_MAX_TEXT_LENGTH', '4000'))
+SEMANTIC_SEARCH_BLOCK_SIZE = int(getenv('SEMANTIC_SEARCH_BLOCK_SIZE', '65536'))
+SEMANTIC_ANN_THRESHOLD = int(getenv('SEMANTIC_ANN_THRESHOLD', '50000'))
+SEMANTIC_ANN_CACHE_SIZE = int(getenv('SEMANTIC_ANN_CACHE_SIZE', '8'))
+
 
 
 
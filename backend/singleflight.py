@@ -0,0 +1,119 @@
+"""
+Single-flight request coalescing.
+
+When many callers ask for the same thing at once (a cached value has just
+expired, or a popular thread is opened in many tabs), single_flight() lets
+one of them do the work and hands its result to the others. Within a
+process, concurrent callers of a key wait for the first one. Across
+processes (``shared=True``, meant for slow upstream calls), the first caller
+takes a lock in the shared cache; callers in other processes flag that they
+are waiting on it, and the result is published for them only then. A result
+is never handed to a caller that arrived after the flight ended. Cheap
+database-backed reads pass ``shared=False`` and coalesce within the process
+only, without touching the cache.
+
+read_through() puts a cache in front of it, so an expired entry is reloaded
+once rather than by every caller that missed it.
+"""
+import threading
+import time
+import uuid
+from typing import Callable, TypeVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+T = TypeVar('T')
+
+_lock = threading.Lock()
+_calls = {}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def _run_shared(key: str, function: Callable[[], T]) -> T:
+    """Run function once across processes, through a lock in the shared cache"""
+    lock_key = f'single-flight:{key}'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_LOCK_TIMEOUT
+    while True:
+        if cache.add(lock_key, token, settings.SINGLE_FLIGHT_LOCK_TIMEOUT):
+            try:
+                value = function()
+                if cache.get(f'{lock_key}:{token}:waiting'):
+                    cache.set(f'{lock_key}:{token}', (value,), settings.SINGLE_FLIGHT_RESULT_TTL)
+                return value
+            finally:
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+
+        # Wait for the flight in progress to publish its result
+        flight = cache.get(lock_key)
+        if flight is not None:
+            cache.set(f'{lock_key}:{flight}:waiting', 1, settings.SINGLE_FLIGHT_LOCK_TIMEOUT)
+        while flight is not None:
+            shared = cache.get(f'{lock_key}:{flight}')
+            if shared is not None:
+                return shared[0]
+            if cache.get(lock_key) != flight:
+                # It failed, or finished just now (before seeing our flag)
+                shared = cache.get(f'{lock_key}:{flight}')
+                if shared is not None:
+                    return shared[0]
+                break
+            if time.monotonic() > deadline:
+                return function()
+            time.sleep(settings.SINGLE_FLIGHT_POLL)
+
+
+def single_flight(key: str, function: Callable[[], T], shared: bool = True) -> T:
+    """
+    Return function(), sharing one execution among the concurrent callers
+    of key, across processes too when shared. The key must identify
+    everything the result depends on. Errors reach every caller waiting in
+    this process; callers in other processes try again themselves.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    try:
+        call.value = _run_shared(key, function) if shared else function()
+        return call.value
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            del _calls[key]
+        call.done.set()
+
+
+def read_through(key: str, function: Callable[[], T], timeout: float) -> T:
+    """Cached function() for timeout seconds, reloaded by a single caller when it expires"""
+    cached = cache.get(key)
+    if cached is not None:
+        return cached[0]
+
+    def load():
+        # Another flight may have filled it while this one waited
+        cached = cache.get(key)
+        if cached is not None:
+            return cached[0]
+        value = function()
+        cache.set(key, (value,), timeout)
+        return value
+
+    return single_flight(key, load)
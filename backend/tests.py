@@ -0,0 +1,530 @@
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from asgiref.testing import ApplicationCommunicator
+from asgiref.sync import async_to_sync
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import prefork
+from .middleware import uses_full_stack
+from .idempotency import IdempotencyMixin
+from .throttling import ConcurrencyLimitMixin
+from .locks import TicketLock, TurnQueueTimeout, thread_turn
+from .singleflight import _run_shared, read_through, single_flight
+from .hedging import hedge_delay, hedged_iter, note_call, record_latency, try_spend
+from .parsers import ORJSONParser
+from .pubsub import get_broker
+from .warmup import WarmUp
+from .renderers import ORJSONRenderer
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    def test_matches_stdlib_renderer(self):
+        """Test that orjson output is identical to DRF's JSONRenderer"""
+        data = {
+            'timestamp': datetime(2025, 3, 22, 14, 51, 7, 123456, tzinfo=dt_timezone.utc),
+            'metadata': {'temperature': 0.7, 'tags': ['a', 'ü'], 'nested': {'n': None}},
+            'amount': Decimal('1.50'),
+            'separator': 'line\u2028break',
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_indented_output_falls_back(self):
+        """Test that the browsable API's indented output still works"""
+        data = {'a': [1, 2]}
+        self.assertEqual(
+            ORJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4')
+        )
+
+    def test_none_renders_empty(self):
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+
+class ORJSONParserTests(SimpleTestCase):
+    def test_parse(self):
+        data = ORJSONParser().parse(io.BytesIO('{"content": "héllo", "metadata": {}}'.encode()))
+        self.assertEqual(data, {'content': 'héllo', 'metadata': {}})
+
+    def test_invalid_json(self):
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(io.BytesIO(b'{"content": '))
+
+
+class StartupTests(SimpleTestCase):
+    def test_sdks_not_imported_at_startup(self):
+        """Test that booting a worker does not load the OpenAI or LangChain SDKs"""
+        script = (
+            'import sys; from backend.wsgi import application; import backend.urls; '
+            'print(" ".join(m for m in ("openai", "langchain_core", "langchain_openai", "chromadb") '
+            'if m in sys.modules))'
+        )
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'backend.settings'}
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env,
+            capture_output=True, text=True, check=True
+        )
+        self.assertEqual(result.stdout.strip(), '')
+
+
+class PreforkTests(SimpleTestCase):
+    def test_reset_after_fork_drops_clients(self):
+        """Test that a new worker builds its own clients instead of the master's"""
+        broker = get_broker()
+        # Leave the test database connection alone
+        with patch.object(prefork, 'connections') as connections:
+            connection = MagicMock()
+            connections.all.return_value = [connection]
+            prefork.reset_after_fork()
+        self.assertIsNot(get_broker(), broker)
+        self.assertIsNone(connection.connection)
+
+    def test_memory_usage(self):
+        usage = prefork.memory_usage()
+        if not usage:
+            self.skipTest("/proc is not available")
+        self.assertGreater(usage['rss'], 0)
+        self.assertLessEqual(usage['private'], usage['rss'])
+
+
+@override_settings(HEDGE_DEFAULT_DELAY=0.05, HEDGE_BUDGET=1)
+class HedgingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+        self.closed = []
+
+    def start(self, stall=0.3):
+        """A call whose first attempt stalls before answering"""
+        attempt = len(self.calls)
+        self.calls.append(attempt)
+
+        def items():
+            try:
+                if attempt == 0:
+                    time.sleep(stall)
+                yield f'{attempt}a'
+                yield f'{attempt}b'
+            finally:
+                self.closed.append(attempt)
+        return items()
+
+    def test_late_first_item_is_hedged(self):
+        """Test that a stalled call is duplicated and the faster attempt wins"""
+        self.assertEqual(list(hedged_iter(self.start, 'model')), ['1a', '1b'])
+        self.assertEqual(self.calls, [0, 1])
+        # The loser is closed once it wakes up
+        time.sleep(0.5)
+        self.assertEqual(sorted(self.closed), [0, 1])
+
+    def test_fast_call_is_not_hedged(self):
+        self.assertEqual(list(hedged_iter(lambda: self.start(stall=0), 'model')), ['0a', '0b'])
+        self.assertEqual(self.calls, [0])
+
+    @override_settings(HEDGE_BUDGET=0)
+    def test_budget_caps_duplicates(self):
+        """Test that no duplicate is sent once the model's budget is spent"""
+        self.assertEqual(list(hedged_iter(lambda: self.start(stall=0.2), 'model')), ['0a', '0b'])
+        self.assertEqual(self.calls, [0])
+
+    @override_settings(HEDGE_BUDGET=0.1)
+    def test_budget_holds_under_concurrency(self):
+        """Test that concurrent callers cannot spend more than the budget between them"""
+        for n in range(10):
+            note_call('model')
+        spent = []
+        threads = [threading.Thread(target=lambda: spent.append(try_spend('model'))) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(spent.count(True), 1)
+
+    def test_errors_are_raised(self):
+        def failing():
+            raise TimeoutError('upstream')
+            yield
+
+        with self.assertRaises(TimeoutError):
+            list(hedged_iter(failing, 'model'))
+
+    @override_settings(HEDGE_MIN_SAMPLES=10, HEDGE_PERCENTILE=90, HEDGE_MIN_DELAY=0.1)
+    def test_delay_follows_percentile(self):
+        """Test that the delay is the configured percentile of recent latencies"""
+        for n in range(9):
+            record_latency('model', 5)
+        self.assertEqual(hedge_delay('model'), 0.05)
+        cache.clear()
+        for n in range(1, 101):
+            record_latency('model', n / 100)
+        self.assertEqual(hedge_delay('model'), 0.91)
+        self.assertEqual(hedge_delay('other'), 0.05)
+
+
+class WarmUpTests(SimpleTestCase):
+    def setUp(self):
+        self.database_up = False
+        self.release = threading.Event()
+
+    def connect(self):
+        self.release.wait(5)
+        if not self.database_up:
+            raise ConnectionError("database unavailable")
+
+    def make_warmup(self):
+        return WarmUp(
+            shared_steps=[('urls', lambda: None, True), ('tokenizer', self.fail_optional, False)],
+            worker_steps=[('database', self.connect, True)]
+        )
+
+    def fail_optional(self):
+        raise RuntimeError("no encoding")
+
+    def test_ready_once_required_steps_succeed(self):
+        """Test that failed required steps keep a worker unready until a retry succeeds"""
+        self.release.set()
+        warmup = self.make_warmup()
+        self.assertFalse(warmup.run())
+        self.assertEqual(warmup.status()['steps']['database']['ok'], False)
+
+        self.database_up = True
+        self.assertTrue(warmup.run())
+        # An optional step does not hold readiness back
+        self.assertEqual(warmup.status()['steps']['tokenizer']['ok'], False)
+
+    def test_readiness_probe(self):
+        """Test that /readyz is 503 until warm-up, which the probe starts, has finished"""
+        self.database_up = True
+        warmup = self.make_warmup()
+        with patch('backend.health.warmup', warmup):
+            response = self.client.get(reverse('readyz'))
+            self.assertEqual(response.status_code, 503)
+            self.assertFalse(response.json()['ready'])
+
+            self.release.set()
+            warmup.thread.join(5)
+            response = self.client.get(reverse('readyz'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(set(response.json()['steps']), {'urls', 'tokenizer', 'database'})
+
+    def test_liveness_probe(self):
+        response = self.client.get(reverse('healthz'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'ok'})
+
+    def test_asgi_lifespan_warms_up(self):
+        """Test that the ASGI application warms up before completing startup"""
+        from backend.asgi import application
+
+        async def startup():
+            communicator = ApplicationCommunicator(application, {'type': 'lifespan'})
+            await communicator.send_input({'type': 'lifespan.startup'})
+            started = await communicator.receive_output(5)
+            await communicator.send_input({'type': 'lifespan.shutdown'})
+            stopped = await communicator.receive_output(5)
+            return started, stopped
+
+        with patch('backend.asgi.warmup') as warmup:
+            started, stopped = async_to_sync(startup)()
+        warmup.run.assert_called_once_with()
+        self.assertEqual(started, {'type': 'lifespan.startup.complete'})
+        self.assertEqual(stopped, {'type': 'lifespan.shutdown.complete'})
+
+
+class RouteMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='test@example.com', password='testpass123', first_name='Test', last_name='User'
+        )
+
+    def test_paths(self):
+        self.assertFalse(uses_full_stack('/api/langchain/threads/'))
+        self.assertFalse(uses_full_stack('/api/jwt/create/'))
+        self.assertTrue(uses_full_stack('/api/o/google-oauth2/'))
+        self.assertTrue(uses_full_stack('/admin/login/'))
+        self.assertTrue(uses_full_stack('/healthz'))
+
+    def test_api_skips_session_middleware(self):
+        """Test that a JWT-authenticated API request runs without the session-based middleware"""
+        token = str(AccessToken.for_user(self.user))
+        response = self.client.get(reverse('langchain-chat-list'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(hasattr(response.wsgi_request, 'session'))
+        self.assertFalse(hasattr(response.wsgi_request, '_messages'))
+        self.assertEqual(response.wsgi_request.user, self.user)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+    def test_admin_keeps_full_stack(self):
+        response = self.client.get('/admin/login/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(hasattr(response.wsgi_request, 'session'))
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+        self.user.is_staff = True
+        self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.get('/admin/')
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(TURN_QUEUE_POLL=0.005)
+class TurnQueueTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def queue_turns(self, count, key='thread'):
+        """Start count turns one after the other, each taking its ticket before the next starts"""
+        order = []
+        threads = []
+        for n in range(count):
+            def turn(n=n):
+                with thread_turn('test', key):
+                    order.append(n)
+                    time.sleep(0.01)
+                    order.append(n)
+            threads.append(threading.Thread(target=turn))
+            threads[-1].start()
+            while cache.get(f'turn-queue:test:{key}:next') != n + 2:
+                time.sleep(0.001)
+        return order, threads
+
+    def test_turns_run_in_arrival_order(self):
+        with thread_turn('test', 'thread'):
+            order, threads = self.queue_turns(4)
+            time.sleep(0.05)
+            self.assertEqual(order, [])
+        for thread in threads:
+            thread.join(5)
+        # One at a time, first come first served
+        self.assertEqual(order, [0, 0, 1, 1, 2, 2, 3, 3])
+
+    def test_other_threads_are_not_blocked(self):
+        with thread_turn('test', 'busy'):
+            with thread_turn('test', 'other'):
+                pass
+
+    def test_timeout_skips_abandoned_ticket(self):
+        first = TicketLock('test:thread')
+        first.acquire()
+        with self.assertRaises(TurnQueueTimeout):
+            TicketLock('test:thread', timeout=0.02).acquire()
+        third = TicketLock('test:thread', timeout=1)
+        threading.Timer(0.02, first.release).start()
+        start = time.monotonic()
+        third.acquire()
+        self.assertLess(time.monotonic() - start, 0.5)
+        third.release()
+
+    def test_dead_holder_is_skipped_after_lease(self):
+        # Acquired by a worker that died without releasing
+        TicketLock('test:thread', lease=0.05).acquire()
+        lock = TicketLock('test:thread', lease=0.05, timeout=1, grace=0.01)
+        start = time.monotonic()
+        lock.acquire()
+        self.assertGreater(time.monotonic() - start, 0.04)
+        lock.release()
+
+    def test_waiters_behind_dead_holder_all_get_their_turn(self):
+        TicketLock('test:thread', lease=0.05).acquire()
+        served = []
+
+        def wait():
+            lock = TicketLock('test:thread', lease=0.05, timeout=0.5, grace=0.01)
+            lock.acquire()
+            served.append(lock.ticket)
+            lock.release()
+
+        threads = [threading.Thread(target=wait) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(sorted(served), [2, 3, 4, 5])
+
+    @override_settings(TURN_QUEUE_LEASE=0.05, TURN_QUEUE_GRACE=0.01)
+    def test_lease_is_renewed_while_the_turn_runs(self):
+        with thread_turn('test', 'thread'):
+            time.sleep(0.2)
+            with self.assertRaises(TurnQueueTimeout):
+                TicketLock('test:thread', timeout=0.1).acquire()
+        lock = TicketLock('test:thread', timeout=0.5)
+        lock.acquire()
+        lock.release()
+
+
+class CountingView(IdempotencyMixin, ConcurrencyLimitMixin, APIView):
+    idempotency_scope = 'test'
+    concurrency_scope = 'test'
+    calls = 0
+
+    def post(self, request):
+        CountingView.calls += 1
+        time.sleep(0.05)
+        return Response({'call': CountingView.calls})
+
+
+@override_settings(IDEMPOTENCY_POLL=0.005)
+class IdempotencyTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        CountingView.calls = 0
+        self.user = MagicMock(pk=1, is_authenticated=True)
+
+    def post(self, key, data=None):
+        request = APIRequestFactory().post('/test/', data or {'content': 'Hi'}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        force_authenticate(request, self.user)
+        return CountingView.as_view()(request)
+
+    @override_settings(CHAT_MAX_CONCURRENT_REQUESTS=1)
+    def test_in_flight_duplicate_waits_for_original(self):
+        # Retries wait before taking a concurrency slot, so they are not refused
+        responses = []
+        threads = [threading.Thread(target=lambda: responses.append(self.post('key'))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(CountingView.calls, 1)
+        self.assertEqual([response.data for response in responses], [{'call': 1}] * 3)
+        self.assertEqual(sum(response.has_header('Idempotent-Replayed') for response in responses), 2)
+
+    @override_settings(IDEMPOTENCY_RUNNING_TIMEOUT=0.02)
+    def test_claim_is_renewed_while_running(self):
+        original = threading.Thread(target=self.post, args=('key',))
+        original.start()
+        while CountingView.calls == 0:
+            time.sleep(0.001)
+        response = self.post('key')
+        original.join(5)
+        self.assertEqual(CountingView.calls, 1)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.01)
+    def test_gives_up_waiting(self):
+        original = threading.Thread(target=self.post, args=('key',))
+        original.start()
+        while CountingView.calls == 0:
+            time.sleep(0.001)
+        response = self.post('key')
+        original.join(5)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(CountingView.calls, 1)
+
+    def test_without_key(self):
+        self.post('')
+        self.post('')
+        self.assertEqual(CountingView.calls, 2)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def run_concurrently(self, count, function):
+        results = []
+
+        def call():
+            try:
+                results.append(function())
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_concurrent_calls_share_one_execution(self):
+        calls = []
+
+        def load():
+            calls.append(1)
+            time.sleep(0.05)
+            return {'value': len(calls)}
+
+        results = self.run_concurrently(5, lambda: single_flight('key', load))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'value': 1}] * 5)
+        # Nothing is cached: a later call runs again
+        self.assertEqual(single_flight('key', load), {'value': 2})
+
+    def test_errors_reach_every_waiter(self):
+        def fail():
+            time.sleep(0.05)
+            raise ValueError("upstream down")
+
+        results = self.run_concurrently(3, lambda: single_flight('key', fail))
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    @override_settings(SINGLE_FLIGHT_POLL=0.005)
+    def test_waits_for_flight_in_another_process(self):
+        # Another process is loading the key
+        cache.set('single-flight:key', 'other')
+        threading.Timer(0.05, lambda: (
+            cache.set('single-flight:key:other', ('shared',)), cache.delete('single-flight:key')
+        )).start()
+        self.assertEqual(single_flight('key', lambda: 'own'), 'shared')
+
+        # A finished flight's result is not handed to later callers
+        self.assertEqual(single_flight('key', lambda: 'own'), 'own')
+
+    def test_result_is_published_only_for_waiters(self):
+        with patch.object(cache, 'set') as cache_set:
+            self.assertEqual(single_flight('key', lambda: 'value'), 'value')
+        cache_set.assert_not_called()
+
+    def test_local_flights_skip_the_cache(self):
+        with patch.object(cache, 'add') as cache_add:
+            self.assertEqual(single_flight('key', lambda: 'value', shared=False), 'value')
+        cache_add.assert_not_called()
+
+    @override_settings(SINGLE_FLIGHT_POLL=0.005)
+    def test_leader_publishes_for_waiting_process(self):
+        calls = []
+
+        def load():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'shared'
+
+        leader = threading.Thread(target=single_flight, args=('key', load))
+        leader.start()
+        while not cache.get('single-flight:key'):
+            time.sleep(0.001)
+        # A caller in another process only shares the cache
+        self.assertEqual(_run_shared('key', load), 'shared')
+        leader.join(5)
+        self.assertEqual(len(calls), 1)
+
+    def test_read_through(self):
+        calls = []
+
+        def load():
+            calls.append(1)
+            time.sleep(0.05)
+            return None
+
+        results = self.run_concurrently(5, lambda: read_through('cached', load, 60))
+        self.assertEqual(results, [None] * 5)
+        self.assertIsNone(read_through('cached', load, 60))
+        self.assertEqual(len(calls), 1)
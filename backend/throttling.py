@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import UserRateThrottle
+
+
+class ChatMessageRateThrottle(UserRateThrottle):
+    """Per-user rate limit for sending messages to OpenAI assistant threads"""
+    scope = 'chat_message'
+
+
+class LangChainMessageRateThrottle(UserRateThrottle):
+    """Per-user rate limit for sending messages to LangChain threads"""
+    scope = 'langchain_message'
+
+
+def acquire_concurrency_slot(scope, user_id):
+    """
+    Take one of the user's CHAT_MAX_CONCURRENT_REQUESTS slots for scope and
+    return its key, or raise Throttled if they are all in use. Slots are
+    counted in the shared cache so the limit holds across workers, and
+    expire on their own if a worker dies while holding one.
+    """
+    key = f'concurrency:{scope}:{user_id}'
+    timeout = settings.CHAT_CONCURRENCY_SLOT_TIMEOUT
+    cache.add(key, 0, timeout)
+    try:
+        in_flight = cache.incr(key)
+    except ValueError:
+        # The counter expired between add() and incr()
+        cache.add(key, 1, timeout)
+        in_flight = 1
+
+    if in_flight > settings.CHAT_MAX_CONCURRENT_REQUESTS:
+        release_concurrency_slot(key)
+        raise Throttled(
+            wait=settings.CHAT_CONCURRENCY_RETRY_AFTER,
+            detail='Too many requests in progress. Wait for a response before sending another message.'
+        )
+    return key
+
+
+def release_concurrency_slot(key):
+    try:
+        if cache.decr(key) < 0:
+            cache.delete(key)
+    except ValueError:
+        pass
+
+
+class ConcurrencyLimitMixin:
+    """
+    Caps the number of in-flight requests a single user may have open against
+    a view (see acquire_concurrency_slot).
+    """
+    concurrency_scope = None
+    concurrency_methods = ('POST',)
+
+    def get_concurrency_scope(self, request):
+        if request.method in self.concurrency_methods:
+            return self.concurrency_scope
+        return None
+
+    def initial(self, request, *args, **kwargs):
+        self._concurrency_key = None
+        super().initial(request, *args, **kwargs)
+
+        scope = self.get_concurrency_scope(request)
+        if scope is None or not request.user or not request.user.is_authenticated:
+            return
+        self._concurrency_key = acquire_concurrency_slot(scope, request.user.pk)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, '_concurrency_key', None):
+            release_concurrency_slot(self._concurrency_key)
+            self._concurrency_key = None
+        return super().finalize_response(request, response, *args, **kwargs)
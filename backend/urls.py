@@ -1,10 +1,16 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from .health import healthz, readyz
+
 urlpatterns = [
+    path('healthz', healthz, name='healthz'),
+    path('readyz', readyz, name='readyz'),
     path('admin/', admin.site.urls),
     path('api/', include('djoser.urls')),
     path('api/', include('users.urls')),
     path('api/chat/', include('chat.urls')),
     path('api/langchain/', include('langchain_chat.urls')),
+    path('api/search/', include('search.urls')),
+    path('api/', include('exports.urls')),
 ]
@@ -0,0 +1,148 @@
+"""
+Worker warm-up and readiness.
+
+A new worker otherwise pays on its first requests for lazy initialisation:
+the URLconf and views, the OpenAI and LangChain SDKs, the conversation
+chain and default prompt, the tiktoken encoding, and the first database
+connection and TLS handshake. warmup.run() does all of it up front, and
+/readyz (backend.health) reports ready only once every required step has
+succeeded, so load balancers never send traffic to a cold worker.
+
+Shared steps build connection-free objects and may run in a preforking
+master (run_shared); the rest open connections and must run in each
+worker. gunicorn.conf.py runs them before a worker accepts requests, the
+ASGI application on lifespan startup, and anything else on the first
+readiness probe.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def load_urls():
+    from django.urls import get_resolver
+    get_resolver().reverse_dict
+
+
+def load_templates():
+    from django.template import engines
+    from django.utils import translation
+    engines.all()
+    translation.activate(settings.LANGUAGE_CODE)
+    translation.deactivate()
+
+
+def load_sdks():
+    import langchain_openai  # noqa: F401
+    import openai  # noqa: F401
+
+
+def build_chain():
+    from langchain_chat.chains import get_conversation_chain
+    from langchain_chat.prompts import DEFAULT_SYSTEM_PROMPT, compile_prompt
+    get_conversation_chain()
+    compile_prompt(DEFAULT_SYSTEM_PROMPT)
+
+
+def load_tokenizer():
+    from langchain_chat.routing import get_encoding
+    if get_encoding() is None:
+        raise RuntimeError("tiktoken encoding unavailable, token counts are estimated")
+
+
+def connect_database():
+    from django.db import connection
+    connection.ensure_connection()
+
+
+def connect_openai():
+    """Open the HTTP connections of the OpenAI clients, TLS handshake included"""
+    if not settings.WARM_UP_OPENAI:
+        return
+    from chat.services import get_client
+    from langchain_chat.chains import get_llm
+    # Each chat model has its own connection pool
+    clients = [get_client()] + [
+        get_llm(model['name'], settings.OPENAI_API_KEY).root_client for model in settings.MODEL_ROUTER_MODELS
+    ]
+    for client in clients:
+        client.with_options(timeout=settings.WARM_UP_TIMEOUT, max_retries=0).models.list()
+
+
+# (name, function, required): a worker is ready once the required steps succeed.
+# Offline, the tokenizer can only come from the image, so its absence is a
+# broken build rather than a download still to happen
+SHARED_STEPS = [
+    ('urls', load_urls, True),
+    ('templates', load_templates, True),
+    ('sdks', load_sdks, True),
+    ('chain', build_chain, True),
+    ('tokenizer', load_tokenizer, settings.MODEL_ROUTER_TOKEN_OFFLINE),
+]
+WORKER_STEPS = [
+    ('database', connect_database, True),
+    ('openai', connect_openai, False),
+]
+
+
+class WarmUp:
+    def __init__(self, shared_steps=None, worker_steps=None):
+        self.shared_steps = SHARED_STEPS if shared_steps is None else shared_steps
+        self.worker_steps = WORKER_STEPS if worker_steps is None else worker_steps
+        self.lock = threading.Lock()
+        self.thread = None
+        self.ready = False
+        self.results = {}
+
+    def _run_steps(self, steps):
+        for name, function, required in steps:
+            if self.results.get(name, {}).get('ok'):
+                continue
+            start = time.monotonic()
+            try:
+                function()
+                ok = True
+            except Exception as e:
+                ok = False
+                log = logger.error if required else logger.warning
+                log("Warm-up step %s failed: %s", name, e)
+            self.results[name] = {'ok': ok, 'required': required, 'seconds': round(time.monotonic() - start, 3)}
+
+    def run_shared(self):
+        """Run the steps that are safe before a fork"""
+        with self.lock:
+            self._run_steps(self.shared_steps)
+
+    def run(self) -> bool:
+        """Run every step not yet done; failed steps are retried on the next run"""
+        with self.lock:
+            self._run_steps(self.shared_steps + self.worker_steps)
+            self.ready = all(result['ok'] for result in self.results.values() if result['required'])
+        logger.info("Warm-up finished, ready=%s: %s", self.ready, self.results)
+        return self.ready
+
+    def start(self):
+        """Run in a background thread, unless already ready or running"""
+        with self.lock:
+            if self.ready or (self.thread is not None and self.thread.is_alive()):
+                return
+            self.thread = threading.Thread(target=self._run_in_background, name='warm-up', daemon=True)
+            self.thread.start()
+
+    def _run_in_background(self):
+        from django.db import connections
+        try:
+            self.run()
+        finally:
+            # The connection checked was this thread's own
+            connections.close_all()
+
+    def status(self):
+        return {'ready': self.ready, 'steps': {name: dict(result) for name, result in self.results.items()}}
+
+
+warmup = WarmUp()
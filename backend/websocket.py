@@ -0,0 +1,258 @@
+import asyncio
+import json
+import re
+import threading
+from http.cookies import SimpleCookie
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http.request import validate_host
+from rest_framework.exceptions import Throttled
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .pubsub import get_broker, thread_channel
+from .throttling import acquire_concurrency_slot, release_concurrency_slot
+
+
+def get_scope_token(scope):
+    """Raw JWT from the ``token`` query parameter or the auth cookie"""
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if query.get('token'):
+        return query['token'][0]
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookie = SimpleCookie()
+            cookie.load(value.decode('latin-1'))
+            if settings.AUTH_COOKIE in cookie:
+                return cookie[settings.AUTH_COOKIE].value
+    return None
+
+
+def origin_allowed(scope):
+    """
+    Whether a handshake's Origin may open the socket: one of
+    CORS_ALLOWED_ORIGINS or a host in ALLOWED_HOSTS. Browsers send the auth
+    cookie on cross-site handshakes and WebSockets are not subject to CORS,
+    so this is what stops other sites from using a visitor's session.
+    Clients that send no Origin (not browsers) are allowed.
+    """
+    for name, value in scope.get('headers', []):
+        if name == b'origin':
+            origin = value.decode('latin-1')
+            if origin in settings.CORS_ALLOWED_ORIGINS:
+                return True
+            host = urlsplit(origin).hostname
+            return bool(host) and validate_host(host, settings.ALLOWED_HOSTS)
+    return True
+
+
+def authenticate_scope(scope):
+    """Resolve the user for a WebSocket handshake, like CustomJWTAuthentication"""
+    raw_token = get_scope_token(scope)
+    if raw_token is None:
+        return None
+    authentication = JWTAuthentication()
+    try:
+        validated_token = authentication.get_validated_token(raw_token)
+        return authentication.get_user(validated_token)
+    except Exception:
+        return None
+    finally:
+        close_old_connections()
+
+
+class ThreadConsumer:
+    """
+    WebSocket consumer for a single conversation thread.
+
+    Client -> server:
+        {"type": "message", "content": "...", ...}
+    Server -> client:
+        {"type": "token", "content": "..."}     while a reply is streaming
+        {"type": "message", "message": {...}}   for every persisted message
+        {"type": "error", "error": "..."}
+
+    Token and message events go through the pub/sub broker, so every tab the
+    user has open on the thread receives them, whichever tab sent the message.
+
+    Messages count against the same rate limits (throttle_classes) and
+    concurrency slots (concurrency_scope) as the HTTP endpoint that sends
+    them, so switching transports does not get around either. With
+    serializer_class set they are validated by it too, and run_turn gets
+    its validated_data.
+
+    Handshakes from an Origin that is not allowed (see origin_allowed) are
+    refused like unauthenticated ones.
+    """
+    channel_kind = None
+    throttle_classes = []
+    concurrency_scope = None
+    serializer_class = None
+
+    def __init__(self, scope, receive, send, thread_id):
+        self.scope = scope
+        self._receive = receive
+        self._send = send
+        self.thread_id = int(thread_id)
+        self.user = None
+        self.thread = None
+        self.connected = False
+        # In-flight turn tasks and their cancel events
+        self.turns = {}
+
+    def get_thread(self, user, thread_id):
+        """Return the user's thread, or None if it does not exist"""
+        raise NotImplementedError
+
+    def run_turn(self, data, on_token, cancel):
+        """
+        Process one user message synchronously; called in a worker thread.
+        cancel (a threading.Event) is set if the client disconnects.
+        """
+        raise NotImplementedError
+
+    @property
+    def channel(self):
+        return thread_channel(self.channel_kind, self.user.pk, self.thread.pk)
+
+    async def __call__(self):
+        subscription = None
+        forwarder = None
+        try:
+            while True:
+                event = await self._receive()
+                if event['type'] == 'websocket.connect':
+                    if not await self.connect():
+                        return
+                    subscription = get_broker().subscribe(self.channel)
+                    forwarder = asyncio.create_task(self.forward(subscription))
+                elif event['type'] == 'websocket.receive':
+                    await self.receive(event.get('text') or event.get('bytes'))
+                elif event['type'] == 'websocket.disconnect':
+                    break
+        finally:
+            self.connected = False
+            await self.disconnect()
+            if subscription is not None:
+                subscription.close()
+            if forwarder is not None:
+                forwarder.cancel()
+
+    async def connect(self):
+        if not origin_allowed(self.scope):
+            await self._send({'type': 'websocket.close', 'code': 4403})
+            return False
+        self.user = await sync_to_async(authenticate_scope)(self.scope)
+        if self.user is not None:
+            self.thread = await sync_to_async(self._get_thread)()
+        if self.thread is None:
+            await self._send({'type': 'websocket.close', 'code': 4403})
+            return False
+        await self._send({'type': 'websocket.accept'})
+        self.connected = True
+        return True
+
+    async def disconnect(self):
+        # With CHAT_CANCEL_ON_DISCONNECT in-flight turns stop generating
+        # and save what they have; either way they are awaited so their
+        # messages are persisted and delivered to the user's other tabs.
+        if settings.CHAT_CANCEL_ON_DISCONNECT:
+            for cancel in self.turns.values():
+                cancel.set()
+        if self.turns:
+            await asyncio.gather(*self.turns, return_exceptions=True)
+
+    async def receive(self, raw):
+        try:
+            data = json.loads(raw)
+        except (TypeError, ValueError):
+            await self.send_json({'type': 'error', 'error': 'Invalid JSON.'})
+            return
+        if not isinstance(data, dict):
+            await self.send_json({'type': 'error', 'error': 'Expected a JSON object.'})
+            return
+        if data.get('type') != 'message' or not data.get('content') or not isinstance(data['content'], str):
+            await self.send_json({'type': 'error', 'error': 'Message content is required.'})
+            return
+        if self.serializer_class is not None:
+            serializer = self.serializer_class(data=data)
+            if not serializer.is_valid():
+                await self.send_json({'type': 'error', 'error': 'Invalid message.', 'errors': serializer.errors})
+                return
+            data = serializer.validated_data
+        try:
+            slot = await sync_to_async(self.check_limits)()
+        except Throttled as e:
+            await self.send_json({'type': 'error', 'error': str(e.detail), 'retry_after': e.wait})
+            return
+        cancel = threading.Event()
+        turn = asyncio.create_task(self.turn(data, cancel, slot))
+        self.turns[turn] = cancel
+        turn.add_done_callback(self._turn_done)
+
+    def check_limits(self):
+        """Apply the rate limits and take a concurrency slot; returns the slot's key, if any"""
+        request = SimpleNamespace(user=self.user)
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not throttle.allow_request(request, self):
+                raise Throttled(wait=throttle.wait())
+        if self.concurrency_scope is None:
+            return None
+        return acquire_concurrency_slot(self.concurrency_scope, self.user.pk)
+
+    def _turn_done(self, turn):
+        self.turns.pop(turn, None)
+
+    async def turn(self, data, cancel, slot=None):
+        broker = get_broker()
+        channel = self.channel
+
+        def on_token(token):
+            broker.publish(channel, {'type': 'token', 'content': token})
+
+        try:
+            await sync_to_async(self._run_turn, thread_sensitive=False)(data, on_token, cancel)
+        except Exception as e:
+            await self.send_json({'type': 'error', 'error': str(e)})
+        finally:
+            if slot is not None:
+                await sync_to_async(release_concurrency_slot)(slot)
+
+    async def forward(self, subscription):
+        while True:
+            await self.send_json(await subscription.get())
+
+    async def send_json(self, data):
+        if self.connected:
+            await self._send({'type': 'websocket.send', 'text': json.dumps(data, default=str)})
+
+    def _get_thread(self):
+        try:
+            return self.get_thread(self.user, self.thread_id)
+        finally:
+            close_old_connections()
+
+    def _run_turn(self, data, on_token, cancel):
+        try:
+            return self.run_turn(data, on_token, cancel)
+        finally:
+            close_old_connections()
+
+
+class WebSocketRouter:
+    """Dispatches WebSocket connections to consumers by path regex"""
+
+    def __init__(self, routes):
+        self.routes = [(re.compile(pattern), consumer) for pattern, consumer in routes]
+
+    async def __call__(self, scope, receive, send):
+        for pattern, consumer_class in self.routes:
+            match = pattern.match(scope['path'])
+            if match:
+                return await consumer_class(scope, receive, send, **match.groupdict())()
+        await receive()
+        await send({'type': 'websocket.close', 'code': 4404})
@@ -0,0 +1,23 @@
+import os
+import sys
+from pathlib import Path
+
+
+def setup_django():
+    """Configure Django for a standalone benchmark run against the local settings"""
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    os.environ.setdefault('DEVELOPMENT_MODE', 'True')
+    os.environ.setdefault('DOMAIN', 'localhost')
+    os.environ.setdefault('REDIRECT_URLS', 'http://localhost:3000')
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-benchmark')
+
+    import django
+    django.setup()
+
+
+def report(name, seconds, count=None):
+    line = f'{name:<48} {seconds * 1000:10.2f} ms'
+    if count:
+        line += f'  ({count / seconds:,.0f} items/s)'
+    print(line)
@@ -0,0 +1,66 @@
+"""
+Import rate of the batched JSONL importer against one create_in_thread()
+call per message (what going through the API amounts to), on a throwaway
+test database. Point DATABASE_URL-style settings at Postgres to measure
+the production path.
+
+    python -m benchmarks.bulk_import [--messages 50000] [--batch-size 1000]
+"""
+import argparse
+import json
+import time
+
+from benchmarks import report, setup_django
+
+
+def make_lines(messages, per_thread=200):
+    for n in range(messages):
+        yield json.dumps({
+            'source': 'langchain',
+            'thread_id': f'thread-{n // per_thread}',
+            'thread_title': f'Thread {n // per_thread}',
+            'message_id': f'message-{n}',
+            'role': 'user' if n % 2 == 0 else 'assistant',
+            'content': f'Message {n} ' + 'lorem ipsum dolor sit amet ' * 8,
+            'timestamp': f'2024-01-01T00:00:00.{n % 1000000:06d}+00:00',
+        }).encode() + b'\n'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--baseline', type=int, default=2000, help='Messages created one at a time')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from exports.importing import ConversationImporter
+    from langchain_chat.models import LangChainMessage, LangChainThread
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        user = get_user_model().objects.create_user(
+            email='bench@example.com', password='x', first_name='B', last_name='U'
+        )
+        lines = list(make_lines(args.messages))
+
+        thread = LangChainThread.objects.create(user=user, title='Baseline')
+        start = time.perf_counter()
+        for n in range(args.baseline):
+            LangChainMessage.objects.create_in_thread(thread, user=user, role='user', content=f'Message {n}')
+        report(f'create_in_thread x {args.baseline}', time.perf_counter() - start, args.baseline)
+
+        stats = ConversationImporter(user, batch_size=args.batch_size).run(lines)
+        report(f'import {args.messages} (batch {args.batch_size})', stats['seconds'], stats['imported'])
+
+        stats = ConversationImporter(user, batch_size=args.batch_size).run(lines)
+        report(f're-run, all {stats["skipped"]} skipped', stats['seconds'], stats['skipped'])
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Per-turn overhead of the conversation chain, with the model replaced by an
+in-process fake: building a verbose ConversationChain (plus ChatOpenAI and
+memory) per request, as LangChainService used to, against the shared LCEL
+runnable. Runs against a throwaway test database.
+
+    python -m benchmarks.conversation_chain [--turns 200] [--history 20]
+"""
+import argparse
+import contextlib
+import io
+import time
+import warnings
+from unittest.mock import patch
+
+from benchmarks import report, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--history', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    warnings.simplefilter('ignore')
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from langchain.chains import ConversationChain
+    from langchain.memory import ConversationBufferMemory
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from langchain_openai import ChatOpenAI
+    from langchain_chat.chains import ThreadMessageHistory, Turn, get_conversation_chain
+    from langchain_chat.models import LangChainMessage, LangChainThread
+    from langchain_chat.prompts import prompt_for_thread
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        user = get_user_model().objects.create_user(
+            email='bench@example.com', password='x', first_name='B', last_name='U'
+        )
+        thread = LangChainThread.objects.create(user=user, title='Bench')
+        for n in range(args.history):
+            LangChainMessage.objects.create_in_thread(
+                thread, user=user, role='user' if n % 2 == 0 else 'assistant', content=f'Message {n}'
+            )
+        fake = FakeListChatModel(responses=['Fine.'])
+        prompt = prompt_for_thread(thread)
+
+        start = time.perf_counter()
+        for _ in range(args.turns):
+            ChatOpenAI(model_name='gpt-3.5-turbo', streaming=True, openai_api_key='sk-benchmark')
+        report('construct ChatOpenAI per turn', time.perf_counter() - start, args.turns)
+
+        history = list(LangChainMessage.objects.filter(thread=thread).order_by('timestamp'))
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(args.turns):
+                memory = ConversationBufferMemory(memory_key='history', return_messages=True)
+                chain = ConversationChain(llm=fake, memory=memory, prompt=prompt, verbose=True)
+                for message in history:
+                    if message.role == 'user':
+                        memory.chat_memory.add_user_message(message.content)
+                    else:
+                        memory.chat_memory.add_ai_message(message.content)
+                chain.predict(input='How are you?')
+        report('ConversationChain per turn (fake model)', time.perf_counter() - start, args.turns)
+
+        start = time.perf_counter()
+        for _ in range(args.turns):
+            history = ThreadMessageHistory(Turn(thread, user.id, prompt))
+            saved = [
+                LangChainMessage.objects.create_in_thread(thread, user=user, role=role, content='x')
+                for role in ['user', 'assistant']
+            ]
+            LangChainMessage.objects.filter(pk__in=[message.pk for message in saved]).delete()
+        report('database work alone (history, two saves)', time.perf_counter() - start, args.turns)
+
+        chain = get_conversation_chain()
+        with patch('langchain_chat.chains.get_llm', return_value=fake):
+            start = time.perf_counter()
+            for _ in range(args.turns):
+                turn = Turn(thread, user.id, prompt)
+                chain.invoke({'input': 'How are you?'}, config=turn.config())
+                # Keep the history length constant
+                LangChainMessage.objects.filter(pk__in=[turn.user_message.pk, turn.reply.pk]).delete()
+        report('shared LCEL chain, incl. DB history (fake)', time.perf_counter() - start, args.turns)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Work wasted on replies nobody is waiting for: a WebSocket client sends a
+message to a LangChain thread and disconnects after --after tokens, with
+CHAT_CANCEL_ON_DISCONNECT off and on. OpenAI is a local stub streaming
+--tokens tokens, one every --interval seconds. Reports the worker-seconds
+spent after the disconnect and the tokens the stub generated after it.
+
+    python -m benchmarks.disconnect [--turns 5] [--tokens 200] [--interval 0.01] [--after 5]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks import setup_django
+
+
+class TokenServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, tokens, interval):
+        super().__init__(('127.0.0.1', 0), TokenHandler)
+        self.tokens = tokens
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.generated = 0
+
+
+class TokenHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        try:
+            for n in range(self.server.tokens):
+                chunk = {
+                    'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'stub',
+                    'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': f' t{n}'}, 'finish_reason': None}],
+                }
+                self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+                self.wfile.flush()
+                with self.server.lock:
+                    self.server.generated += 1
+                time.sleep(self.server.interval)
+            self.wfile.write(b'data: [DONE]\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the response
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--tokens', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.01)
+    parser.add_argument('--after', type=int, default=5)
+    args = parser.parse_args()
+
+    server = TokenServer(args.tokens, args.interval)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}/v1'
+    os.environ['OPENAI_BASE_URL'] = os.environ['OPENAI_API_BASE'] = base_url
+
+    setup_django()
+    from asgiref.sync import async_to_sync
+    from asgiref.testing import ApplicationCommunicator
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from django.test.utils import override_settings
+    from rest_framework_simplejwt.tokens import AccessToken
+    from backend.asgi import application
+    from langchain_chat.models import LangChainMessage, LangChainThread
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    user = get_user_model().objects.create_user(email='bench@example.com', password='x', first_name='B', last_name='U')
+    token = str(AccessToken.for_user(user))
+
+    async def turn(thread):
+        tab = ApplicationCommunicator(application, {
+            'type': 'websocket', 'path': f'/ws/langchain/threads/{thread.id}/',
+            'query_string': f'token={token}'.encode(), 'headers': [],
+        })
+        await tab.send_input({'type': 'websocket.connect'})
+        await tab.receive_output(5)
+        await tab.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'message', 'content': 'Hi'})})
+        received = 0
+        while received < args.after:
+            received += json.loads((await tab.receive_output(30))['text'])['type'] == 'token'
+        generated = server.generated
+        await tab.send_input({'type': 'websocket.disconnect', 'code': 1001})
+        start = time.perf_counter()
+        # The consumer returns once its in-flight turn has finished
+        await tab.wait(60)
+        return time.perf_counter() - start, generated
+
+    try:
+        for name, cancel in [('run to completion', False), ('cancel on disconnect', True)]:
+            worker_seconds = 0.0
+            wasted_tokens = 0
+            with override_settings(CHAT_CANCEL_ON_DISCONNECT=cancel):
+                for _ in range(args.turns):
+                    thread = LangChainThread.objects.create(user=user, title='Bench')
+                    seconds, generated = async_to_sync(turn)(thread)
+                    time.sleep(args.interval * 5)
+                    worker_seconds += seconds
+                    wasted_tokens += server.generated - generated
+            truncated = LangChainMessage.objects.filter(
+                thread__title='Bench', role='assistant', metadata__truncated=True
+            ).count()
+            LangChainThread.objects.all().delete()
+            print(f'{name:<22} {worker_seconds:6.2f} worker-s after disconnect  '
+                  f'{wasted_tokens:5d} tokens generated after it  ({truncated} truncated replies saved)')
+    finally:
+        server.shutdown()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
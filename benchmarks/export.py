@@ -0,0 +1,63 @@
+"""
+Peak Python memory and throughput of streaming exports at growing history
+sizes, against a throwaway test database. Peak memory should stay flat as
+the message count grows.
+
+    python -m benchmarks.export [--sizes 10000 50000 100000]
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks import report, setup_django
+
+
+def seed(thread, user, count, start):
+    from chat.models import ChatHistory
+
+    ChatHistory.objects.bulk_create([
+        ChatHistory(user=user, thread=thread, role='user' if n % 2 else 'assistant',
+                    message=f'Message {n} ' + 'lorem ipsum dolor sit amet ' * 10)
+        for n in range(start, start + count)
+    ], batch_size=5000)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 100000])
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from chat.models import ChatThread
+    from exports.streaming import export_stream
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        user = get_user_model().objects.create_user(
+            email='bench@example.com', password='x', first_name='B', last_name='U'
+        )
+        threads = [ChatThread.objects.create(user=user, title=f'Thread {n}') for n in range(20)]
+        seeded = 0
+        for size in sorted(args.sizes):
+            while seeded < size:
+                step = min(5000, size - seeded)
+                seed(threads[(seeded // 5000) % len(threads)], user, step, seeded)
+                seeded += step
+            for export_format in ['jsonl', 'csv', 'zip']:
+                tracemalloc.start()
+                start = time.perf_counter()
+                written = sum(len(chunk) for chunk in export_stream(export_format, user_id=user.id))
+                seconds = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                report(f'{export_format} {size} messages ({written / 2 ** 20:.0f} MB)', seconds, size)
+                print(f'{"":<4}peak traced memory {peak / 2 ** 20:8.2f} MB')
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
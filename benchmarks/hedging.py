@@ -0,0 +1,121 @@
+"""
+Time to first token through ChatOpenAI against a local stub of the chat
+completions streaming API, with and without request hedging. The stub's
+first-token delay is lognormal around --median seconds, and a --stall-rate
+share of requests stall for an extra --stall seconds.
+
+    python -m benchmarks.hedging [--turns 200] [--median 0.05] [--stall-rate 0.04] [--stall 1]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks import setup_django
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, median, stall_rate, stall, seed):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.median = median
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def first_token_delay(self):
+        with self.lock:
+            self.requests += 1
+            delay = self.median * self.rng.lognormvariate(0, 0.3)
+            if self.rng.random() < self.stall_rate:
+                delay += self.stall
+        return delay
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # models.list, used by warm-up
+        body = b'{"object": "list", "data": []}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        delay = self.server.first_token_delay()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        time.sleep(delay)
+        try:
+            for text in ['Hello', ' there', '!']:
+                chunk = {
+                    'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'stub',
+                    'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': text}, 'finish_reason': None}],
+                }
+                self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+                self.wfile.flush()
+            self.wfile.write(b'data: [DONE]\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # A cancelled hedge
+            pass
+
+
+def percentiles(values):
+    values = sorted(values)
+    return '  '.join(
+        f'p{p} {values[min(len(values) - 1, int(len(values) * p / 100))] * 1000:7.1f} ms' for p in (50, 95, 99)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--median', type=float, default=0.05)
+    parser.add_argument('--stall-rate', type=float, default=0.04)
+    parser.add_argument('--stall', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from django.test.utils import override_settings
+    from langchain_core.messages import HumanMessage
+    from langchain_openai import ChatOpenAI
+    from langchain_chat.chains import HedgedChatModel
+
+    server = StubServer(args.median, args.stall_rate, args.stall, args.seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    llm = ChatOpenAI(
+        model_name='stub', streaming=True, openai_api_key='sk-benchmark',
+        openai_api_base=f'http://127.0.0.1:{server.server_port}/v1', max_retries=0
+    )
+    messages = [HumanMessage(content='Hi')]
+    cache.clear()
+
+    # Hedge after the p95 of observed first tokens, within 10% extra requests
+    with override_settings(HEDGE_MIN_SAMPLES=20, HEDGE_DEFAULT_DELAY=args.median * 4, HEDGE_BUDGET=0.1):
+        for name, model in [('unhedged', llm), ('hedged', HedgedChatModel(model=llm, hedge_key='stub'))]:
+            server.requests = 0
+            first_tokens = []
+            for _ in range(args.turns):
+                start = time.perf_counter()
+                for n, _chunk in enumerate(model.stream(messages)):
+                    if n == 0:
+                        first_tokens.append(time.perf_counter() - start)
+            print(f'{name:<10} {percentiles(first_tokens)}  ({server.requests} requests)')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Client retries of POST /api/chat/messages/ with and without an
+Idempotency-Key. Each message is sent, retried while the first attempt is
+still running (as after a client-side timeout), and retried again once it
+has finished (as after a lost response). OpenAI is the stub Assistants API
+from benchmarks.turn_queue. Reports the assistant runs started and the
+ChatHistory rows written.
+
+    python -m benchmarks.idempotency [--messages 20] [--run 0.05]
+"""
+import argparse
+import threading
+import time
+from unittest.mock import patch
+
+from benchmarks import setup_django
+from benchmarks.turn_queue import StubAssistants
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--run', type=float, default=0.05)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test.utils import override_settings
+    from rest_framework.test import APIClient
+    from rest_framework.throttling import SimpleRateThrottle
+    from chat.models import ChatHistory, ChatThread
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    user = get_user_model().objects.create_user(email='bench@example.com', password='x', first_name='B', last_name='U')
+
+    def post(thread, n, key):
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(user)
+        headers = {'HTTP_IDEMPOTENCY_KEY': f'message-{n}'} if key else {}
+        client.post('/api/chat/messages/', {'thread_id': thread.id, 'message': f'Message {n}'}, **headers)
+
+    try:
+        with override_settings(CHAT_MAX_CONCURRENT_REQUESTS=100, IDEMPOTENCY_POLL=0.005), \
+                patch.dict(SimpleRateThrottle.THROTTLE_RATES, {'chat_message': '10000/min'}):
+            for name, key in [('no key', False), ('Idempotency-Key', True)]:
+                cache.clear()
+                stub = StubAssistants(args.run)
+                thread = ChatThread.objects.create(
+                    user=user, title='Bench', openai_thread_id=f'thread-{key}', openai_assistant_id='asst'
+                )
+                start = time.perf_counter()
+                with patch('chat.services.get_client', return_value=stub):
+                    for n in range(args.messages):
+                        attempts = [threading.Thread(target=post, args=(thread, n, key)) for _ in range(2)]
+                        attempts[0].start()
+                        time.sleep(args.run / 2)
+                        attempts[1].start()
+                        for attempt in attempts:
+                            attempt.join()
+                        post(thread, n, key)
+                elapsed = time.perf_counter() - start
+                rows = ChatHistory.objects.filter(thread=thread).count()
+                print(f'{name:<16} {args.messages} messages x 3 attempts  {stub.runs:3d} runs  '
+                      f'{rows:3d} rows  {elapsed * 1000:8.1f} ms')
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Per-request middleware overhead on a JWT-only API route and on an admin
+route, with Django's session, CSRF, authentication and messages middleware
+on every path and with backend.middleware skipping them under /api/. Both
+routes resolve to a trivial view in this module's URLconf, so the time is
+the handler and middleware alone.
+
+    python -m benchmarks.middleware [--requests 5000] [--repeat 5]
+"""
+import argparse
+import time
+
+from django.http import JsonResponse
+from django.urls import path
+
+from benchmarks import report, setup_django
+
+STOCK = {
+    'backend.middleware.SessionMiddleware': 'django.contrib.sessions.middleware.SessionMiddleware',
+    'backend.middleware.CsrfViewMiddleware': 'django.middleware.csrf.CsrfViewMiddleware',
+    'backend.middleware.AuthenticationMiddleware': 'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'backend.middleware.MessageMiddleware': 'django.contrib.messages.middleware.MessageMiddleware',
+}
+
+
+def ping(request):
+    return JsonResponse({'ok': True})
+
+
+urlpatterns = [
+    path('api/ping/', ping),
+    path('admin/ping/', ping),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.test import RequestFactory
+    from django.test.utils import override_settings
+
+    def start_response(status, headers):
+        assert status.startswith('200'), status
+
+    factory = RequestFactory(SERVER_NAME='localhost', HTTP_COOKIE=f'sessionid=abc; csrftoken={"x" * 32}')
+    stock = [STOCK.get(name, name) for name in settings.MIDDLEWARE]
+    for name, middleware in [('stock', stock), ('routed', settings.MIDDLEWARE)]:
+        with override_settings(MIDDLEWARE=middleware, ROOT_URLCONF=__name__):
+            handler = WSGIHandler()
+            for route in ['/api/ping/', '/admin/ping/']:
+                environ = factory.get(route).environ
+                for _ in range(100):
+                    handler(dict(environ), start_response)
+                # Best of --repeat runs, as the handler itself dominates the noise
+                timings = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    for _ in range(args.requests):
+                        handler(dict(environ), start_response)
+                    timings.append(time.perf_counter() - start)
+                report(f'{name} middleware, {route}', min(timings), args.requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Model routing: the per-turn cost of counting prompt tokens and choosing a
+model, and a simulation of time to first token over a stream of mostly
+short prompts, comparing every turn on the thread's model (gpt-3.5-turbo)
+with routed turns. Midway the small model slows down for a while; the
+router should move off it and come back once its average recovers.
+
+    python -m benchmarks.model_router [--turns 2000] [--seed 1]
+"""
+import argparse
+import random
+import time
+
+from benchmarks import report, setup_django
+
+# Simulated median time to first token (seconds) per model
+LATENCY = {'gpt-4o-mini': 0.35, 'gpt-3.5-turbo': 0.6, 'gpt-4o': 0.9}
+
+
+class Thread:
+    model_name = 'gpt-3.5-turbo'
+    metadata = {}
+
+
+def simulated_latency(rng, model, turn, turns):
+    latency = LATENCY[model] * rng.lognormvariate(0, 0.35)
+    if model == 'gpt-4o-mini' and turns // 3 <= turn < turns // 2:
+        latency *= 15
+    return latency
+
+
+def percentiles(values):
+    values = sorted(values)
+    return {p: values[min(len(values) - 1, int(len(values) * p / 100))] for p in (50, 95, 99)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from langchain_core.messages import HumanMessage, SystemMessage
+    from langchain_chat.routing import ModelRouter, count_tokens, observe_latency
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    # Mostly short chat turns, with the occasional pasted document
+    sizes = [rng.choice([20] * 8 + [400, 4000]) for _ in range(args.turns)]
+    prompts = {
+        size: [SystemMessage(content='You are a helpful AI assistant.'), HumanMessage(content='word ' * size)]
+        for size in set(sizes)
+    }
+    thread = Thread()
+    router = ModelRouter()
+    cache.clear()
+
+    start = time.perf_counter()
+    for size in sizes:
+        router.choose(thread, count_tokens(prompts[size]))
+    report('count tokens and choose a model', time.perf_counter() - start, args.turns)
+
+    fixed = [simulated_latency(rng, 'gpt-3.5-turbo', turn, args.turns) for turn in range(args.turns)]
+    routed, used = [], {}
+    for turn, size in enumerate(sizes):
+        route = router.choose(thread, count_tokens(prompts[size]))
+        latency = simulated_latency(rng, route.model, turn, args.turns)
+        observe_latency(route.model, latency)
+        routed.append(latency)
+        used[route.model] = used.get(route.model, 0) + 1
+
+    for name, latencies in [('thread model', fixed), ('routed', routed)]:
+        print(f'{name:<16}' + '  '.join(f'p{p} {value:6.3f}s' for p, value in percentiles(latencies).items()))
+    print('turns per model:', used)
+
+
+if __name__ == '__main__':
+    main()
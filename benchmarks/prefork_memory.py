@@ -0,0 +1,129 @@
+"""
+Memory of gunicorn workers started with gunicorn.conf.py, without preloading,
+preloaded, and preloaded with gc.freeze(). After --requests requests spread
+over the workers, reports the sum of their PSS (shared pages divided among
+the processes sharing them, so this is their real footprint) and their
+private memory, from /proc. Short runs rarely trigger a full collection in
+a worker, which is what gc.freeze() guards against, so the benchmark also
+forks warmed-up processes and has them run one. Linux only.
+
+    python -m benchmarks.prefork_memory [--workers 4] [--requests 200]
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+VARIANTS = [
+    ('no preload', {'GUNICORN_PRELOAD': 'False'}),
+    ('preload', {'GUNICORN_PRELOAD': 'True', 'GUNICORN_GC_FREEZE': 'False'}),
+    ('preload + gc.freeze', {'GUNICORN_PRELOAD': 'True', 'GUNICORN_GC_FREEZE': 'True'}),
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def measure(name, env, workers, requests):
+    sys.path.insert(0, str(ROOT))
+    from backend.prefork import memory_usage
+
+    port = free_port()
+    env = {
+        **os.environ,
+        'DEVELOPMENT_MODE': 'True',
+        'DOMAIN': 'localhost',
+        'REDIRECT_URLS': 'http://localhost:3000',
+        'OPENAI_API_KEY': 'sk-benchmark',
+        'GUNICORN_BIND': f'127.0.0.1:{port}',
+        'GUNICORN_WORKERS': str(workers),
+        'GUNICORN_MEMORY_LOG_INTERVAL': '0',
+        **env,
+    }
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'backend.wsgi'], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    try:
+        ready = 0
+        for line in server.stderr:
+            ready += 'Worker ready' in line
+            if ready == workers:
+                break
+        for _ in range(requests):
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/admin/login/').read()
+        time.sleep(0.5)
+        usage = [memory_usage(pid) for pid in children(server.pid)]
+        pss = sum(u['pss'] for u in usage) / 1024
+        private = sum(u['private'] for u in usage) / 1024
+        print(f'{name:<24} workers {len(usage)}  PSS {pss:7.1f} MB  private {private:7.1f} MB'
+              f'  ({private / len(usage):.1f} MB/worker)')
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def full_collection_in_child(freeze):
+    """Private memory of a forked child of a warmed-up process, before and after gc.collect()"""
+    import gc
+    from backend import prefork
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        if freeze:
+            prefork.freeze()
+        child = os.fork()
+        if child == 0:
+            before = prefork.memory_usage()['private']
+            gc.collect()
+            after = prefork.memory_usage()['private']
+            os.write(write, f'{before} {after}'.encode())
+            os._exit(0)
+        os.waitpid(child, 0)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    before, after = (int(value) / 1024 for value in os.read(read, 100).split())
+    os.close(read)
+    os.close(write)
+    return before, after
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    for name, env in VARIANTS:
+        measure(name, env, args.workers, args.requests)
+
+    from benchmarks import setup_django
+    setup_django()
+    import gc
+    from backend.warmup import warmup
+    gc.disable()
+    warmup.run_shared()
+    print()
+    for name, freeze in [('gc.collect() in worker', False), ('gc.collect() in worker, frozen', True)]:
+        before, after = full_collection_in_child(freeze)
+        print(f'{name:<32} private {before:6.1f} MB -> {after:6.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
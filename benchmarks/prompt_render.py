@@ -0,0 +1,62 @@
+"""
+Per-turn cost of preparing the conversation prompt: building a template on
+every request (as LangChainService.__init__ used to) against the compiled
+prompt cache, with and without formatting a 20-message history.
+
+    python -m benchmarks.prompt_render [--turns 5000]
+"""
+import argparse
+import time
+
+from benchmarks import report, setup_django
+
+LEGACY_TEMPLATE = """The following is a friendly conversation between a human and an AI. The AI is helpful, creative, clever, and very friendly.
+
+Current conversation:
+{history}
+Human: {input}
+AI:"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_django()
+    from langchain.prompts import PromptTemplate
+    from langchain_core.messages import AIMessage, HumanMessage
+    from langchain_chat import prompts
+    from langchain_chat.models import PromptTemplate as StoredTemplate
+
+    system_prompt = 'You are a helpful AI assistant. ' * 20
+    history = [
+        (HumanMessage if n % 2 == 0 else AIMessage)(content=f'Message {n} about the trip')
+        for n in range(20)
+    ]
+    content_hash = StoredTemplate.compute_hash(system_prompt, prompts.DEFAULT_HUMAN_TEMPLATE)
+
+    start = time.perf_counter()
+    for _ in range(args.turns):
+        PromptTemplate(input_variables=['history', 'input'], template=LEGACY_TEMPLATE)
+    report('build PromptTemplate per turn', time.perf_counter() - start, args.turns)
+
+    start = time.perf_counter()
+    for _ in range(args.turns):
+        prompts._build(system_prompt, prompts.DEFAULT_HUMAN_TEMPLATE)
+    report('build ChatPromptTemplate per turn', time.perf_counter() - start, args.turns)
+
+    start = time.perf_counter()
+    for _ in range(args.turns):
+        prompts.compile_prompt(system_prompt, content_hash=content_hash)
+    report('compiled prompt cache lookup', time.perf_counter() - start, args.turns)
+
+    prompt = prompts.compile_prompt(system_prompt, content_hash=content_hash)
+    start = time.perf_counter()
+    for _ in range(args.turns):
+        prompt.format_messages(history=history, input='Where next?')
+    report('format 20-message history', time.perf_counter() - start, args.turns)
+
+
+if __name__ == '__main__':
+    main()
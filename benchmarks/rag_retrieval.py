@@ -0,0 +1,73 @@
+"""
+Ingestion throughput and retrieval latency of the per-user Chroma store, with
+HashingEmbeddings standing in for a real embedding model.
+
+    python -m benchmarks.rag_retrieval [--chunks 100000] [--queries 200] [--top-k 4]
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks import report, setup_django
+
+WORDS = (
+    'invoice shipment warehouse contract delivery payment refund customer '
+    'supplier order account balance report quarter region product service '
+    'support ticket policy renewal discount schedule budget forecast audit'
+).split()
+
+
+def make_chunk(rng, n):
+    return f'Chunk {n}: ' + ' '.join(rng.choice(WORDS) for _ in range(120))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import override_settings
+    from langchain_chat import retrieval
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as path, override_settings(
+        RAG_CHROMA_PATH=path,
+        RAG_EMBEDDINGS='langchain_chat.retrieval.HashingEmbeddings'
+    ):
+        retrieval.get_chroma_client.cache_clear()
+        retrieval.get_embeddings.cache_clear()
+        collection = retrieval.get_collection(0)
+        embeddings = retrieval.get_embeddings()
+
+        start = time.perf_counter()
+        for offset in range(0, args.chunks, args.batch_size):
+            batch = [make_chunk(rng, n) for n in range(offset, min(offset + args.batch_size, args.chunks))]
+            collection.add(
+                ids=[f'0:{offset + i}' for i in range(len(batch))],
+                embeddings=embeddings.embed_documents(batch),
+                documents=batch,
+                metadatas=[{'document_id': 0, 'name': 'bench', 'chunk': offset + i} for i in range(len(batch))]
+            )
+        report(f'ingest {args.chunks} chunks', time.perf_counter() - start, args.chunks)
+
+        latencies = []
+        for _ in range(args.queries):
+            query = ' '.join(rng.choice(WORDS) for _ in range(8))
+            start = time.perf_counter()
+            retrieval.retrieve(0, query, top_k=args.top_k)
+            latencies.append(time.perf_counter() - start)
+
+        latencies.sort()
+        report('retrieve p50', statistics.median(latencies))
+        report('retrieve p95', latencies[int(len(latencies) * 0.95) - 1])
+        retrieval.get_chroma_client.cache_clear()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Full-text search latency over a large message history, run against a
+throwaway test database of the configured engine (SQLite FTS5 in
+development mode, tsvector/GIN on Postgres).
+
+    python -m benchmarks.search [--messages 200000] [--users 20] [--queries 100]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks import report, setup_django
+
+WORDS = (
+    'invoice shipment warehouse contract delivery payment refund customer '
+    'supplier order account balance report quarter region product service '
+    'support ticket policy renewal discount schedule budget forecast audit '
+    'migration database deploy rollback latency cache queue worker'
+).split()
+# A Zipf-distributed vocabulary, so query terms have realistic selectivity
+VOCABULARY = [f'{word}{n}' if n else word for n in range(150) for word in WORDS]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+
+def seed(count, users, batch_size=5000):
+    from django.contrib.auth import get_user_model
+    from chat.models import ChatHistory, ChatThread
+    from search.indexing import index_messages
+
+    rng = random.Random(0)
+    user_model = get_user_model()
+    accounts = [
+        user_model.objects.create_user(email=f'bench{i}@example.com', password='x', first_name='B', last_name='U')
+        for i in range(users)
+    ]
+    threads = [ChatThread.objects.create(user=user, title='Bench') for user in accounts]
+
+    start = time.perf_counter()
+    for offset in range(0, count, batch_size):
+        messages = ChatHistory.objects.bulk_create([
+            ChatHistory(
+                user=threads[n % users].user,
+                thread=threads[n % users],
+                role='user' if n % 2 else 'assistant',
+                message=' '.join(rng.choices(VOCABULARY, WEIGHTS, k=40)),
+            )
+            for n in range(offset, min(offset + batch_size, count))
+        ])
+        index_messages(messages, batch_size=batch_size)
+    report(f'index {count} messages', time.perf_counter() - start, count)
+    return accounts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=100)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from search.backends import search_messages
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        accounts = seed(args.messages, args.users)
+        rng = random.Random(1)
+        for label, terms in [('1 term', 1), ('2 terms', 2), ('3 terms', 3)]:
+            latencies = []
+            for _ in range(args.queries):
+                query = ' '.join(rng.choices(VOCABULARY[:500], k=terms))
+                results = search_messages(rng.choice(accounts).id, query)
+                start = time.perf_counter()
+                results.count()
+                results[0:20]
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            report(f'search {label} count+page p50', statistics.median(latencies))
+            report(f'search {label} count+page p95', latencies[int(len(latencies) * 0.95) - 1])
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Query latency and on-disk size of one user's semantic index, comparing the
+blocked float16 scan with the hnswlib graph.
+
+    python -m benchmarks.semantic_search [--vectors 200000] [--dimensions 384] [--queries 100]
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks import report, setup_django
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vectors', type=int, default=200000)
+    parser.add_argument('--dimensions', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import override_settings
+    from search.semantic import VectorStore
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as path:
+        store = VectorStore(path, 0, args.dimensions)
+        start = time.perf_counter()
+        for offset in range(0, args.vectors, 10000):
+            size = min(10000, args.vectors - offset)
+            store.append(list(range(offset, offset + size)), rng.standard_normal((size, args.dimensions)))
+        report(f'append {args.vectors} vectors', time.perf_counter() - start, args.vectors)
+        size_mb = store.vectors_path.stat().st_size / 2 ** 20
+        print(f'{"float16 vectors on disk":<48} {size_mb:10.1f} MB (float32 would be {size_mb * 2:.1f} MB)')
+
+        queries = rng.standard_normal((args.queries, args.dimensions))
+        for label, threshold in [('exact scan', args.vectors + 1), ('hnswlib', 1)]:
+            with override_settings(SEMANTIC_ANN_THRESHOLD=threshold):
+                if threshold == 1:
+                    start = time.perf_counter()
+                    store.sync_ann()
+                    report('build hnswlib graph', time.perf_counter() - start, args.vectors)
+                latencies = []
+                for query in queries:
+                    start = time.perf_counter()
+                    store.search(query, args.k)
+                    latencies.append(time.perf_counter() - start)
+            p50, p95 = percentiles(latencies)
+            report(f'{label} k={args.k} p50', p50)
+            report(f'{label} k={args.k} p95', p95)
+
+
+if __name__ == '__main__':
+    main()
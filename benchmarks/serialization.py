@@ -0,0 +1,87 @@
+"""
+Serialization and rendering cost of large message histories.
+
+    python -m benchmarks.serialization [--messages 10000] [--repeat 5]
+"""
+import argparse
+import io
+import timeit
+from datetime import timedelta
+
+from benchmarks import report, setup_django
+
+
+def build_histories(count):
+    from django.utils import timezone
+    from chat.models import ChatHistory
+    from langchain_chat.models import LangChainMessage
+
+    now = timezone.now()
+    chat_messages = [
+        ChatHistory(
+            id=i,
+            message=f'Message {i} ' + 'lorem ipsum dolor sit amet ' * 8,
+            role='user' if i % 2 else 'assistant',
+            timestamp=now + timedelta(seconds=i),
+            openai_message_id=f'msg_{i:024d}',
+        )
+        for i in range(count)
+    ]
+    langchain_messages = [
+        LangChainMessage(
+            id=i,
+            content=f'Message {i} ' + 'lorem ipsum dolor sit amet ' * 8,
+            role='user' if i % 2 else 'assistant',
+            timestamp=now + timedelta(seconds=i),
+            metadata={'temperature': 0.7, 'tokens': i % 512, 'tags': ['a', 'b']},
+        )
+        for i in range(count)
+    ]
+    return chat_messages, langchain_messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+    from backend.parsers import ORJSONParser
+    from backend.renderers import ORJSONRenderer
+    from chat.serializers import ChatHistorySerializer
+    from langchain_chat.serializers import LangChainMessageSerializer
+
+    chat_messages, langchain_messages = build_histories(args.messages)
+    cases = [
+        ('ChatHistorySerializer', ChatHistorySerializer, chat_messages),
+        ('LangChainMessageSerializer', LangChainMessageSerializer, langchain_messages),
+    ]
+
+    for name, serializer_class, instances in cases:
+        def serialize():
+            return serializer_class(instances, many=True).data
+
+        data = serialize()
+        results = [
+            (f'{name} serialize', serialize),
+            (f'{name} render (stdlib json)', lambda: JSONRenderer().render(data)),
+            (f'{name} render (orjson)', lambda: ORJSONRenderer().render(data)),
+        ]
+        for label, func in results:
+            seconds = min(timeit.repeat(func, number=1, repeat=args.repeat))
+            report(label, seconds, args.messages)
+
+        body = JSONRenderer().render(data)
+        for label, parser_class in [('stdlib json', JSONParser), ('orjson', ORJSONParser)]:
+            seconds = min(timeit.repeat(
+                lambda: parser_class().parse(io.BytesIO(body)), number=1, repeat=args.repeat
+            ))
+            report(f'{name} parse ({label})', seconds, args.messages)
+        assert ORJSONRenderer().render(data) == body
+
+
+if __name__ == '__main__':
+    main()
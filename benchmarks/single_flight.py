@@ -0,0 +1,87 @@
+"""
+A burst of concurrent identical reads against a slow upstream: --callers
+threads list the OpenAI assistants on a cold cache, then fetch one thread's
+messages, with each upstream call taking --latency seconds. Compares
+calling the upstream directly with OpenAIAssistantService, which coalesces
+them through backend.singleflight. Reports upstream calls and wall time.
+
+    python -m benchmarks.single_flight [--callers 50] [--latency 0.2]
+"""
+import argparse
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from benchmarks import setup_django
+
+
+class SlowClient:
+    """The read endpoints of the OpenAI client, counting calls"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = 0
+        assistant = SimpleNamespace(
+            id='asst_1', name='Helper', instructions='Help.', model='gpt-4o', tools=[], created_at=0
+        )
+        text = SimpleNamespace(text=SimpleNamespace(value='Hello'))
+        self.assistants = [assistant]
+        self.messages = [SimpleNamespace(id='msg_1', role='user', content=[text], created_at=0)]
+        self.beta = SimpleNamespace(
+            assistants=SimpleNamespace(list=self.list_assistants),
+            threads=SimpleNamespace(messages=SimpleNamespace(list=self.list_messages)),
+        )
+
+    def _call(self, data):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return SimpleNamespace(data=data)
+
+    def list_assistants(self):
+        return self._call(self.assistants)
+
+    def list_messages(self, thread_id):
+        return self._call(self.messages)
+
+
+def burst(callers, function):
+    threads = [threading.Thread(target=function) for _ in range(callers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--callers', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from chat.services import OpenAIAssistantService
+
+    for name, list_assistants, get_messages in [
+        ('direct', lambda client: client.beta.assistants.list(),
+         lambda client: client.beta.threads.messages.list(thread_id='thread_1')),
+        ('single-flight', lambda client: OpenAIAssistantService.list_assistants(),
+         lambda client: OpenAIAssistantService.get_thread_messages('thread_1')),
+    ]:
+        cache.clear()
+        client = SlowClient(args.latency)
+        with patch('chat.services.get_client', return_value=client):
+            for label, call in [('list assistants', list_assistants), ('thread messages', get_messages)]:
+                client.calls = 0
+                seconds = burst(args.callers, lambda: call(client))
+                print(f'{name:<14} {label:<16} {args.callers} callers  {client.calls:3d} upstream calls'
+                      f'  {seconds * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Cold start: wall time of a fresh interpreter loading the WSGI application
+and URLconf (what a worker does before its first request) and of
+``manage.py check``, plus the slowest imports by cumulative time as
+reported by ``python -X importtime``.
+
+    python -m benchmarks.startup [--repeat 5] [--top 15]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+WORKER_BOOT = 'from backend.wsgi import application; import backend.urls'
+
+ENV = {
+    'DJANGO_SETTINGS_MODULE': 'backend.settings',
+    'DEVELOPMENT_MODE': 'True',
+    'DOMAIN': 'localhost',
+    'REDIRECT_URLS': 'http://localhost:3000',
+    'OPENAI_API_KEY': 'sk-benchmark',
+}
+
+
+def run(args, importtime=False):
+    env = {**os.environ, **ENV}
+    flags = ['-X', 'importtime'] if importtime else []
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, *flags, *args], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True
+    )
+    return time.perf_counter() - start, result.stderr
+
+
+def slowest_imports(stderr, top):
+    """Top-level-ish modules by cumulative import time (microseconds)"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    for name, command in [
+        ('worker boot (wsgi + urls)', ['-c', WORKER_BOOT]),
+        ('manage.py check', ['manage.py', 'check']),
+    ]:
+        times = [run(command)[0] for _ in range(args.repeat)]
+        print(f'{name:<48} {statistics.median(times) * 1000:10.2f} ms  (median of {args.repeat})')
+
+    _, stderr = run(['-c', WORKER_BOOT], importtime=True)
+    print(f'\nslowest imports during worker boot (cumulative):')
+    for cumulative, name in slowest_imports(stderr, args.top):
+        print(f'  {cumulative / 1000:8.1f} ms  {name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Latency of creating a chat thread: with the OpenAI threads.create round
+trip inline (how POST /api/chat/threads/ used to work), drawing from the
+pool of pre-created threads, and with an empty pool (the OpenAI thread is
+then created on the first message). OpenAI is a local stub answering
+threads.create after --latency seconds.
+
+    python -m benchmarks.thread_pool [--threads 50] [--latency 0.15]
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks import setup_django
+
+
+class ThreadsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), ThreadsHandler)
+        self.latency = latency
+        self.ids = itertools.count()
+
+
+class ThreadsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.server.latency)
+        body = json.dumps({
+            'id': f'thread_{next(self.server.ids)}', 'object': 'thread', 'created_at': 0, 'metadata': {},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.15)
+    args = parser.parse_args()
+
+    server = ThreadsServer(args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['OPENAI_BASE_URL'] = f'http://127.0.0.1:{server.server_port}/v1'
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from rest_framework.test import APIClient
+    from chat import pool
+    from chat.models import ChatThread
+    from chat.services import OpenAIAssistantService
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    user = get_user_model().objects.create_user(email='bench@example.com', password='x', first_name='B', last_name='U')
+    client = APIClient(SERVER_NAME='localhost')
+    client.force_authenticate(user)
+
+    def inline():
+        ChatThread.objects.create(
+            user=user, title='Bench', openai_assistant_id='asst',
+            openai_thread_id=OpenAIAssistantService.create_thread()
+        )
+
+    def post():
+        response = client.post('/api/chat/threads/', {'title': 'Bench', 'assistant_id': 'asst'})
+        assert response.status_code == 201, response.content
+
+    try:
+        # Connect to the stub once, so no variant pays for it
+        OpenAIAssistantService.create_thread()
+        for name, create, pool_size in [
+            ('remote create inline', inline, 0),
+            ('from the pool', post, args.threads),
+            ('empty pool (lazy)', post, 0),
+        ]:
+            pool.refill(pool_size)
+            timings = []
+            for _ in range(args.threads):
+                start = time.perf_counter()
+                create()
+                timings.append(time.perf_counter() - start)
+            print(f'{name:<22} median {statistics.median(timings) * 1000:7.2f} ms  '
+                  f'max {max(timings) * 1000:7.2f} ms')
+    finally:
+        server.shutdown()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
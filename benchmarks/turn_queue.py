@@ -0,0 +1,110 @@
+"""
+Bursts of messages to the same OpenAI assistant threads, with and without
+the per-thread turn queue (backend.locks.thread_turn). The stub Assistants
+API rejects a message added while a run is active, as OpenAI does; the
+client then retries after --backoff seconds, as the frontend does after an
+error. Reports wasted calls (rejected messages), retries and the time until
+every message is answered.
+
+    python -m benchmarks.turn_queue [--threads 8] [--burst 4] [--run 0.05]
+"""
+import argparse
+import contextlib
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from benchmarks import setup_django
+
+
+class StubAssistants:
+    """The parts of the OpenAI client OpenAIAssistantService uses, with one active run per thread"""
+
+    def __init__(self, run_seconds):
+        self.run_seconds = run_seconds
+        self.lock = threading.Lock()
+        self.active = {}
+        self.rejected = 0
+        self.runs = 0
+        threads = SimpleNamespace(
+            messages=SimpleNamespace(create=self.create_message, list=self.list_messages),
+            runs=SimpleNamespace(create=self.create_run, retrieve=self.retrieve_run),
+        )
+        self.beta = SimpleNamespace(threads=threads)
+
+    def create_message(self, thread_id, role, content):
+        with self.lock:
+            if thread_id in self.active:
+                self.rejected += 1
+                raise RuntimeError(f"Can't add messages to {thread_id} while a run is active.")
+        text = SimpleNamespace(text=SimpleNamespace(value=content))
+        return SimpleNamespace(id='msg', role=role, content=[text])
+
+    def create_run(self, thread_id, assistant_id):
+        with self.lock:
+            if thread_id in self.active:
+                self.rejected += 1
+                raise RuntimeError(f"Thread {thread_id} already has an active run.")
+            self.active[thread_id] = time.monotonic() + self.run_seconds
+            self.runs += 1
+        return SimpleNamespace(id=f'run-{self.runs}', model='stub')
+
+    def retrieve_run(self, thread_id, run_id):
+        time.sleep(0.002)
+        with self.lock:
+            if time.monotonic() < self.active[thread_id]:
+                return SimpleNamespace(status='in_progress')
+            del self.active[thread_id]
+        return SimpleNamespace(status='completed')
+
+    def list_messages(self, thread_id):
+        text = SimpleNamespace(text=SimpleNamespace(value='Reply'))
+        return SimpleNamespace(data=[SimpleNamespace(role='assistant', content=[text])])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--burst', type=int, default=4)
+    parser.add_argument('--run', type=float, default=0.05)
+    parser.add_argument('--backoff', type=float, default=0.05)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from backend.locks import thread_turn
+    from chat.services import OpenAIAssistantService
+
+    def send(thread_id, queue, retries):
+        while True:
+            try:
+                with queue('chat', thread_id):
+                    OpenAIAssistantService.add_message(thread_id, 'Hello')
+                    OpenAIAssistantService.run_assistant(thread_id, 'asst')
+                return
+            except Exception:
+                retries.append(1)
+                time.sleep(args.backoff)
+
+    for name, queue in [('no queue', lambda *key: contextlib.nullcontext()), ('turn queue', thread_turn)]:
+        cache.clear()
+        stub = StubAssistants(args.run)
+        retries = []
+        senders = [
+            threading.Thread(target=send, args=(f'thread-{n}', queue, retries))
+            for n in range(args.threads) for _ in range(args.burst)
+        ]
+        with patch('chat.services.get_client', return_value=stub):
+            start = time.perf_counter()
+            for sender in senders:
+                sender.start()
+            for sender in senders:
+                sender.join()
+            elapsed = time.perf_counter() - start
+        print(f'{name:<12} {len(senders)} messages  {stub.runs} runs  {stub.rejected:4d} rejected calls'
+              f'  {len(retries):4d} retries  {elapsed * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
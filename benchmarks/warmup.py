@@ -0,0 +1,79 @@
+"""
+Latency of a fresh worker's first and second chat request (POST to a
+LangChain thread), cold and after backend.warmup has run. Each run is a new
+interpreter with a throwaway in-memory test database, which stays connected
+in both variants; OpenAI is the local stub server from benchmarks.hedging.
+
+    python -m benchmarks.warmup [--repeat 3]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from benchmarks.hedging import StubServer
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SCRIPT = '''
+import sys, time, warnings
+warnings.simplefilter('ignore')
+from benchmarks import setup_django
+setup_django()
+from django.db import connection
+from backend.wsgi import application
+
+old_name = connection.settings_dict['NAME']
+connection.creation.create_test_db(verbosity=0)
+from django.contrib.auth import get_user_model
+from langchain_chat.models import LangChainThread
+user = get_user_model().objects.create_user(email='bench@example.com', password='x', first_name='B', last_name='U')
+thread = LangChainThread.objects.create(user=user, title='Bench')
+
+warm_up = 0.0
+if sys.argv[1] == 'warm':
+    from backend.warmup import warmup
+    start = time.perf_counter()
+    warmup.run()
+    warm_up = time.perf_counter() - start
+
+from rest_framework.test import APIClient
+client = APIClient(SERVER_NAME='localhost')
+client.force_authenticate(user)
+times = []
+for _ in range(2):
+    start = time.perf_counter()
+    response = client.post(f'/api/langchain/threads/{thread.id}/message/', {'content': 'Hello'}, format='json')
+    times.append(time.perf_counter() - start)
+    assert response.status_code == 200, response.content
+connection.creation.destroy_test_db(old_name, verbosity=0)
+print(warm_up, *times)
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    server = StubServer(median=0.01, stall_rate=0, stall=0, seed=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}/v1'
+    env = {**os.environ, 'OPENAI_BASE_URL': base_url, 'OPENAI_API_BASE': base_url, 'PYTHONPATH': str(ROOT)}
+    for variant in ['cold', 'warm']:
+        runs = []
+        for _ in range(args.repeat):
+            result = subprocess.run(
+                [sys.executable, '-c', SCRIPT, variant], cwd=ROOT, env=env,
+                capture_output=True, text=True, check=True
+            )
+            runs.append([float(value) for value in result.stdout.split()[-3:]])
+        warm_up, first, second = (statistics.median(column) * 1000 for column in zip(*runs))
+        print(f'{variant:<6} warm-up {warm_up:8.1f} ms  first request {first:8.1f} ms  second {second:6.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+from backend.archive import ThreadArchiver
+from .models import ChatThread, ChatHistory
+
+
+class ChatThreadArchiver(ThreadArchiver):
+    thread_model = ChatThread
+    message_model = ChatHistory
+    kind = 'chat'
+
+
+archiver = ChatThreadArchiver()
@@ -0,0 +1,17 @@
+from backend.throttling import ChatMessageRateThrottle
+from backend.websocket import ThreadConsumer
+from .conversation import send_message
+from .models import ChatThread
+
+
+class ChatThreadConsumer(ThreadConsumer):
+    """Live updates and streamed replies for an OpenAI assistant thread"""
+    channel_kind = 'chat'
+    throttle_classes = [ChatMessageRateThrottle]
+    concurrency_scope = 'chat_message'
+
+    def get_thread(self, user, thread_id):
+        return ChatThread.objects.filter(id=thread_id, user=user, is_active=True).first()
+
+    def run_turn(self, data, on_token, cancel):
+        send_message(self.thread, self.user, data['content'], on_token=on_token, cancel=cancel)
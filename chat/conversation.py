@@ -0,0 +1,90 @@
+import threading
+from typing import Callable, Optional
+
+from backend.locks import thread_turn
+from backend.pubsub import get_broker, thread_channel
+from .archive import archiver
+from .models import ChatHistory, ChatThread
+from .pool import ensure_remote_thread
+from .serializers import ChatHistorySerializer
+from .services import OpenAIAssistantService
+
+
+def send_message(
+    thread: ChatThread,
+    user,
+    content: str,
+    on_token: Optional[Callable[[str], None]] = None,
+    cancel: Optional[threading.Event] = None
+) -> Optional[ChatHistory]:
+    """
+    Run one conversation turn: post the user's message to the OpenAI thread
+    (taken from the pool or created if the chat has none yet), run the
+    assistant and save both messages locally. If on_token is given the
+    reply is streamed and each text fragment is passed to it. Saved
+    messages are published to the thread's live channel. Turns on one thread
+    run one at a time, in the order they arrived (backend.locks.thread_turn).
+
+    Setting cancel while the reply streams (the client went away) cancels
+    the run; the text so far is saved with metadata {'truncated': True}, and
+    None is returned if there was none. A turn cancelled while it waited
+    for the thread returns None without posting anything.
+    """
+    with thread_turn('chat', thread.pk):
+        if cancel is not None and cancel.is_set():
+            return None
+        archiver.ensure_hot(thread)
+        ensure_remote_thread(thread)
+        broker = get_broker()
+        channel = thread_channel('chat', user.pk, thread.pk)
+
+        # Add message to OpenAI thread
+        openai_message = OpenAIAssistantService.add_message(
+            thread.openai_thread_id,
+            content,
+            'user'
+        )
+
+        # Save user message locally
+        user_chat = ChatHistory.objects.create_in_thread(
+            thread,
+            user=user,
+            message=content,
+            role='user',
+            openai_message_id=openai_message['id']
+        )
+        broker.publish(channel, {'type': 'message', 'message': ChatHistorySerializer(user_chat).data})
+
+        # Run the assistant
+        metadata = {}
+        if on_token is None:
+            assistant_response = OpenAIAssistantService.run_assistant(
+                thread.openai_thread_id,
+                thread.openai_assistant_id
+            )
+        else:
+            for kind, value in OpenAIAssistantService.stream_assistant(
+                thread.openai_thread_id,
+                thread.openai_assistant_id,
+                cancel=cancel
+            ):
+                if kind == 'delta':
+                    on_token(value)
+                else:
+                    assistant_response = value
+                    if kind == 'cancelled':
+                        metadata['truncated'] = True
+            if metadata.get('truncated') and not assistant_response['message']:
+                return None
+
+        # Save assistant's reply locally
+        assistant_chat = ChatHistory.objects.create_in_thread(
+            thread,
+            user=user,
+            message=assistant_response['message'],
+            role='assistant',
+            openai_message_id=assistant_response['run_id'],
+            metadata=metadata
+        )
+        broker.publish(channel, {'type': 'message', 'message': ChatHistorySerializer(assistant_chat).data})
+        return assistant_chat
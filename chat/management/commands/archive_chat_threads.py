@@ -0,0 +1,7 @@
+from backend.archive import ArchiveThreadsCommand
+from chat.archive import archiver
+
+
+class Command(ArchiveThreadsCommand):
+    help = 'Move inactive or idle chat threads to compressed cold storage'
+    archiver = archiver
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from chat import pool
+
+
+class Command(BaseCommand):
+    help = 'Top up the pool of pre-created OpenAI threads and replace expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=None,
+                            help='Target pool size (default: CHAT_THREAD_POOL_SIZE)')
+
+    def handle(self, *args, **options):
+        created, expired = pool.refill(options['size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created} pooled OpenAI threads, expired {expired}'
+        ))
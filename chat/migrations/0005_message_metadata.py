@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-19 12:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_external_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chathistory',
+            name='metadata',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.7 on 2026-10-19 12:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PooledOpenAIThread',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('openai_thread_id', models.CharField(max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
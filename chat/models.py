@@ -1,5 +1,29 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Substr
 from django.conf import settings
+from django.utils import timezone
+
+LAST_MESSAGE_PREVIEW_LENGTH = 100
+
+class ChatThreadQuerySet(models.QuerySet):
+    def refresh_activity(self):
+        """Recompute the denormalised message counters from ChatHistory"""
+        messages = ChatHistory.objects.filter(thread=OuterRef('pk')).order_by()
+        last_message = messages.order_by('-timestamp', '-id')
+        return self.update(
+            message_count=Coalesce(
+                Subquery(messages.values('thread').annotate(n=Count('id')).values('n')), 0
+            ),
+            last_message_at=Subquery(last_message.values('timestamp')[:1]),
+            last_message_role=Coalesce(Subquery(last_message.values('role')[:1]), Value('')),
+            last_message_preview=Coalesce(
+                Subquery(last_message.annotate(
+                    preview=Substr('message', 1, LAST_MESSAGE_PREVIEW_LENGTH)
+                ).values('preview')[:1]),
+                Value('')
+            ),
+        )
 
 class ChatThread(models.Model):
     user = models.ForeignKey(
@@ -14,10 +38,47 @@ class ChatThread(models.Model):
     # OpenAI specific fields
     openai_assistant_id = models.CharField(max_length=255, null=True, blank=True)
     openai_thread_id = models.CharField(max_length=255, null=True, blank=True)
+    # Denormalised activity, kept in sync by ChatHistory.objects.create_in_thread()
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_role = models.CharField(max_length=20, blank=True, default='')
+    last_message_preview = models.CharField(max_length=255, blank=True, default='')
+    # Set while the messages live in cold storage (see backend.archive)
+    archived_at = models.DateTimeField(null=True, blank=True)
+    archive_path = models.CharField(max_length=255, blank=True, default='')
+    # Key of the thread in the system it was imported from (see exports.importing)
+    external_id = models.CharField(max_length=255, null=True, blank=True)
+
+    objects = ChatThreadQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'external_id'],
+                condition=models.Q(external_id__isnull=False),
+                name='chat_thread_unique_external_id'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.user.username}"
 
+class ChatHistoryManager(models.Manager):
+    def create_in_thread(self, thread, **kwargs):
+        """Create a message and bump its thread's activity counters atomically"""
+        with transaction.atomic():
+            message = self.create(thread=thread, **kwargs)
+            now = timezone.now()
+            ChatThread.objects.filter(pk=thread.pk).update(
+                message_count=F('message_count') + 1,
+                last_message_at=message.timestamp,
+                last_message_role=message.role,
+                last_message_preview=message.message[:LAST_MESSAGE_PREVIEW_LENGTH],
+                updated_at=now,
+            )
+        thread.updated_at = now
+        return message
+
 class ChatHistory(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -33,12 +94,33 @@ class ChatHistory(models.Model):
     )
     message = models.TextField()
     role = models.CharField(max_length=20)  # 'user' or 'assistant'
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     # OpenAI specific fields
     openai_message_id = models.CharField(max_length=255, null=True, blank=True)
+    external_id = models.CharField(max_length=255, null=True, blank=True)
+    # e.g. {'truncated': True} for a reply cut short when its client left
+    metadata = models.JSONField(default=dict, blank=True)
+
+    objects = ChatHistoryManager()
 
     class Meta:
         ordering = ['timestamp']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['thread', 'external_id'],
+                condition=models.Q(external_id__isnull=False),
+                name='chat_message_unique_external_id'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.role} - {self.thread.title if self.thread else 'No Thread'}"
+
+
+class PooledOpenAIThread(models.Model):
+    """An unused OpenAI thread created ahead of time for a new ChatThread (see chat.pool)"""
+    openai_thread_id = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.openai_thread_id
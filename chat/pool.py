@@ -0,0 +1,80 @@
+"""
+Pool of pre-created OpenAI threads.
+
+Creating a ChatThread used to wait for a threads.create round trip to
+OpenAI. Now it takes an unused OpenAI thread from PooledOpenAIThread if one
+is available (a single local delete) and otherwise leaves
+openai_thread_id empty; ensure_remote_thread() fills it in before the first
+message is posted. The refill_openai_thread_pool command, run periodically,
+tops the pool up to CHAT_THREAD_POOL_SIZE and replaces entries older than
+CHAT_THREAD_POOL_MAX_AGE_DAYS, since OpenAI may delete inactive threads.
+"""
+import logging
+from datetime import timedelta
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ChatThread, PooledOpenAIThread
+from .services import OpenAIAssistantService
+
+logger = logging.getLogger(__name__)
+
+
+def _cutoff():
+    return timezone.now() - timedelta(days=settings.CHAT_THREAD_POOL_MAX_AGE_DAYS)
+
+
+def take_thread_id() -> Optional[str]:
+    """Claim the oldest unexpired pooled thread, or None if the pool is empty"""
+    while True:
+        entry = PooledOpenAIThread.objects.filter(created_at__gt=_cutoff()).order_by(
+            'created_at'
+        ).values_list('pk', 'openai_thread_id').first()
+        if entry is None:
+            return None
+        pk, openai_thread_id = entry
+        # Whoever deletes the row owns the thread
+        deleted, _ = PooledOpenAIThread.objects.filter(pk=pk).delete()
+        if deleted:
+            return openai_thread_id
+
+
+def ensure_remote_thread(thread: ChatThread) -> str:
+    """The thread's OpenAI thread id, taking or creating one if it has none yet"""
+    if thread.openai_thread_id:
+        return thread.openai_thread_id
+    openai_thread_id = take_thread_id() or OpenAIAssistantService.create_thread()
+    updated = ChatThread.objects.filter(pk=thread.pk, openai_thread_id__isnull=True).update(
+        openai_thread_id=openai_thread_id
+    )
+    if not updated:
+        # Another request got there first; keep ours for a later thread
+        PooledOpenAIThread.objects.create(openai_thread_id=openai_thread_id)
+        thread.refresh_from_db(fields=['openai_thread_id'])
+    else:
+        thread.openai_thread_id = openai_thread_id
+    return thread.openai_thread_id
+
+
+def refill(size: Optional[int] = None) -> Tuple[int, int]:
+    """Drop expired pooled threads and create new ones up to size; returns (created, expired)"""
+    size = settings.CHAT_THREAD_POOL_SIZE if size is None else size
+    expired = 0
+    for pk, openai_thread_id in PooledOpenAIThread.objects.filter(created_at__lte=_cutoff()).values_list(
+        'pk', 'openai_thread_id'
+    ):
+        if PooledOpenAIThread.objects.filter(pk=pk).delete()[0]:
+            expired += 1
+            try:
+                OpenAIAssistantService.delete_thread(openai_thread_id)
+            except Exception as e:
+                # OpenAI may already have deleted it
+                logger.warning("Could not delete expired pooled thread %s: %s", openai_thread_id, e)
+
+    created = 0
+    for _ in range(size - PooledOpenAIThread.objects.count()):
+        PooledOpenAIThread.objects.create(openai_thread_id=OpenAIAssistantService.create_thread())
+        created += 1
+    return created, expired
@@ -1,24 +1,36 @@
 from rest_framework import serializers
+from backend.serializers import SparseFieldsetMixin
 from .models import ChatHistory, ChatThread
 
 class ChatHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatHistory
-        fields = ['id', 'message', 'role', 'timestamp', 'openai_message_id']
-        read_only_fields = ['id', 'timestamp']
+        fields = ['id', 'message', 'role', 'timestamp', 'openai_message_id', 'metadata']
+        read_only_fields = ['id', 'timestamp', 'metadata']
 
-class ChatThreadSerializer(serializers.ModelSerializer):
+class ChatThreadSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     messages = ChatHistorySerializer(many=True, read_only=True)
     last_message = serializers.SerializerMethodField()
 
     class Meta:
         model = ChatThread
         fields = ['id', 'title', 'is_active', 'created_at', 'updated_at', 
-                 'openai_assistant_id', 'openai_thread_id', 'messages', 'last_message']
-        read_only_fields = ['id', 'created_at', 'updated_at', 'openai_thread_id']
+                 'openai_assistant_id', 'openai_thread_id', 'messages', 'last_message', 'archived_at']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'openai_thread_id', 'archived_at']
 
     def get_last_message(self, obj):
         last_message = obj.messages.order_by('-timestamp').first()
         if last_message:
             return ChatHistorySerializer(last_message).data
         return None
+
+
+class ChatThreadSummarySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Thread listing using the denormalised activity fields instead of the message payload"""
+    class Meta:
+        model = ChatThread
+        fields = ['id', 'title', 'is_active', 'openai_assistant_id', 'updated_at',
+                  'message_count', 'last_message_role', 'last_message_preview', 'last_message_at',
+                  'archived_at']
+        read_only_fields = fields
+
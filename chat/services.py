@@ -1,59 +1,82 @@
-from openai import OpenAI
+import threading
+import time
+from functools import lru_cache
 from django.conf import settings
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from backend.hedging import hedge_delay, note_call, record_latency, try_spend
+from backend.singleflight import read_through, single_flight
+
+
+@lru_cache(maxsize=None)
+def get_client():
+    """The OpenAI client, created on first use so that importing this module stays cheap"""
+    from openai import OpenAI
+    return OpenAI(api_key=settings.OPENAI_API_KEY)
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
 
 class OpenAIAssistantService:
     @staticmethod
     def list_assistants() -> List[Dict[str, Any]]:
-        """List all available assistants from OpenAI"""
+        """
+        List all available assistants from OpenAI. Cached for
+        ASSISTANT_CACHE_TTL seconds and reloaded by a single caller.
+        """
         try:
-            assistants = client.beta.assistants.list()
-            return [
-                {
-                    'id': assistant.id,
-                    'name': assistant.name,
-                    'instructions': assistant.instructions,
-                    'model': assistant.model,
-                    'tools': assistant.tools,
-                    'created_at': assistant.created_at
-                }
-                for assistant in assistants.data
-            ]
+            return read_through('openai:assistants', OpenAIAssistantService._fetch_assistants,
+                                settings.ASSISTANT_CACHE_TTL)
         except Exception as e:
             raise Exception(f"Failed to fetch assistants: {str(e)}")
 
+    @staticmethod
+    def _fetch_assistants() -> List[Dict[str, Any]]:
+        assistants = get_client().beta.assistants.list()
+        return [OpenAIAssistantService._assistant_data(assistant) for assistant in assistants.data]
+
     @staticmethod
     def get_assistant(assistant_id: str) -> Dict[str, Any]:
-        """Get a specific assistant by ID"""
+        """Get a specific assistant by ID; cached like list_assistants"""
         try:
-            assistant = client.beta.assistants.retrieve(assistant_id)
-            return {
-                'id': assistant.id,
-                'name': assistant.name,
-                'instructions': assistant.instructions,
-                'model': assistant.model,
-                'tools': assistant.tools,
-                'created_at': assistant.created_at
-            }
+            return read_through(
+                f'openai:assistant:{assistant_id}',
+                lambda: OpenAIAssistantService._assistant_data(get_client().beta.assistants.retrieve(assistant_id)),
+                settings.ASSISTANT_CACHE_TTL
+            )
         except Exception as e:
             raise Exception(f"Failed to fetch assistant: {str(e)}")
 
+    @staticmethod
+    def _assistant_data(assistant) -> Dict[str, Any]:
+        return {
+            'id': assistant.id,
+            'name': assistant.name,
+            'instructions': assistant.instructions,
+            'model': assistant.model,
+            'tools': assistant.tools,
+            'created_at': assistant.created_at
+        }
+
     @staticmethod
     def create_thread() -> str:
         """Create a new thread"""
         try:
-            thread = client.beta.threads.create()
+            thread = get_client().beta.threads.create()
             return thread.id
         except Exception as e:
             raise Exception(f"Failed to create thread: {str(e)}")
 
+    @staticmethod
+    def delete_thread(thread_id: str) -> None:
+        """Delete a thread"""
+        try:
+            get_client().beta.threads.delete(thread_id)
+        except Exception as e:
+            raise Exception(f"Failed to delete thread: {str(e)}")
+
     @staticmethod
     def add_message(thread_id: str, content: str, role: str = "user") -> Dict[str, Any]:
         """Add a message to a thread"""
         try:
-            message = client.beta.threads.messages.create(
+            message = get_client().beta.threads.messages.create(
                 thread_id=thread_id,
                 role=role,
                 content=content
@@ -68,19 +91,39 @@ class OpenAIAssistantService:
 
     @staticmethod
     def run_assistant(thread_id: str, assistant_id: str) -> Dict[str, Any]:
-        """Run the assistant on a thread"""
+        """
+        Run the assistant on a thread. With HEDGE_ENABLED, a run still queued
+        after the hedge delay for its model is cancelled and replaced once;
+        a thread allows a single active run, so the replacement cannot race
+        the original as hedged LangChain calls do.
+        """
         try:
-            run = client.beta.threads.runs.create(
+            run = get_client().beta.threads.runs.create(
                 thread_id=thread_id,
                 assistant_id=assistant_id
             )
-            
+            hedge_key = f'assistant:{run.model}'
+            may_hedge = settings.HEDGE_ENABLED
+            if may_hedge:
+                note_call(hedge_key)
+                started = time.monotonic()
+                deadline = started + hedge_delay(hedge_key)
+
             # Wait for the run to complete
             while True:
-                run_status = client.beta.threads.runs.retrieve(
+                run_status = get_client().beta.threads.runs.retrieve(
                     thread_id=thread_id,
                     run_id=run.id
                 )
+                if may_hedge and run_status.status != 'queued':
+                    record_latency(hedge_key, time.monotonic() - started)
+                    may_hedge = False
+                elif may_hedge and time.monotonic() > deadline:
+                    may_hedge = False
+                    if try_spend(hedge_key):
+                        run = OpenAIAssistantService._replace_run(thread_id, assistant_id, run)
+                        continue
+
                 if run_status.status == 'completed':
                     break
                 elif run_status.status == 'failed':
@@ -91,7 +134,7 @@ class OpenAIAssistantService:
                     raise Exception("Assistant run cancelled")
                 
             # Get the assistant's response
-            messages = client.beta.threads.messages.list(thread_id=thread_id)
+            messages = get_client().beta.threads.messages.list(thread_id=thread_id)
             assistant_message = next(
                 (msg for msg in messages.data if msg.role == "assistant"),
                 None
@@ -108,10 +151,125 @@ class OpenAIAssistantService:
             raise Exception(f"Failed to run assistant: {str(e)}")
 
     @staticmethod
-    def get_thread_messages(thread_id: str) -> List[Dict[str, Any]]:
-        """Get all messages in a thread"""
+    def _find_active_run(thread_id: str) -> Optional[str]:
+        """
+        The id of the thread's active run, polled for up to
+        OPENAI_RUN_CANCEL_TIMEOUT while a just-requested run may not be
+        listed yet; None if none turns up.
+        """
+        deadline = time.monotonic() + settings.OPENAI_RUN_CANCEL_TIMEOUT
+        while True:
+            runs = get_client().beta.threads.runs.list(thread_id=thread_id, limit=1, order='desc')
+            for run in runs.data:
+                if run.status in ('queued', 'in_progress', 'requires_action'):
+                    return run.id
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(settings.OPENAI_RUN_POLL_INTERVAL)
+
+    @staticmethod
+    def _cancel_run(thread_id: str, run_id: str) -> bool:
+        """Cancel a run; False if it is no longer cancellable (started or finished)"""
+        from openai import APIStatusError
         try:
-            messages = client.beta.threads.messages.list(thread_id=thread_id)
+            get_client().beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+        except APIStatusError:
+            return False
+        return True
+
+    @staticmethod
+    def _replace_run(thread_id: str, assistant_id: str, run):
+        """
+        Cancel a run stalled in the queue and start another. A run no longer
+        queued is kept. Once cancelled, the run is polled every
+        OPENAI_RUN_POLL_INTERVAL until it ends, as the thread accepts no new
+        run before then; the run is only returned if it completed anyway.
+        """
+        retrieve = get_client().beta.threads.runs.retrieve
+        if retrieve(thread_id=thread_id, run_id=run.id).status != 'queued':
+            return run
+        if not OpenAIAssistantService._cancel_run(thread_id, run.id):
+            return run
+        while True:
+            status = retrieve(thread_id=thread_id, run_id=run.id).status
+            if status == 'completed':
+                return run
+            if status in ('cancelled', 'failed', 'expired'):
+                break
+            time.sleep(settings.OPENAI_RUN_POLL_INTERVAL)
+        return get_client().beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id
+        )
+
+    @staticmethod
+    def stream_assistant(
+        thread_id: str,
+        assistant_id: str,
+        cancel: Optional[threading.Event] = None
+    ) -> Iterator[Tuple[str, Any]]:
+        """
+        Run the assistant on a thread and stream its reply. Yields
+        ('delta', text) for each text fragment and finally
+        ('completed', {'run_id': ..., 'message': ...}). Once cancel is set
+        the run is cancelled and the stream closed, and the last item is
+        ('cancelled', {...}) with whatever text had arrived. If cancel is
+        already set, no run is started.
+        """
+        if cancel is not None and cancel.is_set():
+            yield 'cancelled', {'run_id': None, 'message': ''}
+            return
+        try:
+            stream = get_client().beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                stream=True
+            )
+            run_id = None
+            parts = []
+            for event in stream:
+                if event.event == 'thread.run.created':
+                    run_id = event.data.id
+                elif event.event == 'thread.message.delta':
+                    for block in event.data.delta.content or []:
+                        if block.type == 'text' and block.text and block.text.value:
+                            parts.append(block.text.value)
+                            yield 'delta', block.text.value
+                elif event.event == 'thread.run.failed':
+                    raise Exception("Assistant run failed")
+                elif event.event == 'thread.run.expired':
+                    raise Exception("Assistant run expired")
+                elif event.event == 'thread.run.cancelled':
+                    raise Exception("Assistant run cancelled")
+
+                if cancel is not None and cancel.is_set():
+                    stream.close()
+                    if run_id is None:
+                        # Closed before the run announced itself
+                        run_id = OpenAIAssistantService._find_active_run(thread_id)
+                    if run_id is not None:
+                        OpenAIAssistantService._cancel_run(thread_id, run_id)
+                    yield 'cancelled', {
+                        'run_id': run_id,
+                        'message': ''.join(parts)
+                    }
+                    return
+
+            if not parts:
+                raise Exception("No assistant response found")
+
+            yield 'completed', {
+                'run_id': run_id,
+                'message': ''.join(parts)
+            }
+        except Exception as e:
+            raise Exception(f"Failed to run assistant: {str(e)}")
+
+    @staticmethod
+    def get_thread_messages(thread_id: str) -> List[Dict[str, Any]]:
+        """Get all messages in a thread; concurrent calls for a thread share one request"""
+        def fetch():
+            messages = get_client().beta.threads.messages.list(thread_id=thread_id)
             return [
                 {
                     'id': msg.id,
@@ -121,5 +279,8 @@ class OpenAIAssistantService:
                 }
                 for msg in messages.data
             ]
+
+        try:
+            return single_flight(f'openai:thread-messages:{thread_id}', fetch)
         except Exception as e:
-            raise Exception(f"Failed to fetch thread messages: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Failed to fetch thread messages: {str(e)}") 
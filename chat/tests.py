@@ -3,7 +3,24 @@ from django.urls import reverse
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from .models import ChatThread, ChatHistory
+from django.core.cache import cache
+from django.test import override_settings
+from django.core.files.storage import storages
+from django.core.management import call_command
+from datetime import timedelta
+from django.utils import timezone
+from io import StringIO
+import gzip
+import json
+import tempfile
+import threading
+import time
+from rest_framework.throttling import SimpleRateThrottle
+from backend.locks import thread_turn
+from .archive import archiver
+from .conversation import send_message
+from .models import ChatThread, ChatHistory, PooledOpenAIThread
+from .pool import take_thread_id
 from .services import OpenAIAssistantService
 from unittest.mock import patch, MagicMock
 
@@ -15,6 +32,7 @@ class MockOpenAIResponse:
 
 class ChatAPITestCase(APITestCase):
     def setUp(self):
+        cache.clear()
         # Create test user
         self.user = User.objects.create_user(
             email='test@example.com',
@@ -63,9 +81,9 @@ class ChatAPITestCase(APITestCase):
 
     @patch('chat.services.OpenAIAssistantService.create_thread')
     def test_create_chat_thread(self, mock_create_thread):
-        """Test creating a new chat thread"""
-        mock_create_thread.return_value = self.mock_thread['id']
-        
+        """Test creating a new chat thread from the pool of OpenAI threads"""
+        PooledOpenAIThread.objects.create(openai_thread_id=self.mock_thread['id'])
+
         data = {
             'title': 'Test Chat',
             'assistant_id': self.mock_assistant['id']
@@ -76,6 +94,54 @@ class ChatAPITestCase(APITestCase):
         thread = ChatThread.objects.latest('created_at')
         self.assertEqual(thread.openai_thread_id, 'thread_123')
         self.assertEqual(thread.openai_assistant_id, 'asst_123')
+        self.assertFalse(PooledOpenAIThread.objects.exists())
+        mock_create_thread.assert_not_called()
+
+    @patch('chat.services.OpenAIAssistantService.add_message')
+    @patch('chat.services.OpenAIAssistantService.run_assistant')
+    @patch('chat.services.OpenAIAssistantService.create_thread')
+    def test_remote_thread_created_on_first_message(self, mock_create_thread, mock_run, mock_add):
+        """Test that an empty pool defers creating the OpenAI thread to the first message"""
+        mock_create_thread.return_value = 'thread_new'
+        mock_add.return_value = {'id': 'msg_123', 'role': 'user', 'content': 'Hi'}
+        mock_run.return_value = {'run_id': 'run_123', 'message': 'Hello'}
+
+        response = self.client.post(reverse('thread-list'), {'title': 'Lazy', 'assistant_id': 'asst_123'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        thread = ChatThread.objects.get(title='Lazy')
+        self.assertIsNone(thread.openai_thread_id)
+        mock_create_thread.assert_not_called()
+
+        for _ in range(2):
+            response = self.client.post(reverse('message-create'), {'thread_id': thread.id, 'message': 'Hi'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        thread.refresh_from_db()
+        self.assertEqual(thread.openai_thread_id, 'thread_new')
+        mock_create_thread.assert_called_once_with()
+        self.assertEqual([call.args[0] for call in mock_add.call_args_list], ['thread_new'] * 2)
+
+    @override_settings(CHAT_THREAD_POOL_MAX_AGE_DAYS=30)
+    @patch('chat.services.OpenAIAssistantService.delete_thread')
+    @patch('chat.services.OpenAIAssistantService.create_thread')
+    def test_refill_thread_pool(self, mock_create_thread, mock_delete_thread):
+        """Test that the refill command tops up the pool and replaces expired threads"""
+        mock_create_thread.side_effect = [f'thread_pool_{i}' for i in range(3)]
+        PooledOpenAIThread.objects.create(openai_thread_id='thread_fresh')
+        PooledOpenAIThread.objects.create(
+            openai_thread_id='thread_old', created_at=timezone.now() - timedelta(days=31)
+        )
+
+        out = StringIO()
+        call_command('refill_openai_thread_pool', size=3, stdout=out)
+
+        self.assertIn('Created 2 pooled OpenAI threads, expired 1', out.getvalue())
+        mock_delete_thread.assert_called_once_with('thread_old')
+        self.assertEqual(
+            set(PooledOpenAIThread.objects.values_list('openai_thread_id', flat=True)),
+            {'thread_fresh', 'thread_pool_0', 'thread_pool_1'}
+        )
+        # The oldest unexpired thread is used first
+        self.assertEqual(take_thread_id(), 'thread_fresh')
 
     def test_list_threads(self):
         """Test listing all threads"""
@@ -108,6 +174,30 @@ class ChatAPITestCase(APITestCase):
         self.thread.refresh_from_db()
         self.assertFalse(self.thread.is_active)
 
+    @patch('chat.services.get_client')
+    def test_assistants_are_fetched_once(self, mock_get_client):
+        """Test that concurrent and repeated assistant listings share one upstream call"""
+        assistant = MockOpenAIResponse(**self.mock_assistant)
+
+        def slow_list():
+            time.sleep(0.05)
+            return MockOpenAIResponse(data=[assistant])
+
+        mock_get_client.return_value.beta.assistants.list.side_effect = slow_list
+        results = []
+        callers = [
+            threading.Thread(target=lambda: results.append(OpenAIAssistantService.list_assistants()))
+            for _ in range(5)
+        ]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join(5)
+        results.append(OpenAIAssistantService.list_assistants())
+
+        self.assertEqual(mock_get_client.return_value.beta.assistants.list.call_count, 1)
+        self.assertEqual(results, [[self.mock_assistant]] * 6)
+
     @patch('chat.services.OpenAIAssistantService.add_message')
     @patch('chat.services.OpenAIAssistantService.run_assistant')
     def test_send_message(self, mock_run, mock_add):
@@ -125,6 +215,9 @@ class ChatAPITestCase(APITestCase):
         response = self.client.post(reverse('message-create'), data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(ChatHistory.objects.count(), 2)  # User message + Assistant response
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.message_count, 2)
+        self.assertEqual(self.thread.last_message_preview, 'Test response')
         
         # Verify the messages
         messages = ChatHistory.objects.all().order_by('timestamp')
@@ -182,3 +275,404 @@ class ChatAPITestCase(APITestCase):
         
         response = self.client.get(reverse('thread-messages', kwargs={'thread_id': other_thread.id}))
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch('chat.services.OpenAIAssistantService.add_message')
+    @patch('chat.services.OpenAIAssistantService.run_assistant')
+    @patch.dict(SimpleRateThrottle.THROTTLE_RATES, {'chat_message': '1/min'})
+    def test_send_message_rate_limited(self, mock_run, mock_add):
+        """Test the per-user message rate limit"""
+        mock_add.return_value = {'id': 'msg_123', 'role': 'user', 'content': 'Test message'}
+        mock_run.return_value = {'run_id': 'run_123', 'message': 'Test response'}
+        data = {'thread_id': self.thread.id, 'message': 'Test message'}
+
+        response = self.client.post(reverse('message-create'), data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(reverse('message-create'), data)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+    @override_settings(CHAT_MAX_CONCURRENT_REQUESTS=1, CHAT_CONCURRENCY_RETRY_AFTER=7)
+    @patch('chat.services.OpenAIAssistantService.add_message')
+    def test_send_message_concurrency_limited(self, mock_add):
+        """Test that a user cannot exceed the in-flight request limit"""
+        # Another worker is already processing a message for this user
+        cache.set(f'concurrency:chat_message:{self.user.pk}', 1)
+
+        data = {'thread_id': self.thread.id, 'message': 'Test message'}
+        response = self.client.post(reverse('message-create'), data)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '7')
+        mock_add.assert_not_called()
+
+        # Once the other request finishes the slot becomes available again
+        cache.set(f'concurrency:chat_message:{self.user.pk}', 0)
+        mock_add.side_effect = Exception('upstream down')
+        response = self.client.post(reverse('message-create'), data)
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(cache.get(f'concurrency:chat_message:{self.user.pk}'), 0)
+
+    @patch('chat.services.OpenAIAssistantService.add_message')
+    @patch('chat.services.OpenAIAssistantService.run_assistant')
+    def test_send_message_idempotency_key(self, mock_run, mock_add):
+        """Test that a retried message replays the first response instead of running again"""
+        mock_add.return_value = {'id': 'msg_123', 'role': 'user', 'content': 'Test message'}
+        mock_run.return_value = {'run_id': 'run_123', 'message': 'Test response'}
+        data = {'thread_id': self.thread.id, 'message': 'Test message'}
+
+        first = self.client.post(reverse('message-create'), data, HTTP_IDEMPOTENCY_KEY='key-1')
+        retry = self.client.post(reverse('message-create'), data, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(mock_run.call_count, 1)
+        self.assertEqual(ChatHistory.objects.count(), 2)
+
+        # The key cannot be reused for another message
+        response = self.client.post(
+            reverse('message-create'), {**data, 'message': 'Other'}, HTTP_IDEMPOTENCY_KEY='key-1'
+        )
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        # A new key is a new message
+        self.client.post(reverse('message-create'), data, HTTP_IDEMPOTENCY_KEY='key-2')
+        self.assertEqual(mock_run.call_count, 2)
+
+    @patch('chat.services.OpenAIAssistantService.add_message')
+    @patch('chat.services.OpenAIAssistantService.run_assistant')
+    @patch.dict(SimpleRateThrottle.THROTTLE_RATES, {'chat_message': '1/min'})
+    def test_replayed_message_is_not_throttled(self, mock_run, mock_add):
+        """Test that replaying a message does not use up the rate limit"""
+        mock_add.return_value = {'id': 'msg_123', 'role': 'user', 'content': 'Test message'}
+        mock_run.return_value = {'run_id': 'run_123', 'message': 'Test response'}
+        data = {'thread_id': self.thread.id, 'message': 'Test message'}
+
+        self.client.post(reverse('message-create'), data, HTTP_IDEMPOTENCY_KEY='key-1')
+        retry = self.client.post(reverse('message-create'), data, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+    @patch('chat.services.OpenAIAssistantService.add_message')
+    @patch('chat.services.OpenAIAssistantService.run_assistant')
+    def test_failed_idempotent_message_can_be_retried(self, mock_run, mock_add):
+        mock_add.return_value = {'id': 'msg_123', 'role': 'user', 'content': 'Test message'}
+        mock_run.side_effect = [Exception('upstream down'), {'run_id': 'run_123', 'message': 'Test response'}]
+        data = {'thread_id': self.thread.id, 'message': 'Test message'}
+
+        response = self.client.post(reverse('message-create'), data, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        response = self.client.post(reverse('message-create'), data, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    @override_settings(TURN_QUEUE_TIMEOUT=0.1)
+    @patch('chat.services.OpenAIAssistantService.add_message')
+    def test_send_message_while_thread_busy(self, mock_add):
+        """Test that a message waits for the thread's running turn and gives up with 409"""
+        data = {'thread_id': self.thread.id, 'message': 'Test message'}
+        with thread_turn('chat', self.thread.pk):
+            response = self.client.post(reverse('message-create'), data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        mock_add.assert_not_called()
+
+    @override_settings(HEDGE_ENABLED=True, HEDGE_DEFAULT_DELAY=0, HEDGE_BUDGET=1, OPENAI_RUN_POLL_INTERVAL=0)
+    @patch('chat.services.get_client')
+    def test_stalled_run_is_replaced(self, mock_get_client):
+        """Test that a run stuck in the queue is cancelled and started again"""
+        mock_client = mock_get_client.return_value
+        runs = mock_client.beta.threads.runs
+        runs.create.side_effect = [
+            MockOpenAIResponse(id='run_1', model='gpt-4o'),
+            MockOpenAIResponse(id='run_2', model='gpt-4o'),
+        ]
+        runs.retrieve.side_effect = [
+            MockOpenAIResponse(status='queued'),
+            MockOpenAIResponse(status='queued'),
+            MockOpenAIResponse(status='cancelling'),
+            MockOpenAIResponse(status='cancelled'),
+            MockOpenAIResponse(status='completed'),
+        ]
+        mock_client.beta.threads.messages.list.return_value = MockOpenAIResponse(data=[
+            MockOpenAIResponse(role='assistant', content=[
+                MockOpenAIResponse(text=MockOpenAIResponse(value='Test response'))
+            ])
+        ])
+
+        response = OpenAIAssistantService.run_assistant('thread_123', 'asst_123')
+
+        self.assertEqual(response, {'run_id': 'run_2', 'message': 'Test response'})
+        runs.cancel.assert_called_once_with(thread_id='thread_123', run_id='run_1')
+        self.assertEqual(runs.create.call_count, 2)
+
+    @override_settings(HEDGE_ENABLED=True, HEDGE_DEFAULT_DELAY=0, HEDGE_BUDGET=1,
+                       OPENAI_RUN_CANCEL_TIMEOUT=0.05, OPENAI_RUN_POLL_INTERVAL=0.02)
+    @patch('chat.services.get_client')
+    def test_replacement_waits_for_slow_cancellation(self, mock_get_client):
+        """Test that a run still cancelling past the timeout is waited out, not returned"""
+        mock_client = mock_get_client.return_value
+        runs = mock_client.beta.threads.runs
+        runs.create.side_effect = [
+            MockOpenAIResponse(id='run_1', model='gpt-4o'),
+            MockOpenAIResponse(id='run_2', model='gpt-4o'),
+        ]
+        runs.retrieve.side_effect = (
+            [MockOpenAIResponse(status='queued')] * 2
+            + [MockOpenAIResponse(status='cancelling')] * 5
+            + [MockOpenAIResponse(status='cancelled'), MockOpenAIResponse(status='completed')]
+        )
+        mock_client.beta.threads.messages.list.return_value = MockOpenAIResponse(data=[
+            MockOpenAIResponse(role='assistant', content=[
+                MockOpenAIResponse(text=MockOpenAIResponse(value='Test response'))
+            ])
+        ])
+
+        response = OpenAIAssistantService.run_assistant('thread_123', 'asst_123')
+
+        self.assertEqual(response, {'run_id': 'run_2', 'message': 'Test response'})
+        self.assertEqual(runs.retrieve.call_count, 9)
+
+    @patch('chat.services.get_client')
+    def test_replacement_keeps_run_that_started(self, mock_get_client):
+        """Test that a run found no longer queued is not cancelled"""
+        runs = mock_get_client.return_value.beta.threads.runs
+        runs.retrieve.return_value = MockOpenAIResponse(status='in_progress')
+        run = MockOpenAIResponse(id='run_1')
+
+        self.assertIs(OpenAIAssistantService._replace_run('thread_123', 'asst_123', run), run)
+        runs.cancel.assert_not_called()
+        runs.create.assert_not_called()
+
+    @patch('chat.services.get_client')
+    def test_cancelled_stream_saves_partial_reply(self, mock_get_client):
+        """Test that cancelling a streamed reply cancels the run and saves what arrived"""
+        def delta(text):
+            block = MockOpenAIResponse(type='text', text=MockOpenAIResponse(value=text))
+            return MockOpenAIResponse(
+                event='thread.message.delta',
+                data=MockOpenAIResponse(delta=MockOpenAIResponse(content=[block]))
+            )
+
+        mock_client = mock_get_client.return_value
+        mock_client.beta.threads.messages.create.return_value = MockOpenAIResponse(
+            id='msg_1', role='user', content=[MockOpenAIResponse(text=MockOpenAIResponse(value='Hi'))]
+        )
+        stream = MagicMock()
+        stream.__iter__.return_value = iter([
+            MockOpenAIResponse(event='thread.run.created', data=MockOpenAIResponse(id='run_1')),
+            delta('Hel'),
+            delta('lo'),
+            MockOpenAIResponse(event='thread.run.completed', data=None),
+        ])
+        mock_client.beta.threads.runs.create.return_value = stream
+        cancel = threading.Event()
+
+        reply = send_message(self.thread, self.user, 'Hi', on_token=lambda token: cancel.set(), cancel=cancel)
+
+        mock_client.beta.threads.runs.cancel.assert_called_once_with(thread_id='thread_123', run_id='run_1')
+        stream.close.assert_called_once_with()
+        self.assertEqual(reply.message, 'Hel')
+        self.assertEqual(reply.metadata, {'truncated': True})
+
+    @override_settings(OPENAI_RUN_POLL_INTERVAL=0)
+    @patch('chat.services.get_client')
+    def test_cancelled_stream_finds_unannounced_run(self, mock_get_client):
+        """Test that a stream closed before its run was announced still cancels the run"""
+        runs = mock_get_client.return_value.beta.threads.runs
+        stream = MagicMock()
+        stream.__iter__.return_value = iter([MockOpenAIResponse(event='thread.created', data=None)])
+        runs.create.return_value = stream
+        runs.list.side_effect = [
+            MockOpenAIResponse(data=[]),
+            MockOpenAIResponse(data=[MockOpenAIResponse(id='run_1', status='queued')]),
+        ]
+        # The client leaves once the first event has arrived
+        cancel = threading.Event()
+        cancel.is_set = MagicMock(side_effect=[False, True])
+
+        events = list(OpenAIAssistantService.stream_assistant('thread_123', 'asst_123', cancel=cancel))
+
+        self.assertEqual(events, [('cancelled', {'run_id': 'run_1', 'message': ''})])
+        runs.cancel.assert_called_once_with(thread_id='thread_123', run_id='run_1')
+
+    @patch('chat.services.get_client')
+    def test_turn_cancelled_while_queued_is_not_sent(self, mock_get_client):
+        """Test that a turn whose client left while it waited for the thread posts nothing"""
+        cancel = threading.Event()
+        cancel.set()
+
+        self.assertIsNone(send_message(self.thread, self.user, 'Hi', on_token=lambda token: None, cancel=cancel))
+        mock_get_client.return_value.beta.threads.messages.create.assert_not_called()
+        mock_get_client.return_value.beta.threads.runs.create.assert_not_called()
+        self.assertFalse(ChatHistory.objects.filter(thread=self.thread).exists())
+
+    def test_thread_messages_conditional_get(self):
+        """Test that unchanged message lists return 304 Not Modified"""
+        ChatHistory.objects.create_in_thread(
+            self.thread, user=self.user, message='Hello', role='user'
+        )
+        url = reverse('thread-messages', kwargs={'thread_id': self.thread.id})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        ChatHistory.objects.create_in_thread(
+            self.thread, user=self.user, message='Hi there!', role='assistant'
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data), 2)
+
+    def test_large_response_compressed(self):
+        """Test that large JSON responses are gzip compressed"""
+        ChatHistory.objects.bulk_create([
+            ChatHistory(user=self.user, thread=self.thread, message='x' * 100, role='user')
+            for _ in range(20)
+        ])
+        url = reverse('thread-messages', kwargs={'thread_id': self.thread.id})
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+        response = self.client.get(reverse('thread-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ChatArchiveTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpass123',
+            first_name='Test',
+            last_name='User'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            'archive': {
+                'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                'OPTIONS': {'location': self.archive_dir.name},
+            },
+        })
+        self.settings_override.enable()
+
+        self.thread = ChatThread.objects.create(
+            user=self.user,
+            title='Old Thread',
+            openai_assistant_id='asst_123',
+            openai_thread_id='thread_123'
+        )
+        self.messages = [
+            ChatHistory.objects.create_in_thread(
+                self.thread, user=self.user, role='user' if i % 2 == 0 else 'assistant',
+                message=f'archived message {i}', openai_message_id=f'msg_{i}',
+                timestamp=timezone.now() - timedelta(days=400 - i)
+            )
+            for i in range(5)
+        ]
+        ChatThread.objects.filter(pk=self.thread.pk).update(updated_at=timezone.now() - timedelta(days=365))
+        self.recent_thread = ChatThread.objects.create(user=self.user, title='Recent')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.archive_dir.cleanup()
+
+    def test_archive_command(self):
+        """Test that idle threads are moved to compressed storage, leaving a stub"""
+        call_command('archive_chat_threads', batch_size=1, stdout=StringIO())
+
+        self.thread.refresh_from_db()
+        self.recent_thread.refresh_from_db()
+        self.assertIsNotNone(self.thread.archived_at)
+        self.assertIsNone(self.recent_thread.archived_at)
+        self.assertFalse(ChatHistory.objects.filter(thread=self.thread).exists())
+        self.assertEqual(self.thread.message_count, 5)
+
+        with storages['archive'].open(self.thread.archive_path, 'rb') as f:
+            lines = gzip.decompress(f.read()).splitlines()
+        self.assertEqual(json.loads(lines[0])['thread']['id'], self.thread.id)
+        self.assertEqual(len(lines), 6)
+
+        response = self.client.get(reverse('thread-list'))
+        archived = next(t for t in response.data if t['id'] == self.thread.id)
+        self.assertEqual(archived['last_message_preview'], 'archived message 4')
+        self.assertIsNotNone(archived['archived_at'])
+
+    def test_rehydrate_on_demand(self):
+        """Test that reading an archived thread restores its messages unchanged"""
+        archiver.archive(self.thread)
+        path = self.thread.archive_path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse('thread-messages', kwargs={'thread_id': self.thread.id}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(m['id'], m['message'], m['timestamp']) for m in response.data],
+            [(m.id, m.message, m.timestamp.isoformat().replace('+00:00', 'Z')) for m in self.messages]
+        )
+        self.thread.refresh_from_db()
+        self.assertIsNone(self.thread.archived_at)
+        self.assertFalse(storages['archive'].exists(path))
+        self.assertEqual(ChatHistory.objects.filter(thread=self.thread, search_entry__isnull=False).count(), 5)
+
+    def test_archive_skips_thread_with_new_messages(self):
+        """Test that a message arriving while the blob is written aborts the archive"""
+        original_write = archiver._write_blob
+
+        def write_then_post(thread):
+            result = original_write(thread)
+            ChatHistory.objects.create_in_thread(thread, user=self.user, role='user', message='late')
+            return result
+
+        with patch.object(archiver, '_write_blob', side_effect=write_then_post):
+            self.assertFalse(archiver.archive(self.thread))
+
+        self.thread.refresh_from_db()
+        self.assertIsNone(self.thread.archived_at)
+        self.assertEqual(ChatHistory.objects.filter(thread=self.thread).count(), 6)
+        self.assertEqual(storages['archive'].listdir(f'chat/{self.user.id}')[1], [])
+
+    def test_overlapping_archive_runs(self):
+        """Test that a run losing the race keeps the winner's blob intact"""
+        original_write = archiver._write_blob
+        results = []
+
+        def write_during_other_run(thread):
+            result = original_write(thread)
+            if not results:
+                # A second run while this one holds the claim is turned away
+                results.append(archiver.archive(ChatThread.objects.get(pk=thread.pk)))
+                # One that got past the claim (it expired) archives the thread first
+                results.append(archiver._archive(ChatThread.objects.get(pk=thread.pk)))
+            return result
+
+        with patch.object(archiver, '_write_blob', side_effect=write_during_other_run):
+            results.append(archiver.archive(self.thread))
+
+        self.assertEqual(results, [False, True, False])
+        self.thread.refresh_from_db()
+        self.assertIsNotNone(self.thread.archived_at)
+        self.assertEqual(storages['archive'].listdir(f'chat/{self.user.id}')[1],
+                         [self.thread.archive_path.rsplit('/', 1)[1]])
+        self.assertEqual(len(list(archiver.iter_archived_messages(self.thread))), 5)
+        # The claim is released
+        self.assertTrue(archiver.archive(ChatThread.objects.create(user=self.user, title='Empty')))
+
+    def test_deleting_archived_thread_removes_blob(self):
+        """Test that the blob goes away with its thread"""
+        archiver.archive(self.thread)
+        path = self.thread.archive_path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.thread.delete()
+
+        self.assertFalse(storages['archive'].exists(path))
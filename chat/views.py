@@ -22,17 +22,20 @@ from rest_framework.response import Response
 # from rest_framework import status, permissions
 # from .models import ChatHistory
 # from .serializers import ChatHistorySerializer
-from django.conf import settings
-
-from openai import OpenAI
+from django.utils.decorators import method_decorator
+
+from backend.conditional import thread_condition, thread_flight_key
+from backend.idempotency import IdempotencyMixin
+from backend.locks import TurnQueueTimeout
+from backend.singleflight import single_flight
+from backend.throttling import ChatMessageRateThrottle, ConcurrencyLimitMixin
+from .archive import archiver
+from .conversation import send_message
 from .models import ChatThread
-from .serializers import ChatThreadSerializer
+from .pool import take_thread_id
+from .serializers import ChatThreadSerializer, ChatThreadSummarySerializer
 from .services import OpenAIAssistantService
 
-# OpenAI API call
-openai_api_key = settings.OPENAI_API_KEY
-client = OpenAI(api_key=openai_api_key)
-
 class AssistantListView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -66,6 +69,11 @@ class ChatThreadListCreateView(generics.ListCreateAPIView):
     def get_queryset(self):
         return ChatThread.objects.filter(user=self.request.user, is_active=True)
 
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return ChatThreadSummarySerializer
+        return ChatThreadSerializer
+
     def perform_create(self, serializer):
         assistant_id = self.request.data.get('assistant_id')
         if not assistant_id:
@@ -75,15 +83,13 @@ class ChatThreadListCreateView(generics.ListCreateAPIView):
             )
 
         try:
-            # Create OpenAI thread
-            openai_thread_id = OpenAIAssistantService.create_thread()
-            
-            # Create our thread with OpenAI IDs
+            # Use a pre-created OpenAI thread if one is pooled; otherwise it
+            # is created with the first message (chat.pool)
             serializer.save(
                 user=self.request.user,
                 title=self.request.data.get('title', 'New Chat'),
                 openai_assistant_id=assistant_id,
-                openai_thread_id=openai_thread_id
+                openai_thread_id=take_thread_id()
             )
         except Exception as e:
             return Response(
@@ -98,6 +104,20 @@ class ChatThreadDetailView(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         return ChatThread.objects.filter(user=self.request.user)
 
+    def get_object(self):
+        thread = super().get_object()
+        if self.request.method != 'DELETE':
+            archiver.ensure_hot(thread)
+        return thread
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        data = single_flight(
+            thread_flight_key('chat', instance, request), lambda: self.get_serializer(instance).data,
+            shared=False
+        )
+        return Response(data)
+
     def perform_destroy(self, instance):
         instance.is_active = False
         instance.save()
@@ -125,8 +145,11 @@ class ChatThreadDetailView(generics.RetrieveUpdateDestroyAPIView):
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
-class ChatMessageView(APIView):
+class ChatMessageView(IdempotencyMixin, ConcurrencyLimitMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [ChatMessageRateThrottle]
+    concurrency_scope = 'chat_message'
+    idempotency_scope = 'chat_message'
 
     def post(self, request):
         thread_id = request.data.get('thread_id')
@@ -141,40 +164,12 @@ class ChatMessageView(APIView):
         try:
             # Get the thread
             thread = ChatThread.objects.get(id=thread_id, user=request.user)
-            
-            # Add message to OpenAI thread
-            openai_message = OpenAIAssistantService.add_message(
-                thread.openai_thread_id,
-                message,
-                'user'
-            )
-
-            # Save user message locally
-            user_chat = ChatHistory.objects.create(
-                user=request.user,
-                thread=thread,
-                message=message,
-                role='user',
-                openai_message_id=openai_message['id']
-            )
-
-            # Run the assistant
-            assistant_response = OpenAIAssistantService.run_assistant(
-                thread.openai_thread_id,
-                thread.openai_assistant_id
-            )
 
-            # Save assistant's reply locally
-            assistant_chat = ChatHistory.objects.create(
-                user=request.user,
-                thread=thread,
-                message=assistant_response['message'],
-                role='assistant',
-                openai_message_id=assistant_response['run_id']
-            )
+            # Post the message, run the assistant and save both sides
+            assistant_chat = send_message(thread, request.user, message)
 
             return Response({
-                'message': assistant_response['message'],
+                'message': assistant_chat.message,
                 'thread_id': thread_id
             }, status=status.HTTP_200_OK)
 
@@ -183,12 +178,28 @@ class ChatMessageView(APIView):
                 {'error': 'Thread not found.'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except TurnQueueTimeout as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_409_CONFLICT
+            )
         except Exception as e:
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+def thread_messages_state(request, thread_id=None, **kwargs):
+    """Version and last-modified time of a thread's message list"""
+    state = ChatThread.objects.filter(id=thread_id, user=request.user).values_list(
+        'updated_at', 'message_count'
+    ).first()
+    if state is None:
+        return None
+    updated_at, message_count = state
+    return f'{updated_at.timestamp()}-{message_count}', updated_at
+
+@method_decorator(thread_condition(thread_messages_state), name='get')
 class ThreadMessagesView(generics.ListAPIView):
     serializer_class = ChatHistorySerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -196,7 +207,9 @@ class ThreadMessagesView(generics.ListAPIView):
     def get_queryset(self):
         thread_id = self.kwargs.get('thread_id')
         try:
-            thread = ChatThread.objects.get(id=thread_id, user=self.request.user)
+            thread = archiver.ensure_hot(
+                ChatThread.objects.get(id=thread_id, user=self.request.user)
+            )
             return ChatHistory.objects.filter(
                 thread=thread
             ).order_by('timestamp')
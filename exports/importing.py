@@ -0,0 +1,224 @@
+"""
+Bulk import of conversations from JSONL.
+
+Each line is one message in the export row format (see exports.streaming)::
+
+    {"source": "langchain", "thread_id": "abc", "thread_title": "Trip",
+     "message_id": "abc-1", "role": "user", "content": "...",
+     "timestamp": "2024-01-01T12:00:00+00:00", "metadata": {}}
+
+``thread_id`` and ``message_id`` are the keys in the system the data comes
+from; they are stored as ``external_id`` and make re-runs idempotent:
+threads are matched per user, messages per thread, and anything already
+imported is skipped. An export can therefore be imported elsewhere as is.
+
+Lines are read as a stream and written with bulk_create() in batches, one
+transaction per batch, and each batch's search entries are written by the
+database with INSERT ... SELECT. Lookups by id are split into chunks of
+LOOKUP_CHUNK_SIZE so a large batch stays under SQLite's limit on bound
+variables. Thread activity counters are recomputed once
+per thread when the import ends, including for threads whose messages were
+all skipped, so re-running an interrupted import also repairs them.
+"""
+import json
+import time
+from datetime import timezone as dt_timezone
+from typing import Callable, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from backend.renderers import orjson
+from langchain_chat.models import LangChainMessage
+from search.indexing import index_new_messages
+
+from .streaming import SOURCES
+
+ROLES = {role for role, _ in LangChainMessage.ROLE_CHOICES}
+DEFAULT_THREAD_TITLE = 'Imported conversation'
+# Rows per id lookup; a message lookup binds two ids per row, and SQLite
+# allows 999 variables in a query
+LOOKUP_CHUNK_SIZE = 400
+
+
+class ConversationImportError(Exception):
+    """Raised for a malformed input line; batches before it stay imported"""
+
+    def __init__(self, message, line=None):
+        super().__init__(message)
+        self.line = line
+
+
+def _loads(line):
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+class ConversationImporter:
+    """
+    Imports JSONL lines into ``user``'s threads. ``source`` is used for rows
+    that do not name one; ``progress`` is called with the running stats
+    after every batch.
+    """
+
+    def __init__(
+        self,
+        user,
+        source: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        progress: Optional[Callable[[Dict], None]] = None
+    ):
+        self.user = user
+        self.source = source
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.progress = progress
+        # external thread id -> pk, per source
+        self.threads = {name: {} for name in SOURCES}
+        self.stats = {'lines': 0, 'threads_created': 0, 'imported': 0, 'skipped': 0, 'seconds': 0.0}
+
+    def run(self, lines: Iterable) -> Dict:
+        started = time.perf_counter()
+        batch = []
+        try:
+            for number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                batch.append(self._parse(number, line))
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = []
+                    self._report(started)
+            if batch:
+                self._flush(batch)
+                self._report(started)
+        finally:
+            self._refresh_activity()
+            self.stats['seconds'] = time.perf_counter() - started
+        return self.stats
+
+    def _report(self, started):
+        if self.progress is not None:
+            self.stats['seconds'] = time.perf_counter() - started
+            self.progress(self.stats)
+
+    def _parse(self, number: int, line) -> Dict:
+        self.stats['lines'] = number
+        try:
+            data = _loads(line)
+        except ValueError as e:
+            raise ConversationImportError(f'Invalid JSON: {str(e)}', line=number)
+        if not isinstance(data, dict):
+            raise ConversationImportError('Expected a JSON object', line=number)
+
+        source = data.get('source') or self.source
+        if source not in SOURCES:
+            raise ConversationImportError(f'Unknown source {source!r}', line=number)
+        for key in ['thread_id', 'message_id']:
+            if data.get(key) in (None, ''):
+                raise ConversationImportError(f'{key} is required', line=number)
+        if data.get('role') not in ROLES:
+            raise ConversationImportError(f"Unknown role {data.get('role')!r}", line=number)
+        if not isinstance(data.get('content'), str):
+            raise ConversationImportError('content must be a string', line=number)
+
+        timestamp = data.get('timestamp')
+        if timestamp:
+            parsed = parse_datetime(timestamp) if isinstance(timestamp, str) else None
+            if parsed is None:
+                raise ConversationImportError(f'Invalid timestamp {timestamp!r}', line=number)
+            if timezone.is_naive(parsed):
+                parsed = timezone.make_aware(parsed, dt_timezone.utc)
+            timestamp = parsed
+        else:
+            timestamp = timezone.now()
+
+        return {
+            'source': source,
+            'thread_id': str(data['thread_id']),
+            'thread_title': (data.get('thread_title') or DEFAULT_THREAD_TITLE)[:255],
+            'message_id': str(data['message_id']),
+            'role': data['role'],
+            'content': data['content'],
+            'timestamp': timestamp,
+            'metadata': data.get('metadata') or {},
+        }
+
+    def _flush(self, rows):
+        with transaction.atomic():
+            for name in SOURCES:
+                source_rows = [row for row in rows if row['source'] == name]
+                if source_rows:
+                    self._import_rows(name, source_rows)
+
+    def _resolve_threads(self, name, rows):
+        """Map the rows' external thread ids to local threads, creating missing ones"""
+        thread_model, _, _, archiver = SOURCES[name]
+        known = self.threads[name]
+        titles = {}
+        for row in rows:
+            if row['thread_id'] not in known:
+                titles.setdefault(row['thread_id'], row['thread_title'])
+        if not titles:
+            return known
+
+        external_ids = list(titles)
+        for start in range(0, len(external_ids), LOOKUP_CHUNK_SIZE):
+            chunk = external_ids[start:start + LOOKUP_CHUNK_SIZE]
+            for thread in thread_model.objects.filter(user=self.user, external_id__in=chunk):
+                archiver.ensure_hot(thread)
+                known[thread.external_id] = thread.pk
+        created = thread_model.objects.bulk_create([
+            thread_model(user=self.user, title=title, external_id=external_id)
+            for external_id, title in titles.items()
+            if external_id not in known
+        ])
+        for thread in created:
+            known[thread.external_id] = thread.pk
+        self.stats['threads_created'] += len(created)
+        return known
+
+    def _import_rows(self, name, rows):
+        _, message_model, content_field, _ = SOURCES[name]
+        has_metadata = any(field.name == 'metadata' for field in message_model._meta.concrete_fields)
+        threads = self._resolve_threads(name, rows)
+
+        existing = set()
+        for start in range(0, len(rows), LOOKUP_CHUNK_SIZE):
+            chunk = rows[start:start + LOOKUP_CHUNK_SIZE]
+            existing.update(message_model.objects.filter(
+                thread_id__in={threads[row['thread_id']] for row in chunk},
+                external_id__in={row['message_id'] for row in chunk},
+            ).values_list('thread_id', 'external_id'))
+
+        messages = []
+        for row in rows:
+            key = (threads[row['thread_id']], row['message_id'])
+            if key in existing:
+                self.stats['skipped'] += 1
+                continue
+            existing.add(key)
+            values = {
+                'user': self.user,
+                'thread_id': key[0],
+                'external_id': key[1],
+                'role': row['role'],
+                content_field: row['content'],
+                'timestamp': row['timestamp'],
+            }
+            if has_metadata:
+                values['metadata'] = row['metadata']
+            messages.append(message_model(**values))
+
+        created = message_model.objects.bulk_create(messages)
+        index_new_messages(message_model, [message.pk for message in created])
+        self.stats['imported'] += len(created)
+
+    def _refresh_activity(self, chunk_size=500):
+        for name, known in self.threads.items():
+            thread_model = SOURCES[name][0]
+            pks = list(known.values())
+            for start in range(0, len(pks), chunk_size):
+                thread_model.objects.filter(pk__in=pks[start:start + chunk_size]).refresh_activity()
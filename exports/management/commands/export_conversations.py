@@ -0,0 +1,46 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from exports.streaming import FORMATS, SOURCES, export_stream
+
+
+class Command(BaseCommand):
+    help = 'Stream conversation history to a file (or stdout) as JSONL, CSV or zip'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='export_format', choices=list(FORMATS), default='jsonl')
+        parser.add_argument('--user', help='Email of the user to export; default is everyone')
+        parser.add_argument('--source', choices=list(SOURCES))
+        parser.add_argument('--thread', type=int, help='Export a single thread (requires --source)')
+        parser.add_argument('--output', help='File to write; default is stdout')
+
+    def handle(self, *args, **options):
+        if options['thread'] is not None and not options['source']:
+            raise CommandError('--thread requires --source')
+
+        user_id = None
+        if options['user']:
+            try:
+                user_id = get_user_model().objects.get(email=options['user']).pk
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"User {options['user']} not found")
+
+        chunks = export_stream(
+            options['export_format'],
+            user_id=user_id,
+            source=options['source'],
+            thread_id=options['thread']
+        )
+        if options['output']:
+            written = 0
+            with open(options['output'], 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    written += len(chunk)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,49 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from exports.importing import ConversationImporter, ConversationImportError
+from exports.streaming import SOURCES
+
+
+class Command(BaseCommand):
+    help = 'Import conversations from a JSONL file (or stdin) into a user\'s threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='JSONL file to read, or - for stdin')
+        parser.add_argument('--user', required=True, help='Email of the user to import into')
+        parser.add_argument('--source', choices=list(SOURCES), help='Source for rows that do not name one')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {options['user']} not found")
+
+        def progress(stats):
+            rate = stats['imported'] / stats['seconds'] if stats['seconds'] else 0
+            self.stdout.write(
+                f"{stats['lines']} lines read, {stats['imported']} imported, "
+                f"{stats['skipped']} skipped ({rate:,.0f} messages/s)"
+            )
+
+        importer = ConversationImporter(
+            user,
+            source=options['source'],
+            batch_size=options['batch_size'],
+            progress=progress
+        )
+        f = sys.stdin.buffer if options['input'] == '-' else open(options['input'], 'rb')
+        try:
+            stats = importer.run(f)
+        except ConversationImportError as e:
+            raise CommandError(f'Line {e.line}: {str(e)}')
+        finally:
+            if f is not sys.stdin.buffer:
+                f.close()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['imported']} messages into {stats['threads_created']} new threads "
+            f"({stats['skipped']} already present) in {stats['seconds']:.1f}s"
+        ))
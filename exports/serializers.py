@@ -0,0 +1,24 @@
+from rest_framework import serializers
+from .streaming import FORMATS, SOURCES
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    export_format = serializers.ChoiceField(choices=list(FORMATS), default='jsonl')
+    source = serializers.ChoiceField(choices=list(SOURCES), required=False)
+    thread_id = serializers.IntegerField(required=False, min_value=1)
+    # Staff only: another user's data, or everything
+    user_id = serializers.IntegerField(required=False, min_value=1)
+    all = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, data):
+        if 'thread_id' in data and 'source' not in data:
+            raise serializers.ValidationError({'source': 'Required when exporting a single thread.'})
+        return data
+
+
+class ImportQuerySerializer(serializers.Serializer):
+    # Used for rows that do not name their source
+    source = serializers.ChoiceField(choices=list(SOURCES), required=False)
+    batch_size = serializers.IntegerField(required=False, min_value=1, max_value=10000)
+    # Staff only: import into another user's account
+    user_id = serializers.IntegerField(required=False, min_value=1)
@@ -0,0 +1,165 @@
+"""
+Streaming exports of conversation history.
+
+iter_rows() walks messages with ``.iterator(chunk_size=...)`` (a server-side
+cursor on Postgres) and reads archived threads straight from their blobs,
+so neither the database rows nor the archive are ever held in memory as a
+whole. The writers turn rows into byte chunks for StreamingHttpResponse or
+a file.
+"""
+import csv
+import json
+import zipfile
+from typing import Dict, Iterable, Iterator, Optional
+
+from django.conf import settings
+
+from chat.archive import archiver as chat_archiver
+from chat.models import ChatHistory, ChatThread
+from langchain_chat.archive import archiver as langchain_archiver
+from langchain_chat.models import LangChainMessage, LangChainThread
+
+SOURCES = {
+    'chat': (ChatThread, ChatHistory, 'message', chat_archiver),
+    'langchain': (LangChainThread, LangChainMessage, 'content', langchain_archiver),
+}
+
+CSV_COLUMNS = ['source', 'thread_id', 'thread_title', 'message_id', 'role', 'timestamp', 'content', 'metadata']
+
+FORMATS = {
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'zip': ('application/zip', 'zip'),
+}
+
+
+def _row(source, thread_id, thread_title, message_id, role, content, timestamp, metadata=None) -> Dict:
+    return {
+        'source': source,
+        'thread_id': thread_id,
+        'thread_title': thread_title,
+        'message_id': message_id,
+        'role': role,
+        'timestamp': timestamp.isoformat() if timestamp else None,
+        'content': content,
+        'metadata': metadata,
+    }
+
+
+def iter_rows(
+    user_id: Optional[int] = None,
+    source: Optional[str] = None,
+    thread_id: Optional[int] = None,
+    chunk_size: Optional[int] = None
+) -> Iterator[Dict]:
+    """
+    Messages of one thread, of one user's threads, or of everything, grouped
+    by source and thread. Archived threads follow the live ones.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    for name in ([source] if source else SOURCES):
+        thread_model, message_model, content_field, archiver = SOURCES[name]
+        fields = ['id', 'thread_id', 'thread__title', 'role', content_field, 'timestamp']
+        has_metadata = any(field.name == 'metadata' for field in message_model._meta.concrete_fields)
+        if has_metadata:
+            fields.append('metadata')
+
+        messages = message_model.objects.filter(thread__archived_at__isnull=True)
+        threads = thread_model.objects.filter(archived_at__isnull=False)
+        if user_id is not None:
+            messages = messages.filter(user_id=user_id)
+            threads = threads.filter(user_id=user_id)
+        if thread_id is not None:
+            messages = messages.filter(thread_id=thread_id)
+            threads = threads.filter(pk=thread_id)
+
+        for values in messages.order_by('thread_id', 'id').values_list(*fields).iterator(chunk_size=chunk_size):
+            message_id, message_thread_id, title, role, content, timestamp = values[:6]
+            yield _row(name, message_thread_id, title, message_id, role, content, timestamp,
+                       values[6] if has_metadata else None)
+
+        for thread in threads.order_by('pk').iterator(chunk_size=chunk_size):
+            for message in archiver.iter_archived_messages(thread):
+                yield _row(name, thread.pk, thread.title, message.pk, message.role,
+                           getattr(message, content_field), message.timestamp,
+                           message.metadata if has_metadata else None)
+
+
+class _Buffer:
+    """Write target that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(part.encode() if isinstance(part, str) else part for part in self.parts)
+        self.parts = []
+        return data
+
+
+def _dumps(row: Dict) -> bytes:
+    return json.dumps(row, ensure_ascii=False).encode() + b'\n'
+
+
+def write_jsonl(rows: Iterable[Dict], batch: int = 100) -> Iterator[bytes]:
+    lines = []
+    for row in rows:
+        lines.append(_dumps(row))
+        if len(lines) >= batch:
+            yield b''.join(lines)
+            lines = []
+    if lines:
+        yield b''.join(lines)
+
+
+def write_csv(rows: Iterable[Dict], batch: int = 100) -> Iterator[bytes]:
+    buffer = _Buffer()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for n, row in enumerate(rows, 1):
+        if row['metadata'] is not None:
+            row = {**row, 'metadata': json.dumps(row['metadata'], ensure_ascii=False)}
+        writer.writerow([row[column] for column in CSV_COLUMNS])
+        if n % batch == 0:
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def write_zip(rows: Iterable[Dict]) -> Iterator[bytes]:
+    """A zip with one JSONL file per thread, written without seeking"""
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        current = None
+        entry = None
+        for row in rows:
+            key = (row['source'], row['thread_id'])
+            if key != current:
+                if entry is not None:
+                    entry.close()
+                current = key
+                entry = archive.open(f'{row["source"]}/thread_{row["thread_id"]}.jsonl', mode='w', force_zip64=True)
+            entry.write(_dumps(row))
+            data = buffer.drain()
+            if data:
+                yield data
+        if entry is not None:
+            entry.close()
+    yield buffer.drain()
+
+
+WRITERS = {
+    'jsonl': write_jsonl,
+    'csv': write_csv,
+    'zip': write_zip,
+}
+
+
+def export_stream(export_format: str, **scope) -> Iterator[bytes]:
+    return WRITERS[export_format](iter_rows(**scope))
@@ -0,0 +1,287 @@
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.http import StreamingHttpResponse
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from io import BytesIO, StringIO
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import zipfile
+from unittest.mock import patch
+from chat.archive import archiver as chat_archiver
+from chat.models import ChatThread, ChatHistory
+from langchain_chat.archive import archiver as langchain_archiver
+from langchain_chat.models import LangChainThread, LangChainMessage
+
+User = get_user_model()
+
+
+class ExportAPITestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpass123',
+            first_name='Test',
+            last_name='User'
+        )
+        self.other_user = User.objects.create_user(
+            email='other@example.com',
+            password='testpass123',
+            first_name='Other',
+            last_name='User'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(EXPORT_CHUNK_SIZE=2, STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            'archive': {
+                'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                'OPTIONS': {'location': self.archive_dir.name},
+            },
+        })
+        self.settings_override.enable()
+
+        self.chat_thread = ChatThread.objects.create(user=self.user, title='Chat')
+        for i in range(3):
+            ChatHistory.objects.create_in_thread(
+                self.chat_thread, user=self.user, role='user', message=f'chat, "quoted"\nline {i}'
+            )
+        self.archived_thread = ChatThread.objects.create(user=self.user, title='Old')
+        ChatHistory.objects.create_in_thread(self.archived_thread, user=self.user, role='user', message='archived')
+        chat_archiver.archive(self.archived_thread)
+
+        self.langchain_thread = LangChainThread.objects.create(user=self.user, title='LangChain')
+        LangChainMessage.objects.create_in_thread(
+            self.langchain_thread, user=self.user, role='assistant', content='héllo', metadata={'tokens': 3}
+        )
+        other_thread = ChatThread.objects.create(user=self.other_user, title='Other')
+        ChatHistory.objects.create_in_thread(other_thread, user=self.other_user, role='user', message='private')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.archive_dir.cleanup()
+
+    def export(self, **params):
+        response = self.client.get(reverse('export'), params)
+        if isinstance(response, StreamingHttpResponse):
+            response.body = b''.join(response.streaming_content)
+        return response
+
+    def test_jsonl_export_of_own_threads(self):
+        """Test that a user's export covers live and archived threads only"""
+        response = self.export()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        rows = [json.loads(line) for line in response.body.splitlines()]
+        self.assertEqual(
+            [(row['source'], row['thread_id']) for row in rows],
+            [('chat', self.chat_thread.id)] * 3 + [('chat', self.archived_thread.id),
+                                                  ('langchain', self.langchain_thread.id)]
+        )
+        self.assertEqual(rows[3]['content'], 'archived')
+        self.assertEqual(rows[4]['metadata'], {'tokens': 3})
+        self.assertNotIn('private', response.body.decode())
+
+        # Exporting does not rehydrate archived threads
+        self.archived_thread.refresh_from_db()
+        self.assertIsNotNone(self.archived_thread.archived_at)
+
+    def test_csv_export_of_single_thread(self):
+        """Test CSV quoting and the single-thread scope"""
+        response = self.export(export_format='csv', source='chat', thread_id=self.chat_thread.id)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = list(csv.DictReader(io.StringIO(response.body.decode())))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['content'], 'chat, "quoted"\nline 0')
+        self.assertEqual(rows[0]['thread_title'], 'Chat')
+
+    def test_streamed_export_is_compressed(self):
+        """Test that JSONL exports are gzipped chunk by chunk"""
+        response = self.client.get(reverse('export'), HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(lines), 5)
+
+    def test_zip_export(self):
+        """Test that the zip holds one JSONL file per thread"""
+        response = self.export(export_format='zip')
+
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(BytesIO(response.body)) as archive:
+            self.assertEqual(sorted(archive.namelist()), sorted([
+                f'chat/thread_{self.chat_thread.id}.jsonl',
+                f'chat/thread_{self.archived_thread.id}.jsonl',
+                f'langchain/thread_{self.langchain_thread.id}.jsonl',
+            ]))
+            lines = archive.read(f'chat/thread_{self.chat_thread.id}.jsonl').splitlines()
+        self.assertEqual(len(lines), 3)
+
+    def test_scope_checks(self):
+        """Test that other users' threads and everything-exports are refused"""
+        other_thread = ChatThread.objects.get(user=self.other_user)
+        response = self.export(source='chat', thread_id=other_thread.id)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.export(all='true').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.export(thread_id=self.chat_thread.id).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_staff_can_export_everything(self):
+        """Test the compliance export across all users"""
+        self.user.is_staff = True
+        self.user.save()
+
+        response = self.export(all='true', source='chat')
+
+        contents = [json.loads(line)['content'] for line in response.body.splitlines()]
+        self.assertIn('private', contents)
+        self.assertEqual(len(contents), 5)
+
+    def test_export_command(self):
+        """Test the management command writing a file"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.jsonl')
+            call_command('export_conversations', user='test@example.com', output=path, stderr=StringIO())
+            with open(path) as f:
+                self.assertEqual(len(f.readlines()), 5)
+
+
+class ImportTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpass123',
+            first_name='Test',
+            last_name='User'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.lines = [
+            {'source': 'langchain', 'thread_id': 'trip', 'thread_title': 'Trip', 'message_id': f'trip-{i}',
+             'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'about lisbon {i}',
+             'timestamp': f'2024-01-01T12:00:0{i}+00:00', 'metadata': {'n': i}}
+            for i in range(5)
+        ] + [
+            {'source': 'chat', 'thread_id': 7, 'message_id': 1, 'role': 'user', 'content': 'hello'},
+        ]
+
+    def jsonl(self, rows):
+        return ''.join(json.dumps(row) + '\n' for row in rows)
+
+    def import_file(self, rows, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'import.jsonl')
+            with open(path, 'w') as f:
+                f.write(self.jsonl(rows))
+            out = StringIO()
+            call_command('import_conversations', path, user='test@example.com', stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_command_is_idempotent(self):
+        """Test batched import, counters, search entries and skipping on re-runs"""
+        output = self.import_file(self.lines, batch_size=2)
+
+        self.assertIn('Imported 6 messages into 2 new threads', output)
+        self.assertIn('2 lines read', output)
+        thread = LangChainThread.objects.get(user=self.user, external_id='trip')
+        self.assertEqual(thread.title, 'Trip')
+        self.assertEqual(thread.message_count, 5)
+        self.assertEqual(thread.last_message_preview, 'about lisbon 4')
+        messages = list(thread.messages.order_by('timestamp'))
+        self.assertEqual(messages[0].metadata, {'n': 0})
+        self.assertEqual(messages[1].timestamp.second, 1)
+        chat_thread = ChatThread.objects.get(user=self.user, external_id='7')
+        self.assertEqual(chat_thread.title, 'Imported conversation')
+        self.assertEqual(chat_thread.messages.get().message, 'hello')
+        self.assertEqual(self.user.search_entries.count(), 6)
+
+        # Re-running with one new message only imports that one
+        extra = {'source': 'langchain', 'thread_id': 'trip', 'message_id': 'trip-5',
+                 'role': 'user', 'content': 'one more'}
+        output = self.import_file(self.lines + [extra])
+
+        self.assertIn('Imported 1 messages into 0 new threads (6 already present)', output)
+        thread.refresh_from_db()
+        self.assertEqual(thread.message_count, 6)
+        self.assertEqual(LangChainThread.objects.filter(user=self.user).count(), 1)
+
+    @patch('exports.importing.LOOKUP_CHUNK_SIZE', 2)
+    def test_import_chunks_lookups(self):
+        """Test that lookups split into chunks still find existing threads and messages"""
+        rows = self.lines + [
+            {'source': 'langchain', 'thread_id': f'other-{i}', 'message_id': f'other-{i}', 'role': 'user', 'content': 'hi'}
+            for i in range(3)
+        ]
+        self.import_file(rows, batch_size=100)
+        output = self.import_file(rows, batch_size=100)
+
+        self.assertIn('Imported 0 messages into 0 new threads (9 already present)', output)
+        self.assertEqual(self.user.search_entries.count(), 9)
+
+    def test_import_rehydrates_archived_thread(self):
+        """Test that importing into an archived thread restores it first"""
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        storages = {
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            'archive': {
+                'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                'OPTIONS': {'location': archive_dir.name},
+            },
+        }
+        with override_settings(STORAGES=storages):
+            self.import_file(self.lines[:1])
+            thread = LangChainThread.objects.get(external_id='trip')
+            with self.captureOnCommitCallbacks(execute=True):
+                langchain_archiver.archive(thread)
+                self.import_file(self.lines[:2])
+
+        thread.refresh_from_db()
+        self.assertIsNone(thread.archived_at)
+        self.assertEqual(thread.messages.count(), 2)
+
+    def test_import_endpoint(self):
+        """Test importing a raw JSONL body and a multipart upload"""
+        response = self.client.post(
+            reverse('import'), self.jsonl(self.lines), content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['imported'], 6)
+
+        upload = BytesIO(self.jsonl(self.lines).encode())
+        upload.name = 'conversations.jsonl'
+        response = self.client.post(reverse('import'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['skipped'], 6)
+        self.assertEqual(response.data['imported'], 0)
+
+    def test_import_reports_bad_line(self):
+        """Test that a malformed line stops the import with its line number"""
+        body = self.jsonl(self.lines[:2]) + '{"source": "chat", "role": "user"}\n'
+        response = self.client.post(
+            reverse('import') + '?batch_size=1', body, content_type='application/x-ndjson'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['line'], 3)
+        self.assertEqual(response.data['imported'], 2)
+        self.assertEqual(LangChainThread.objects.get(external_id='trip').message_count, 2)
+
+    def test_staff_only_import_for_other_user(self):
+        """Test that importing into another account needs staff"""
+        response = self.client.post(
+            reverse('import') + f'?user_id={self.user.id}', self.jsonl(self.lines),
+            content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,109 @@
+from django.contrib.auth import get_user_model
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .importing import ConversationImporter, ConversationImportError
+from .serializers import ExportQuerySerializer, ImportQuerySerializer
+from .streaming import FORMATS, SOURCES, export_stream
+
+
+class ExportView(APIView):
+    """
+    Stream conversation history as JSONL, CSV or a zip of per-thread JSONL
+    files. Users export their own threads; staff may pass ``user_id`` or
+    ``all=true``.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        serializer = ExportQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        user_id = request.user.id
+        if params.get('user_id') or params['all']:
+            if not request.user.is_staff:
+                return Response(
+                    {'error': 'Only staff can export other users\' conversations.'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            user_id = None if params['all'] else params['user_id']
+
+        source = params.get('source')
+        thread_id = params.get('thread_id')
+        if thread_id is not None:
+            thread_model = SOURCES[source][0]
+            threads = thread_model.objects.filter(pk=thread_id)
+            if user_id is not None:
+                threads = threads.filter(user_id=user_id)
+            if not threads.exists():
+                return Response(
+                    {'error': 'Thread not found.'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+        export_format = params['export_format']
+        content_type, extension = FORMATS[export_format]
+        response = StreamingHttpResponse(
+            export_stream(export_format, user_id=user_id, source=source, thread_id=thread_id),
+            content_type=content_type
+        )
+        filename = f'conversations-{timezone.now():%Y%m%d-%H%M%S}.{extension}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class ImportView(APIView):
+    """
+    Import conversations from JSONL, sent either as the request body
+    (``Content-Type: application/x-ndjson``) or as a multipart ``file``
+    upload. Either way the input is read line by line. Staff may import
+    into another user's account with ``user_id``.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        serializer = ImportQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        user = request.user
+        if params.get('user_id'):
+            if not request.user.is_staff:
+                return Response(
+                    {'error': 'Only staff can import into other users\' accounts.'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            try:
+                user = get_user_model().objects.get(pk=params['user_id'])
+            except get_user_model().DoesNotExist:
+                return Response(
+                    {'error': 'User not found.'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+        if request.content_type.startswith('multipart/'):
+            lines = request.FILES.get('file')
+        else:
+            lines = request.stream
+        if lines is None:
+            return Response(
+                {'error': 'No JSONL input provided.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        importer = ConversationImporter(user, source=params.get('source'), batch_size=params.get('batch_size'))
+        try:
+            stats = importer.run(lines)
+        except ConversationImportError as e:
+            return Response(
+                {'error': str(e), 'line': e.line, **importer.stats},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(stats)
@@ -0,0 +1,76 @@
+"""
+Production gunicorn settings, picked up from the working directory:
+
+    gunicorn backend.wsgi
+
+The application is preloaded in the master and warmed up there (see
+backend.warmup and backend.prefork), then frozen out of the garbage
+collector so workers share those pages instead of each holding a copy.
+Each worker finishes warming up (database and OpenAI connections) before
+it accepts requests. Workers log their memory use when they start and
+every GUNICORN_MEMORY_LOG_INTERVAL requests.
+"""
+import gc
+import multiprocessing
+from os import getenv
+
+bind = getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(getenv('GUNICORN_WORKERS', str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(getenv('GUNICORN_THREADS', '1'))
+timeout = int(getenv('GUNICORN_TIMEOUT', '120'))
+max_requests = int(getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(getenv('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+preload_app = getenv('GUNICORN_PRELOAD', 'True') == 'True'
+gc_freeze = preload_app and getenv('GUNICORN_GC_FREEZE', 'True') == 'True'
+memory_log_interval = int(getenv('GUNICORN_MEMORY_LOG_INTERVAL', '1000'))
+
+if gc_freeze:
+    # Collections while the app loads would leave freed gaps among the
+    # objects workers share (see backend.prefork.freeze)
+    gc.disable()
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded application is imported
+    if not preload_app:
+        return
+    from backend import prefork
+    from backend.warmup import warmup
+    warmup.run_shared()
+    prefork.close_connections()
+    if gc_freeze:
+        prefork.freeze()
+        gc.enable()
+    server.log.info("Master warmed up: %s", prefork.format_memory_usage())
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        from backend import prefork
+        prefork.close_connections()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from backend import prefork
+        prefork.reset_after_fork()
+    gc.enable()
+
+
+def post_worker_init(worker):
+    from backend import prefork
+    from backend.warmup import warmup
+    warmup.run()
+    worker.requests_served = 0
+    worker.log.info("Worker ready: %s", prefork.format_memory_usage())
+
+
+def post_request(worker, req, environ, resp):
+    if not memory_log_interval:
+        return
+    worker.requests_served += 1
+    if worker.requests_served % memory_log_interval == 0:
+        from backend import prefork
+        worker.log.info(
+            "Worker memory after %d requests: %s", worker.requests_served, prefork.format_memory_usage()
+        )
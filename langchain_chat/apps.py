@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class LangchainChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'langchain_chat'
+
+    def ready(self):
+        from .archive import archiver
+        archiver.connect()
@@ -0,0 +1,11 @@
+from backend.archive import ThreadArchiver
+from .models import LangChainThread, LangChainMessage
+
+
+class LangChainThreadArchiver(ThreadArchiver):
+    thread_model = LangChainThread
+    message_model = LangChainMessage
+    kind = 'langchain'
+
+
+archiver = LangChainThreadArchiver()
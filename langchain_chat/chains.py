@@ -0,0 +1,268 @@
+"""
+The conversation pipeline, built once per process.
+
+    {input, history} -> compiled prompt -> chat model -> text
+
+wrapped in RunnableWithMessageHistory, which reads the history from and
+writes replies to LangChainMessage. Everything that varies per turn (the
+thread, model, temperature, compiled prompt, metadata for the saved reply)
+travels in a Turn passed as the ``turn`` configurable rather than in the
+inputs, which tracers serialise at every step. A request builds no chain
+objects; chat models are created once per model name. Unless the turn
+names a model, the router picks one once the prompt is formatted, and the
+decision is stored with the reply under ``metadata['routing']``. With
+HEDGE_ENABLED, a call whose first token is late is hedged with a duplicate.
+A turn with a ``cancel`` event stops streaming once it is set.
+
+The runnable supports invoke, batch, stream and their async variants::
+
+    turn = Turn(thread, user_id, prompt_for_thread(thread))
+    get_conversation_chain().invoke({'input': 'Hello'}, config=turn.config())
+
+The reply is saved from a run listener, which LangChain calls in the
+thread that finished the run: the caller's for invoke and stream, worker
+threads (with their own database connections) for batch and the async
+variants. Listener errors are only logged, so check ``turn.reply``.
+"""
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from django.conf import settings
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.chat_models import generate_from_stream
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import ConfigurableFieldSpec, RunnableLambda
+from langchain_core.runnables.history import RunnableWithMessageHistory
+
+from backend.hedging import hedged_iter
+from .models import LangChainMessage
+from .routing import ModelRouter, Route, RoutingCallback, count_tokens
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+
+class Turn:
+    """
+    One conversation turn. ``user_message`` is the already saved message
+    being answered, if the caller recorded it before running the chain;
+    otherwise the chain saves the input itself. ``reply`` is set to the
+    saved assistant message once the chain finishes. Setting ``cancel``
+    stops a streaming reply early; what was generated is saved with
+    ``metadata['truncated']``.
+    """
+
+    def __init__(
+        self,
+        thread,
+        user_id: int,
+        prompt: ChatPromptTemplate,
+        model_name: Optional[str] = None,
+        temperature: float = 0.7,
+        user_message: Optional[LangChainMessage] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        api_key: Optional[str] = None,
+        cancel: Optional[threading.Event] = None
+    ):
+        self.thread = thread
+        self.user_id = user_id
+        self.prompt = prompt
+        # None lets the router choose (see routing.py)
+        self.model_name = model_name
+        self.temperature = temperature
+        self.user_message = user_message
+        self.metadata = metadata if metadata is not None else {}
+        self.api_key = api_key or settings.OPENAI_API_KEY
+        self.cancel = cancel
+        self.reply = None
+
+    def stop_requested(self) -> bool:
+        """Whether the caller asked to stop; if so the reply is marked truncated"""
+        if self.cancel is None or not self.cancel.is_set():
+            return False
+        self.metadata['truncated'] = True
+        return True
+
+    def config(self, **config) -> Dict[str, Any]:
+        configurable = {**config.pop('configurable', {}), 'turn': self}
+        return {**config, 'configurable': configurable}
+
+
+class ThreadMessageHistory(BaseChatMessageHistory):
+    """
+    A thread's conversation as stored in LangChainMessage. The messages are
+    read when the history is created, which happens in the calling thread:
+    RunnableWithMessageHistory reads ``messages`` from a worker thread, and
+    database access there would use another connection.
+    """
+
+    def __init__(self, turn: Turn):
+        self.turn = turn
+        stored = LangChainMessage.objects.filter(thread=turn.thread).exclude(role='system')
+        if turn.user_message is not None:
+            stored = stored.exclude(pk=turn.user_message.pk)
+        self._messages = [
+            HumanMessage(content=content) if role == 'user' else AIMessage(content=content)
+            for role, content in stored.order_by('timestamp', 'id').values_list('role', 'content')
+        ]
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return list(self._messages)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        turn = self.turn
+        for message in messages:
+            if isinstance(message, HumanMessage):
+                # The input may carry retrieved context; the caller's saved
+                # message holds what the user actually wrote
+                if turn.user_message is None:
+                    turn.user_message = LangChainMessage.objects.create_in_thread(
+                        turn.thread, user_id=turn.user_id, content=message.content, role='user'
+                    )
+            else:
+                turn.reply = LangChainMessage.objects.create_in_thread(
+                    turn.thread,
+                    user_id=turn.user_id,
+                    content=message.content,
+                    role='assistant',
+                    metadata=turn.metadata
+                )
+        self._messages.extend(messages)
+
+    def clear(self) -> None:
+        raise NotImplementedError("Threads are deleted through LangChainService.delete_thread")
+
+
+@lru_cache(maxsize=None)
+def get_llm(model_name: str, api_key: str) -> 'ChatOpenAI':
+    """Chat model for a model name; temperature is bound per turn"""
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model_name=model_name,
+        streaming=True,
+        openai_api_key=api_key,
+        timeout=settings.MODEL_ROUTER_TIMEOUT,
+        max_retries=settings.MODEL_ROUTER_MAX_RETRIES
+    )
+
+
+def _report_token(chunk: ChatGenerationChunk, run_manager) -> ChatGenerationChunk:
+    """
+    Tell callbacks about a chunk when _stream is called from _generate.
+    stream() reports the chunks itself and passes no run_manager; invoke()
+    goes through _generate, and without this the routing callback would
+    see no first token and take the whole generation for its latency.
+    """
+    if run_manager is not None:
+        run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+    return chunk
+
+
+class HedgedChatModel(BaseChatModel):
+    """
+    Streams from ``model``, sending a duplicate request if the first token
+    is late (see backend.hedging). Hedges are budgeted per ``hedge_key``.
+    """
+    model: BaseChatModel
+    hedge_key: str
+
+    @property
+    def _llm_type(self) -> str:
+        return 'hedged'
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        for chunk in hedged_iter(lambda: self.model.stream(messages, stop=stop, **kwargs), self.hedge_key):
+            yield _report_token(ChatGenerationChunk(message=chunk), run_manager)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+
+class CancellableChatModel(BaseChatModel):
+    """
+    Streams from ``model`` until ``should_stop`` returns True, checked
+    between chunks. The reply then ends early as if complete, so the partial
+    text is saved and no fallback runs. Closing the inner stream closes the
+    upstream response, which stops generation. (Closing the chain's own
+    stream would not: LangChain drains it.)
+    """
+    model: BaseChatModel
+    should_stop: Callable[[], bool]
+
+    @property
+    def _llm_type(self) -> str:
+        return 'cancellable'
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        stream = self.model.stream(messages, stop=stop, **kwargs)
+        try:
+            for chunk in stream:
+                yield _report_token(ChatGenerationChunk(message=chunk), run_manager)
+                if self.should_stop():
+                    return
+        finally:
+            stream.close()
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+
+def _format_prompt(inputs: Dict[str, Any], config):
+    return config['configurable']['turn'].prompt.invoke(inputs)
+
+
+def _select_model(prompt_value, config):
+    turn = config['configurable']['turn']
+    prompt_tokens = count_tokens(prompt_value.to_messages())
+    if turn.model_name:
+        route = Route(turn.model_name, None, 'explicit', prompt_tokens)
+    else:
+        route = ModelRouter().choose(turn.thread, prompt_tokens)
+    turn.metadata['routing'] = route.as_metadata()
+    callback = RoutingCallback(turn)
+
+    def candidate(model_name):
+        llm = get_llm(model_name, turn.api_key)
+        if settings.HEDGE_ENABLED:
+            llm = HedgedChatModel(model=llm, hedge_key=model_name)
+        if turn.cancel is not None:
+            llm = CancellableChatModel(model=llm, should_stop=turn.stop_requested)
+        return llm.bind(temperature=turn.temperature).with_config(
+            metadata={'router_model': model_name}, callbacks=[callback]
+        )
+
+    llm = candidate(route.model)
+    if route.fallback:
+        llm = llm.with_fallbacks([candidate(route.fallback)])
+    return llm
+
+
+def _history_for(turn: Turn) -> ThreadMessageHistory:
+    return ThreadMessageHistory(turn)
+
+
+@lru_cache(maxsize=None)
+def get_conversation_chain() -> RunnableWithMessageHistory:
+    pipeline = RunnableLambda(_format_prompt) | RunnableLambda(_select_model) | StrOutputParser()
+    return RunnableWithMessageHistory(
+        pipeline,
+        _history_for,
+        input_messages_key='input',
+        history_messages_key='history',
+        history_factory_config=[
+            ConfigurableFieldSpec(
+                id='turn',
+                annotation=Turn,
+                name='Turn',
+                description='The thread and settings of this conversation turn',
+                default=None,
+                is_shared=True,
+            ),
+        ],
+    )
@@ -0,0 +1,26 @@
+from backend.throttling import LangChainMessageRateThrottle
+from backend.websocket import ThreadConsumer
+from .models import LangChainThread
+from .serializers import MessageInputSerializer
+from .services import LangChainService
+
+
+class LangChainThreadConsumer(ThreadConsumer):
+    """Live updates and streamed replies for a LangChain thread"""
+    channel_kind = 'langchain'
+    throttle_classes = [LangChainMessageRateThrottle]
+    concurrency_scope = 'langchain_message'
+    serializer_class = MessageInputSerializer
+
+    def get_thread(self, user, thread_id):
+        return LangChainThread.objects.filter(id=thread_id, user=user).first()
+
+    def run_turn(self, data, on_token, cancel):
+        LangChainService().process_message(
+            thread_id=self.thread.id,
+            user_id=self.user.id,
+            content=data['content'],
+            temperature=data['temperature'],
+            on_token=on_token,
+            cancel=cancel
+        )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from langchain_chat.models import LangChainThread
+
+
+class Command(BaseCommand):
+    help = 'Recompute message_count and last-message fields on LangChain threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = LangChainThread.objects.count()
+        done = 0
+        last_pk = 0
+        while True:
+            pks = list(
+                LangChainThread.objects.filter(pk__gt=last_pk)
+                .order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            LangChainThread.objects.filter(pk__in=pks).refresh_activity()
+            done += len(pks)
+            last_pk = pks[-1]
+            self.stdout.write(f'{done}/{total} threads updated')
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {done} LangChain threads'))
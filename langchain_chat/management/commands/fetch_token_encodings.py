@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from langchain_chat.routing import encoding_cache_path, load_encoding
+
+
+class Command(BaseCommand):
+    help = 'Download tiktoken encodings into MODEL_ROUTER_TOKEN_CACHE_DIR so workers can load them offline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('encodings', nargs='*', help='Defaults to MODEL_ROUTER_TOKEN_ENCODING')
+
+    def handle(self, *args, **options):
+        for name in options['encodings'] or [settings.MODEL_ROUTER_TOKEN_ENCODING]:
+            try:
+                load_encoding(name, offline=False)
+            except Exception as e:
+                raise CommandError(f"Could not fetch {name}: {e}")
+            self.stdout.write(self.style.SUCCESS(f'{name}: {encoding_cache_path(name)}'))
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.7 on 2026-10-19 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('langchain_chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='langchainthread',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='langchainthread',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='langchainthread',
+            name='last_message_role',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='langchainthread',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.7 on 2026-10-19 11:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('langchain_chat', '0003_knowledge_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='langchainthread',
+            name='archive_path',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='langchainthread',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='langchainmessage',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
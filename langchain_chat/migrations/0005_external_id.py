@@ -0,0 +1,33 @@
+# Generated by Django 5.0.7 on 2026-10-19 11:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('langchain_chat', '0004_thread_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='langchainmessage',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='langchainthread',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='langchainmessage',
+            constraint=models.UniqueConstraint(condition=models.Q(('external_id__isnull', False)), fields=('thread', 'external_id'), name='langchain_message_unique_external_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='langchainthread',
+            constraint=models.UniqueConstraint(condition=models.Q(('external_id__isnull', False)), fields=('user', 'external_id'), name='langchain_thread_unique_external_id'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.7 on 2026-10-19 11:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('langchain_chat', '0005_external_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromptTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('system_prompt', models.TextField()),
+                ('human_template', models.TextField(default='{input}')),
+                ('content_hash', models.CharField(editable=False, max_length=64)),
+                ('is_default', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='prompt_templates', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['name', '-version'],
+            },
+        ),
+        migrations.AddField(
+            model_name='langchainthread',
+            name='prompt_template',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='threads', to='langchain_chat.prompttemplate'),
+        ),
+        migrations.AddConstraint(
+            model_name='prompttemplate',
+            constraint=models.UniqueConstraint(fields=('user', 'name', 'version'), name='prompt_template_unique_version'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.7 on 2026-10-19 12:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('langchain_chat', '0006_prompt_template'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='prompttemplate',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('name', 'version'), name='prompt_template_unique_site_version'),
+        ),
+    ]
@@ -1,5 +1,33 @@
-from django.db import models
+import hashlib
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Substr
 from django.conf import settings
+from django.utils import timezone
+
+LAST_MESSAGE_PREVIEW_LENGTH = 100
+
+class LangChainThreadQuerySet(models.QuerySet):
+    def refresh_activity(self):
+        """Recompute the denormalised message counters, ignoring system messages"""
+        messages = LangChainMessage.objects.filter(
+            thread=OuterRef('pk')
+        ).exclude(role='system').order_by()
+        last_message = messages.order_by('-timestamp', '-id')
+        return self.update(
+            message_count=Coalesce(
+                Subquery(messages.values('thread').annotate(n=Count('id')).values('n')), 0
+            ),
+            last_message_at=Subquery(last_message.values('timestamp')[:1]),
+            last_message_role=Coalesce(Subquery(last_message.values('role')[:1]), Value('')),
+            last_message_preview=Coalesce(
+                Subquery(last_message.annotate(
+                    preview=Substr('content', 1, LAST_MESSAGE_PREVIEW_LENGTH)
+                ).values('preview')[:1]),
+                Value('')
+            ),
+        )
 
 class LangChainThread(models.Model):
     user = models.ForeignKey(
@@ -14,12 +42,60 @@ class LangChainThread(models.Model):
     model_name = models.CharField(max_length=100, default='gpt-3.5-turbo')
     langchain_memory_key = models.CharField(max_length=255, null=True, blank=True)
     metadata = models.JSONField(default=dict, blank=True)
+    # Denormalised activity, kept in sync by LangChainMessage.objects.create_in_thread()
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_role = models.CharField(max_length=20, blank=True, default='')
+    last_message_preview = models.CharField(max_length=255, blank=True, default='')
+    # Set while the messages live in cold storage (see backend.archive)
+    archived_at = models.DateTimeField(null=True, blank=True)
+    archive_path = models.CharField(max_length=255, blank=True, default='')
+    # Key of the thread in the system it was imported from (see exports.importing)
+    external_id = models.CharField(max_length=255, null=True, blank=True)
+    # Prompt version the thread was created with; None uses its stored system message
+    prompt_template = models.ForeignKey(
+        'PromptTemplate',
+        on_delete=models.SET_NULL,
+        related_name='threads',
+        null=True,
+        blank=True
+    )
+
+    objects = LangChainThreadQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.title} - {self.user.username}"
 
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'external_id'],
+                condition=models.Q(external_id__isnull=False),
+                name='langchain_thread_unique_external_id'
+            ),
+        ]
+
+class LangChainMessageManager(models.Manager):
+    def create_in_thread(self, thread, **kwargs):
+        """
+        Create a message and bump its thread's activity counters atomically.
+        System messages are not counted as conversation activity.
+        """
+        with transaction.atomic():
+            message = self.create(thread=thread, **kwargs)
+            if message.role == 'system':
+                return message
+            now = timezone.now()
+            LangChainThread.objects.filter(pk=thread.pk).update(
+                message_count=F('message_count') + 1,
+                last_message_at=message.timestamp,
+                last_message_role=message.role,
+                last_message_preview=message.content[:LAST_MESSAGE_PREVIEW_LENGTH],
+                updated_at=now,
+            )
+        thread.updated_at = now
+        return message
 
 class LangChainMessage(models.Model):
     ROLE_CHOICES = [
@@ -40,11 +116,134 @@ class LangChainMessage(models.Model):
     )
     content = models.TextField()
     role = models.CharField(max_length=20, choices=ROLE_CHOICES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     metadata = models.JSONField(default=dict, blank=True)
+    external_id = models.CharField(max_length=255, null=True, blank=True)
+
+    objects = LangChainMessageManager()
 
     class Meta:
         ordering = ['timestamp']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['thread', 'external_id'],
+                condition=models.Q(external_id__isnull=False),
+                name='langchain_message_unique_external_id'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.role} - {self.thread.title}"
+
+class KnowledgeDocument(models.Model):
+    """A document uploaded for retrieval; its chunks live in the user's Chroma collection"""
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='knowledge_documents'
+    )
+    name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    size = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    chunk_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} - {self.user.email}"
+
+
+# Tries create_version makes at claiming the next version number
+VERSION_ATTEMPTS = 5
+
+
+class PromptTemplateManager(models.Manager):
+    def visible_to(self, user_id):
+        """A user's own templates and the site-wide ones"""
+        return self.filter(models.Q(user_id=user_id) | models.Q(user__isnull=True))
+
+    def default_for(self, user_id):
+        """The user's default template, else the site-wide default, else None"""
+        return self.visible_to(user_id).filter(is_default=True).order_by(
+            F('user_id').asc(nulls_last=True), '-version'
+        ).first()
+
+    def create_version(self, user, name, **fields):
+        """
+        Save a template as the next version of ``name``. Making it the
+        default takes the flag away from the owner's other templates. Two
+        saves racing for the same version are told apart by the unique
+        constraints; the loser tries again with the next number.
+        """
+        for attempt in range(VERSION_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    versions = self.select_for_update().filter(user=user, name=name).values_list('version', flat=True)
+                    latest = max(versions, default=0)
+                    if fields.get('is_default'):
+                        self.filter(user=user, is_default=True).update(is_default=False)
+                    return self.create(user=user, name=name, version=latest + 1, **fields)
+            except IntegrityError:
+                if attempt == VERSION_ATTEMPTS - 1:
+                    raise
+
+class PromptTemplate(models.Model):
+    """
+    A system prompt and the template wrapping each user message. Rows are
+    not edited in place: a change is saved as the next version of the same
+    name, and threads keep pointing at the version they were created with.
+    Templates without a user are site-wide.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='prompt_templates',
+        null=True,
+        blank=True
+    )
+    name = models.CharField(max_length=100)
+    version = models.PositiveIntegerField(default=1)
+    system_prompt = models.TextField()
+    human_template = models.TextField(default='{input}')
+    # Identifies the compiled prompt in the process-wide cache (see prompts.py)
+    content_hash = models.CharField(max_length=64, editable=False)
+    is_default = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = PromptTemplateManager()
+
+    class Meta:
+        ordering = ['name', '-version']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name', 'version'], name='prompt_template_unique_version'),
+            # NULLs are distinct in the constraint above, so site-wide templates need their own
+            models.UniqueConstraint(
+                fields=['name', 'version'],
+                condition=models.Q(user__isnull=True),
+                name='prompt_template_unique_site_version'
+            ),
+        ]
+
+    @staticmethod
+    def compute_hash(system_prompt: str, human_template: str) -> str:
+        return hashlib.sha256(f'{system_prompt}\0{human_template}'.encode()).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.compute_hash(self.system_prompt, self.human_template)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
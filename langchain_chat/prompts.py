@@ -0,0 +1,80 @@
+"""
+Compiled chat prompts, cached per process.
+
+A ChatPromptTemplate is built once per distinct template content and kept
+in a small LRU keyed by its content hash, so a conversation turn only pays
+for formatting the messages. langchain_core is imported on first use.
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import TYPE_CHECKING, Optional
+
+from .models import PromptTemplate
+
+if TYPE_CHECKING:
+    from langchain_core.prompts import ChatPromptTemplate
+
+DEFAULT_SYSTEM_PROMPT = "You are a helpful AI assistant."
+DEFAULT_HUMAN_TEMPLATE = "{input}"
+CACHE_SIZE = 256
+
+_compiled = OrderedDict()
+_lock = Lock()
+
+
+def _escape(text: str) -> str:
+    """System prompts are literal text, not format strings"""
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def _build(system_prompt: str, human_template: str) -> 'ChatPromptTemplate':
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    return ChatPromptTemplate.from_messages([
+        ('system', _escape(system_prompt)),
+        MessagesPlaceholder(variable_name='history'),
+        ('human', human_template),
+    ])
+
+
+def validate_human_template(human_template: str):
+    """Raise ValueError unless the template uses exactly the {input} variable"""
+    try:
+        variables = set(_build('', human_template).input_variables)
+    except Exception as e:
+        raise ValueError(f"Invalid template: {str(e)}")
+    if variables != {'history', 'input'}:
+        raise ValueError("The template must use {input} and no other variables.")
+
+
+def compile_prompt(
+    system_prompt: str,
+    human_template: str = DEFAULT_HUMAN_TEMPLATE,
+    content_hash: Optional[str] = None
+) -> 'ChatPromptTemplate':
+    """The compiled prompt for this content, built on first use"""
+    key = content_hash or PromptTemplate.compute_hash(system_prompt, human_template)
+    with _lock:
+        prompt = _compiled.get(key)
+        if prompt is not None:
+            _compiled.move_to_end(key)
+            return prompt
+    prompt = _build(system_prompt, human_template)
+    with _lock:
+        _compiled[key] = prompt
+        while len(_compiled) > CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return prompt
+
+
+def prompt_for_thread(thread) -> 'ChatPromptTemplate':
+    """
+    The thread's pinned template, or for threads without one its last
+    stored system message (falling back to the default prompt).
+    """
+    template = thread.prompt_template
+    if template is not None:
+        return compile_prompt(template.system_prompt, template.human_template, template.content_hash)
+    system_prompt = thread.messages.filter(role='system').order_by(
+        '-timestamp', '-id'
+    ).values_list('content', flat=True).first()
+    return compile_prompt(system_prompt or DEFAULT_SYSTEM_PROMPT)
@@ -0,0 +1,246 @@
+"""
+Document ingestion and retrieval for retrieval-augmented generation.
+
+Uploaded documents are read in fixed-size pieces, split into overlapping
+chunks, embedded in batches and stored in a per-user persistent Chroma
+collection, so memory use does not grow with the size of the upload.
+"""
+import codecs
+import hashlib
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterable, Iterator, List
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import KnowledgeDocument
+
+
+class RetrievalError(Exception):
+    """Raised when document ingestion or retrieval fails"""
+    pass
+
+
+class HashingEmbeddings:
+    """
+    Deterministic feature-hashing embeddings. Needs no model or network
+    access; used for local development, tests and benchmarks in place of a
+    real embedding model.
+    """
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        import numpy as np
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in text.lower().split():
+            digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            vector[value % self.dimensions] += 1.0 if value & (1 << 63) else -1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def openai_embeddings():
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(
+        model=settings.RAG_EMBEDDING_MODEL,
+        openai_api_key=settings.OPENAI_API_KEY
+    )
+
+
+@lru_cache(maxsize=None)
+def get_embeddings():
+    return import_string(settings.RAG_EMBEDDINGS)()
+
+
+@lru_cache(maxsize=None)
+def get_chroma_client():
+    import chromadb
+    from chromadb.config import Settings
+    return chromadb.PersistentClient(
+        path=str(settings.RAG_CHROMA_PATH),
+        settings=Settings(anonymized_telemetry=False)
+    )
+
+
+def get_collection(user_id: int):
+    """The user's document collection, created on first use"""
+    return get_chroma_client().get_or_create_collection(
+        f'user_{user_id}_documents',
+        metadata={'hnsw:space': 'cosine'}
+    )
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Incremental HTML to text conversion; text is collected as it is fed"""
+    skipped_tags = {'script', 'style', 'noscript', 'template'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skipped_tags:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.skipped_tags and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in ('p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'):
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+    def drain(self) -> str:
+        text = ''.join(self.parts)
+        self.parts = []
+        return text
+
+
+def is_html(name: str, content_type: str = '') -> bool:
+    return content_type in ('text/html', 'application/xhtml+xml') \
+        or name.lower().endswith(('.html', '.htm'))
+
+
+def iter_text(pieces: Iterable[bytes], html: bool = False) -> Iterator[str]:
+    """Decode a byte stream (and strip HTML) one piece at a time"""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    extractor = _HTMLTextExtractor() if html else None
+    for piece in pieces:
+        text = decoder.decode(piece)
+        if extractor is not None:
+            extractor.feed(text)
+            text = extractor.drain()
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if extractor is not None:
+        extractor.feed(text)
+        extractor.close()
+        text = extractor.drain()
+    if text:
+        yield text
+
+
+def iter_chunks(texts: Iterable[str], chunk_size: int, chunk_overlap: int) -> Iterator[str]:
+    """
+    Split a stream of text into overlapping chunks. Only a window of a few
+    chunks is buffered: the last, possibly incomplete, chunk of each window is
+    carried over and re-split together with the next piece of text.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    window = chunk_size * 8
+    buffer = ''
+    for text in texts:
+        buffer += text
+        if len(buffer) < window:
+            continue
+        chunks = splitter.split_text(buffer)
+        if len(chunks) < 2:
+            continue
+        yield from chunks[:-1]
+        # Carry over the raw text from the start of the last chunk, keeping
+        # the whitespace the splitter strips from chunk ends.
+        buffer = buffer[buffer.rfind(chunks[-1]):]
+    if buffer.strip():
+        yield from splitter.split_text(buffer)
+
+
+def _batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest_document(document: KnowledgeDocument, pieces: Iterable[bytes]) -> int:
+    """
+    Split, embed and store a document's content. ``pieces`` is an iterable of
+    byte strings, e.g. ``uploaded_file.chunks()``. Returns the chunk count.
+    """
+    try:
+        collection = get_collection(document.user_id)
+        embeddings = get_embeddings()
+        texts = iter_text(pieces, html=is_html(document.name, document.content_type))
+        chunks = iter_chunks(texts, settings.RAG_CHUNK_SIZE, settings.RAG_CHUNK_OVERLAP)
+
+        count = 0
+        for batch in _batched(chunks, settings.RAG_EMBEDDING_BATCH_SIZE):
+            collection.add(
+                ids=[f'{document.id}:{count + i}' for i in range(len(batch))],
+                embeddings=embeddings.embed_documents(batch),
+                documents=batch,
+                metadatas=[
+                    {'document_id': document.id, 'name': document.name, 'chunk': count + i}
+                    for i in range(len(batch))
+                ]
+            )
+            count += len(batch)
+
+        document.status = KnowledgeDocument.STATUS_READY
+        document.chunk_count = count
+        document.save(update_fields=['status', 'chunk_count'])
+        return count
+    except Exception as e:
+        try:
+            get_collection(document.user_id).delete(where={'document_id': document.id})
+        except Exception:
+            pass
+        document.status = KnowledgeDocument.STATUS_FAILED
+        document.error = str(e)
+        document.save(update_fields=['status', 'error'])
+        raise RetrievalError(f"Failed to ingest document: {str(e)}")
+
+
+def delete_document(document: KnowledgeDocument) -> None:
+    try:
+        get_collection(document.user_id).delete(where={'document_id': document.id})
+    except Exception as e:
+        raise RetrievalError(f"Failed to delete document chunks: {str(e)}")
+
+
+def retrieve(user_id: int, query: str, top_k: int = 4) -> List[Dict[str, Any]]:
+    """The user's top_k document chunks closest to the query"""
+    try:
+        collection = get_collection(user_id)
+        result = collection.query(
+            query_embeddings=[get_embeddings().embed_query(query)],
+            n_results=top_k
+        )
+    except Exception as e:
+        raise RetrievalError(f"Failed to retrieve context: {str(e)}")
+
+    return [
+        {
+            'id': chunk_id,
+            'content': content,
+            'document_id': metadata.get('document_id'),
+            'name': metadata.get('name'),
+            'distance': distance,
+        }
+        for chunk_id, content, metadata, distance in zip(
+            result['ids'][0],
+            result['documents'][0],
+            result['metadatas'][0],
+            result['distances'][0]
+        )
+    ]
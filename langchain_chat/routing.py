@@ -0,0 +1,201 @@
+"""
+Per-turn model selection.
+
+The router picks a model from MODEL_ROUTER_MODELS, which lists candidates
+cheapest and fastest first, each with the largest prompt (in tokens) it is
+used for. The first candidate that fits the prompt and whose observed
+latency is within MODEL_ROUTER_LATENCY_SLO wins; the next fitting candidate
+is the fallback if the call fails or times out. A thread can pin a model
+with ``metadata['model']``, or by being created with a ``model_name`` other
+than the field's default; threads left on the default are routed.
+
+Latency is tracked per model as an exponentially weighted moving average
+in the shared cache, so every worker routes on the same observations.
+A model routed around for being slow gets no new observations, so a
+MODEL_ROUTER_PROBE_RATE share of its turns still go to it (with the usual
+fallback) to notice when it recovers; averages also expire after
+MODEL_ROUTER_LATENCY_TTL.
+
+Token counts use a tiktoken encoding kept in MODEL_ROUTER_TOKEN_CACHE_DIR,
+downloaded there by the first worker that needs it. With
+MODEL_ROUTER_TOKEN_OFFLINE it is never downloaded: populate the directory at
+build time with ``manage.py fetch_token_encodings``, and the tokenizer
+warm-up step becomes required so a missing file keeps workers unready.
+Without the encoding, counts are estimated from the text length.
+"""
+import hashlib
+import logging
+import os
+import random
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+LATENCY_KEY = 'model_router:latency:{}'
+BPE_URL = 'https://openaipublic.blob.core.windows.net/encodings/{}.tiktoken'
+
+
+def encoding_cache_path(name: str) -> Path:
+    """The encoding's BPE file in the cache directory, named as tiktoken names it"""
+    return Path(settings.MODEL_ROUTER_TOKEN_CACHE_DIR) / hashlib.sha1(BPE_URL.format(name).encode()).hexdigest()
+
+
+def load_encoding(name: str, offline: bool):
+    """Load a tiktoken encoding through the cache directory, downloading it unless offline"""
+    if offline and not encoding_cache_path(name).exists():
+        raise FileNotFoundError(
+            f"{name} is not in {settings.MODEL_ROUTER_TOKEN_CACHE_DIR}; run manage.py fetch_token_encodings"
+        )
+    _use_cache_dir(str(settings.MODEL_ROUTER_TOKEN_CACHE_DIR))
+    import tiktoken
+    return tiktoken.get_encoding(name)
+
+
+@lru_cache(maxsize=None)
+def _use_cache_dir(path: str):
+    """Point tiktoken at path; it reads the directory from the environment only"""
+    os.environ['TIKTOKEN_CACHE_DIR'] = path
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    """The tiktoken encoding used for prompt sizes, or None if it cannot be loaded"""
+    try:
+        return load_encoding(settings.MODEL_ROUTER_TOKEN_ENCODING, settings.MODEL_ROUTER_TOKEN_OFFLINE)
+    except Exception as e:
+        logger.warning("Falling back to estimated token counts: %s", e)
+        return None
+
+
+def count_tokens(messages) -> int:
+    """Approximate prompt size of chat messages (about 4 tokens of framing each)"""
+    encoding = get_encoding()
+    total = 0
+    for message in messages:
+        text = message.content if isinstance(message.content, str) else str(message.content)
+        total += 4 + (len(encoding.encode(text, disallowed_special=())) if encoding else len(text) // 4)
+    return total
+
+
+def get_latencies(models: List[str]) -> Dict[str, float]:
+    found = cache.get_many([LATENCY_KEY.format(model) for model in models])
+    return {model: found[LATENCY_KEY.format(model)] for model in models if LATENCY_KEY.format(model) in found}
+
+
+def observe_latency(model: str, seconds: float) -> float:
+    """Fold one observation into the model's moving average and return it"""
+    key = LATENCY_KEY.format(model)
+    previous = cache.get(key)
+    alpha = settings.MODEL_ROUTER_EWMA_ALPHA
+    value = seconds if previous is None else alpha * seconds + (1 - alpha) * previous
+    cache.set(key, value, settings.MODEL_ROUTER_LATENCY_TTL)
+    return value
+
+
+class Route:
+    def __init__(self, model: str, fallback: Optional[str], reason: str, prompt_tokens: int):
+        self.model = model
+        self.fallback = fallback
+        self.reason = reason
+        self.prompt_tokens = prompt_tokens
+
+    def as_metadata(self) -> Dict:
+        return {
+            'model': self.model,
+            'fallback': self.fallback,
+            'reason': self.reason,
+            'prompt_tokens': self.prompt_tokens,
+        }
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        models: Optional[List[Dict]] = None,
+        latency_slo: Optional[float] = None,
+        probe_rate: Optional[float] = None
+    ):
+        self.models = models if models is not None else settings.MODEL_ROUTER_MODELS
+        self.latency_slo = latency_slo if latency_slo is not None else settings.MODEL_ROUTER_LATENCY_SLO
+        self.probe_rate = probe_rate if probe_rate is not None else settings.MODEL_ROUTER_PROBE_RATE
+
+    def choose(self, thread, prompt_tokens: int) -> Route:
+        names = [candidate['name'] for candidate in self.models]
+        fitting = [candidate['name'] for candidate in self.models if prompt_tokens <= candidate['max_input_tokens']]
+        if not fitting:
+            # Nothing is rated for a prompt this large: use the biggest model
+            fitting = names[-1:]
+
+        pinned = (thread.metadata or {}).get('model')
+        if not pinned and thread.model_name != thread._meta.get_field('model_name').get_default():
+            pinned = thread.model_name
+        if pinned:
+            fallback = next((name for name in fitting if name != pinned), None)
+            return Route(pinned, fallback, 'pinned', prompt_tokens)
+        if not settings.MODEL_ROUTER_ENABLED or not fitting:
+            return Route(thread.model_name, None, 'thread', prompt_tokens)
+
+        latencies = get_latencies(fitting)
+        within_slo = [name for name in fitting if latencies.get(name, 0) <= self.latency_slo]
+        if within_slo:
+            model = within_slo[0]
+            reason = 'size' if model == fitting[0] else 'latency'
+        else:
+            model = min(fitting, key=lambda name: latencies[name])
+            reason = 'fastest'
+        if model != fitting[0] and random.random() < self.probe_rate:
+            model, reason = fitting[0], 'probe'
+        fallback = next((name for name in fitting if name != model), None)
+        return Route(model, fallback, reason, prompt_tokens)
+
+
+class RoutingCallback(BaseCallbackHandler):
+    """
+    Records which routed model answered a turn, how long it took to the
+    first token, and any error that caused a fallback. Models are told
+    apart by the ``router_model`` metadata set on each candidate.
+    """
+
+    def __init__(self, turn):
+        self.turn = turn
+        self.started = {}
+        self.first_token = {}
+
+    def _model(self, metadata):
+        return (metadata or {}).get('router_model')
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        model = self._model(metadata)
+        if model:
+            self.started[run_id] = (model, time.monotonic())
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id in self.started and run_id not in self.first_token:
+            self.first_token[run_id] = time.monotonic()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id not in self.started:
+            return
+        model, started = self.started.pop(run_id)
+        latency = self.first_token.pop(run_id, time.monotonic()) - started
+        routing = self.turn.metadata.setdefault('routing', {})
+        routing['used'] = model
+        routing['latency'] = round(latency, 3)
+        observe_latency(model, latency)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        if run_id not in self.started:
+            return
+        model, started = self.started.pop(run_id)
+        self.first_token.pop(run_id, None)
+        routing = self.turn.metadata.setdefault('routing', {})
+        routing['error'] = f'{model}: {type(error).__name__}: {str(error)}'[:500]
+        # A failed call counts as at least an SLO's worth of latency
+        observe_latency(model, max(time.monotonic() - started, settings.MODEL_ROUTER_LATENCY_SLO))
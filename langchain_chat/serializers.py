@@ -1,5 +1,7 @@
 from rest_framework import serializers
-from .models import LangChainThread, LangChainMessage
+from backend.serializers import SparseFieldsetMixin
+from .models import KnowledgeDocument, LangChainThread, LangChainMessage, PromptTemplate
+from .prompts import DEFAULT_HUMAN_TEMPLATE, validate_human_template
 
 class LangChainMessageSerializer(serializers.ModelSerializer):
     class Meta:
@@ -7,21 +9,78 @@ class LangChainMessageSerializer(serializers.ModelSerializer):
         fields = ['id', 'content', 'role', 'timestamp', 'metadata']
         read_only_fields = ['id', 'timestamp']
 
-class LangChainThreadSerializer(serializers.ModelSerializer):
+class LangChainThreadSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     messages = LangChainMessageSerializer(many=True, read_only=True)
     
     class Meta:
         model = LangChainThread
         fields = ['id', 'title', 'is_active', 'created_at', 'updated_at', 
-                 'model_name', 'metadata', 'messages']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+                 'model_name', 'metadata', 'messages', 'archived_at', 'prompt_template']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'archived_at', 'prompt_template']
+
+class LangChainThreadSummarySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Thread listing using the denormalised activity fields instead of the message payload"""
+    class Meta:
+        model = LangChainThread
+        fields = ['id', 'title', 'model_name', 'updated_at', 'message_count',
+                  'last_message_role', 'last_message_preview', 'last_message_at', 'archived_at']
+        read_only_fields = fields
 
 class MessageInputSerializer(serializers.Serializer):
     content = serializers.CharField(required=True)
     temperature = serializers.FloatField(required=False, default=0.7)
     metadata = serializers.JSONField(required=False, default=dict)
+    use_retrieval = serializers.BooleanField(required=False, default=False)
+    top_k = serializers.IntegerField(required=False, default=4, min_value=1, max_value=20)
 
 class ThreadCreateSerializer(serializers.Serializer):
     title = serializers.CharField(required=True)
+    # Any model other than the default pins the thread to it; left on the
+    # default, the router picks a model per turn (see routing.py)
     model_name = serializers.CharField(required=False, default="gpt-3.5-turbo")
-    metadata = serializers.JSONField(required=False, default=dict) 
\ No newline at end of file
+    metadata = serializers.JSONField(required=False, default=dict)
+    # Defaults to the user's (or the site's) default template
+    prompt_template = serializers.IntegerField(required=False, min_value=1)
+
+    def validate_prompt_template(self, value):
+        if not PromptTemplate.objects.visible_to(self.context['request'].user.id).filter(pk=value).exists():
+            raise serializers.ValidationError("Prompt template not found.")
+        return value
+
+class PromptTemplateSerializer(serializers.ModelSerializer):
+    """Saving always creates a new version; see PromptTemplateViewSet"""
+    human_template = serializers.CharField(required=False, default=DEFAULT_HUMAN_TEMPLATE)
+    # Staff only: a site-wide template
+    is_global = serializers.BooleanField(required=False, default=False, write_only=True)
+
+    class Meta:
+        model = PromptTemplate
+        fields = ['id', 'name', 'version', 'system_prompt', 'human_template', 'content_hash',
+                  'is_default', 'is_global', 'created_at']
+        read_only_fields = ['id', 'version', 'content_hash', 'created_at']
+
+    def validate_human_template(self, value):
+        try:
+            validate_human_template(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def validate_is_global(self, value):
+        if value and not self.context['request'].user.is_staff:
+            raise serializers.ValidationError("Only staff can create site-wide templates.")
+        return value
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['is_global'] = instance.user_id is None
+        return data
+
+class KnowledgeDocumentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = KnowledgeDocument
+        fields = ['id', 'name', 'content_type', 'size', 'status', 'chunk_count', 'error', 'created_at']
+        read_only_fields = fields
+
+class DocumentUploadSerializer(serializers.Serializer):
+    file = serializers.FileField(required=True)
@@ -1,11 +1,13 @@
-from typing import Dict, Any, List, Optional
+import threading
+from typing import Callable, Dict, Any, List, Optional
 from django.conf import settings
-from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from langchain.prompts import PromptTemplate
-from .models import LangChainThread, LangChainMessage
+from backend.locks import TurnQueueTimeout, thread_turn
+from backend.pubsub import get_broker, thread_channel
+from .archive import archiver
+from .models import LangChainThread, LangChainMessage, PromptTemplate
+from .prompts import DEFAULT_SYSTEM_PROMPT, prompt_for_thread
+from .retrieval import retrieve
+from .serializers import LangChainMessageSerializer
 
 class LangChainError(Exception):
     """Base exception for LangChain service errors"""
@@ -22,54 +24,43 @@ class MemoryError(LangChainError):
 class LangChainService:
     def __init__(self, api_key: str = settings.OPENAI_API_KEY):
         self.api_key = api_key
-        self.prompt = PromptTemplate(
-            input_variables=["history", "input"],
-            template="""The following is a friendly conversation between a human and an AI. The AI is helpful, creative, clever, and very friendly.
-
-Current conversation:
-{history}
-Human: {input}
-AI:"""
-        )
 
-    def _create_llm(self, model_name: str = "gpt-3.5-turbo", temperature: float = 0.7) -> ChatOpenAI:
-        """Initialize the language model"""
-        try:
-            return ChatOpenAI(
-                temperature=temperature,
-                model_name=model_name,
-                streaming=True,
-                callbacks=[StreamingStdOutCallbackHandler()],
-                openai_api_key=self.api_key
-            )
-        except Exception as e:
-            raise ChainExecutionError(f"Failed to initialize LLM: {str(e)}")
+    @property
+    def chain(self):
+        # The LangChain stack is imported on first use rather than at startup
+        from .chains import get_conversation_chain
+        return get_conversation_chain()
 
-    def _create_memory(self, memory_key: str = "history") -> ConversationBufferMemory:
-        """Initialize conversation memory"""
+    def create_thread(
+        self,
+        user_id: int,
+        title: str,
+        model_name: str = "gpt-3.5-turbo",
+        prompt_template_id: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Create a new conversation thread. It is pinned to the given prompt
+        template, or to the user's (or the site's) default one if any.
+        """
         try:
-            return ConversationBufferMemory(
-                memory_key=memory_key,
-                return_messages=True
-            )
-        except Exception as e:
-            raise MemoryError(f"Failed to initialize memory: {str(e)}")
+            if prompt_template_id is not None:
+                template = PromptTemplate.objects.visible_to(user_id).get(pk=prompt_template_id)
+            else:
+                template = PromptTemplate.objects.default_for(user_id)
 
-    def create_thread(self, user_id: int, title: str, model_name: str = "gpt-3.5-turbo") -> Dict[str, Any]:
-        """Create a new conversation thread"""
-        try:
             thread = LangChainThread.objects.create(
                 user_id=user_id,
                 title=title,
                 model_name=model_name,
-                langchain_memory_key=f"memory_{user_id}_{title}"
+                langchain_memory_key=f"memory_{user_id}_{title}",
+                prompt_template=template
             )
             
             # Initialize system message
             LangChainMessage.objects.create(
                 user_id=user_id,
                 thread=thread,
-                content="You are a helpful AI assistant.",
+                content=template.system_prompt if template else DEFAULT_SYSTEM_PROMPT,
                 role='system'
             )
             
@@ -79,6 +70,8 @@ AI:"""
                 'model_name': thread.model_name,
                 'created_at': thread.created_at
             }
+        except PromptTemplate.DoesNotExist:
+            raise ChainExecutionError(f"Prompt template {prompt_template_id} not found")
         except Exception as e:
             raise ChainExecutionError(f"Failed to create thread: {str(e)}")
 
@@ -87,67 +80,116 @@ AI:"""
         thread_id: int,
         user_id: int,
         content: str,
-        temperature: float = 0.7
-    ) -> Dict[str, Any]:
-        """Process a user message and generate a response"""
+        temperature: float = 0.7,
+        on_token: Optional[Callable[[str], None]] = None,
+        use_retrieval: bool = False,
+        top_k: int = 4,
+        cancel: Optional[threading.Event] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Process a user message and generate a response. If on_token is given
+        it is called with each token as the response streams in. With
+        use_retrieval the top_k closest chunks of the user's documents are
+        added to the prompt. Saved messages are published to the thread's
+        live channel. Turns on one thread run one at a time, in the order
+        they arrived; TurnQueueTimeout is raised if the wait is too long.
+        Setting cancel while the reply streams (the client went away) stops
+        generation; the text so far is saved with metadata
+        {'truncated': True} (see chains.CancellableChatModel). A turn
+        cancelled while it waited for the thread returns None unprocessed.
+        """
         try:
-            thread = LangChainThread.objects.get(id=thread_id)
-            
-            # Save user message
-            user_message = LangChainMessage.objects.create(
-                user_id=user_id,
-                thread=thread,
-                content=content,
-                role='user'
-            )
-
-            # Initialize LangChain components
-            llm = self._create_llm(model_name=thread.model_name, temperature=temperature)
-            memory = self._create_memory(memory_key="history")
+            with thread_turn('langchain', thread_id):
+                if cancel is not None and cancel.is_set():
+                    return None
+                thread = archiver.ensure_hot(
+                    LangChainThread.objects.select_related('prompt_template').get(id=thread_id)
+                )
+                broker = get_broker()
+                channel = thread_channel('langchain', user_id, thread.id)
             
-            # Create conversation chain with custom prompt
-            chain = ConversationChain(
-                llm=llm,
-                memory=memory,
-                prompt=self.prompt,
-                verbose=True
-            )
-
-            # Get conversation history
-            history = LangChainMessage.objects.filter(
-                thread=thread
-            ).order_by('timestamp')
-
-            # Load history into memory
-            for msg in history:
-                if msg.role != 'system':
-                    memory.chat_memory.add_user_message(msg.content) if msg.role == 'user' \
-                        else memory.chat_memory.add_ai_message(msg.content)
-
-            # Generate response
-            response = chain.predict(input=content)
-
-            # Save assistant message
-            assistant_message = LangChainMessage.objects.create(
-                user_id=user_id,
-                thread=thread,
-                content=response,
-                role='assistant'
-            )
-
-            return {
-                'thread_id': thread.id,
-                'message_id': assistant_message.id,
-                'content': response,
-                'role': 'assistant',
-                'timestamp': assistant_message.timestamp
-            }
+                # Save user message
+                user_message = LangChainMessage.objects.create_in_thread(
+                    thread,
+                    user_id=user_id,
+                    content=content,
+                    role='user'
+                )
+                broker.publish(channel, {
+                    'type': 'message',
+                    'message': LangChainMessageSerializer(user_message).data
+                })
+
+                # Generate response
+                prompt_input = content
+                assistant_metadata = {}
+                if use_retrieval:
+                    chunks = retrieve(user_id, content, top_k=top_k)
+                    if chunks:
+                        prompt_input = self._with_context(content, chunks)
+                        assistant_metadata['retrieval'] = [
+                            {'id': chunk['id'], 'document_id': chunk['document_id'], 'distance': chunk['distance']}
+                            for chunk in chunks
+                        ]
+
+                # The shared chain reads the history and saves the reply
+                from .chains import Turn
+                turn = Turn(
+                    thread,
+                    user_id,
+                    prompt_for_thread(thread),
+                    temperature=temperature,
+                    user_message=user_message,
+                    metadata=assistant_metadata,
+                    api_key=self.api_key,
+                    cancel=cancel
+                )
+                inputs = {'input': prompt_input}
+                if on_token is None:
+                    response = self.chain.invoke(inputs, config=turn.config())
+                else:
+                    parts = []
+                    for token in self.chain.stream(inputs, config=turn.config()):
+                        if token:
+                            parts.append(token)
+                            on_token(token)
+                    response = ''.join(parts)
+                assistant_message = turn.reply
+                if assistant_message is None:
+                    raise ChainExecutionError("The reply could not be saved")
+
+                broker.publish(channel, {
+                    'type': 'message',
+                    'message': LangChainMessageSerializer(assistant_message).data
+                })
+
+                return {
+                    'thread_id': thread.id,
+                    'message_id': assistant_message.id,
+                    'content': response,
+                    'role': 'assistant',
+                    'timestamp': assistant_message.timestamp
+                }
 
         except LangChainThread.DoesNotExist:
             raise ChainExecutionError(f"Thread {thread_id} not found")
+        except TurnQueueTimeout:
+            raise
         except Exception as e:
             raise ChainExecutionError(f"Failed to process message: {str(e)}")
 
+    @staticmethod
+    def _with_context(content: str, chunks: List[Dict[str, Any]]) -> str:
+        """Prefix the user's message with retrieved document excerpts"""
+        context = "\n\n".join(
+            f"[{chunk['name']}]\n{chunk['content']}" for chunk in chunks
+        )
+        return (
+            "Use the following excerpts from the user's documents if they are relevant.\n\n"
+            f"{context}\n\n"
+            f"Question: {content}"
+        )
+
     def get_thread_history(self, thread_id: int) -> List[Dict[str, Any]]:
         """Retrieve conversation history for a thread"""
         try:
@@ -1,9 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import LangChainChatViewSet
+from .views import KnowledgeDocumentViewSet, LangChainChatViewSet, PromptTemplateViewSet
 
 router = DefaultRouter()
 router.register(r'threads', LangChainChatViewSet, basename='langchain-chat')
+router.register(r'documents', KnowledgeDocumentViewSet, basename='langchain-document')
+router.register(r'prompts', PromptTemplateViewSet, basename='langchain-prompt')
 
 urlpatterns = [
     path('', include(router.urls)),
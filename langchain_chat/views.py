@@ -1,42 +1,79 @@
+from django.conf import settings
 from django.shortcuts import render
 from rest_framework import viewsets, status
+from rest_framework.parsers import MultiPartParser
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
-from .models import LangChainThread
+from django.utils.decorators import method_decorator
+from backend.conditional import thread_condition, thread_flight_key
+from backend.idempotency import IdempotencyMixin
+from backend.locks import TurnQueueTimeout
+from backend.singleflight import single_flight
+from backend.throttling import ConcurrencyLimitMixin, LangChainMessageRateThrottle
+from .archive import archiver
+from .models import KnowledgeDocument, LangChainThread, PromptTemplate
+from .retrieval import RetrievalError, delete_document, ingest_document
 from .serializers import (
+    DocumentUploadSerializer,
+    KnowledgeDocumentSerializer,
     LangChainThreadSerializer,
+    LangChainThreadSummarySerializer,
     LangChainMessageSerializer,
     MessageInputSerializer,
+    PromptTemplateSerializer,
     ThreadCreateSerializer
 )
 from .services import LangChainService, LangChainError
 
 # Create your views here.
 
-class LangChainChatViewSet(viewsets.ViewSet):
+def thread_state(request, pk=None, **kwargs):
+    """Version and last-modified time of a thread and its messages"""
+    state = LangChainThread.objects.filter(id=pk, user=request.user).values_list(
+        'updated_at', 'message_count'
+    ).first()
+    if state is None:
+        return None
+    updated_at, message_count = state
+    return f'{updated_at.timestamp()}-{message_count}', updated_at
+
+class LangChainChatViewSet(IdempotencyMixin, ConcurrencyLimitMixin, viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.langchain_service = LangChainService()
 
+    def get_concurrency_scope(self, request):
+        if self.action == 'message':
+            return 'langchain_message'
+        return None
+
+    def get_idempotency_scope(self, request):
+        if self.action == 'message':
+            return 'langchain_message'
+        return None
+
     def list(self, request):
         """List all chat threads for the current user"""
         threads = LangChainThread.objects.filter(user=request.user)
-        serializer = LangChainThreadSerializer(threads, many=True)
+        serializer = LangChainThreadSummarySerializer(
+            threads, many=True, context={'request': request}
+        )
         return Response(serializer.data)
 
     def create(self, request):
         """Create a new chat thread"""
-        serializer = ThreadCreateSerializer(data=request.data)
+        serializer = ThreadCreateSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             try:
                 thread_data = self.langchain_service.create_thread(
                     user_id=request.user.id,
                     title=serializer.validated_data['title'],
-                    model_name=serializer.validated_data.get('model_name', 'gpt-3.5-turbo')
+                    model_name=serializer.validated_data.get('model_name', 'gpt-3.5-turbo'),
+                    prompt_template_id=serializer.validated_data.get('prompt_template')
                 )
                 thread = LangChainThread.objects.get(id=thread_data['thread_id'])
                 response_serializer = LangChainThreadSerializer(thread)
@@ -48,13 +85,18 @@ class LangChainChatViewSet(viewsets.ViewSet):
                 )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @method_decorator(thread_condition(thread_state))
     def retrieve(self, request, pk=None):
         """Get a specific chat thread and its messages"""
-        thread = get_object_or_404(LangChainThread, id=pk, user=request.user)
-        serializer = LangChainThreadSerializer(thread)
-        return Response(serializer.data)
+        thread = archiver.ensure_hot(get_object_or_404(LangChainThread, id=pk, user=request.user))
+        data = single_flight(
+            thread_flight_key('langchain', thread, request),
+            lambda: LangChainThreadSerializer(thread, context={'request': request}).data,
+            shared=False
+        )
+        return Response(data)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['post'], throttle_classes=[LangChainMessageRateThrottle])
     def message(self, request, pk=None):
         """Send a message in a specific chat thread"""
         thread = get_object_or_404(LangChainThread, id=pk, user=request.user)
@@ -66,9 +108,16 @@ class LangChainChatViewSet(viewsets.ViewSet):
                     thread_id=thread.id,
                     user_id=request.user.id,
                     content=serializer.validated_data['content'],
-                    temperature=serializer.validated_data.get('temperature', 0.7)
+                    temperature=serializer.validated_data.get('temperature', 0.7),
+                    use_retrieval=serializer.validated_data.get('use_retrieval', False),
+                    top_k=serializer.validated_data.get('top_k', 4)
                 )
                 return Response(response, status=status.HTTP_200_OK)
+            except TurnQueueTimeout as e:
+                return Response(
+                    {'error': str(e)},
+                    status=status.HTTP_409_CONFLICT
+                )
             except LangChainError as e:
                 return Response(
                     {'error': str(e)},
@@ -77,11 +126,16 @@ class LangChainChatViewSet(viewsets.ViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['get'])
+    @method_decorator(thread_condition(thread_state))
     def history(self, request, pk=None):
         """Get the message history for a specific chat thread"""
-        thread = get_object_or_404(LangChainThread, id=pk, user=request.user)
+        thread = archiver.ensure_hot(get_object_or_404(LangChainThread, id=pk, user=request.user))
         try:
-            messages = self.langchain_service.get_thread_history(thread.id)
+            messages = single_flight(
+                thread_flight_key('langchain', thread, request),
+                lambda: self.langchain_service.get_thread_history(thread.id),
+                shared=False
+            )
             return Response(messages, status=status.HTTP_200_OK)
         except LangChainError as e:
             return Response(
@@ -100,3 +154,130 @@ class LangChainChatViewSet(viewsets.ViewSet):
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+class KnowledgeDocumentViewSet(viewsets.ViewSet):
+    """Documents used for retrieval-augmented replies"""
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def list(self, request):
+        """List the current user's documents"""
+        documents = KnowledgeDocument.objects.filter(user=request.user)
+        serializer = KnowledgeDocumentSerializer(documents, many=True)
+        return Response(serializer.data)
+
+    def create(self, request):
+        """Upload a document, then split, embed and index it"""
+        serializer = DocumentUploadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        uploaded = serializer.validated_data['file']
+        if uploaded.size > settings.RAG_MAX_UPLOAD_SIZE:
+            return Response(
+                {'error': 'File is too large.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        document = KnowledgeDocument.objects.create(
+            user=request.user,
+            name=uploaded.name[:255],
+            content_type=uploaded.content_type or '',
+            size=uploaded.size
+        )
+        try:
+            ingest_document(document, uploaded.chunks(settings.RAG_UPLOAD_READ_SIZE))
+        except RetrievalError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        return Response(KnowledgeDocumentSerializer(document).data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        """Get a specific document"""
+        document = get_object_or_404(KnowledgeDocument, id=pk, user=request.user)
+        return Response(KnowledgeDocumentSerializer(document).data)
+
+    def destroy(self, request, pk=None):
+        """Delete a document and its indexed chunks"""
+        document = get_object_or_404(KnowledgeDocument, id=pk, user=request.user)
+        try:
+            delete_document(document)
+        except RetrievalError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        document.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class PromptTemplateViewSet(viewsets.ViewSet):
+    """
+    Versioned prompt templates. Templates are never edited in place: an
+    update saves the next version under the same name, so threads created
+    with an earlier version keep using it.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def list(self, request):
+        """List the user's own and the site-wide templates, newest version first"""
+        templates = PromptTemplate.objects.visible_to(request.user.id)
+        serializer = PromptTemplateSerializer(templates, many=True)
+        return Response(serializer.data)
+
+    def create(self, request):
+        """Create a template, or a new version if the name already exists"""
+        serializer = PromptTemplateSerializer(data=request.data, context={'request': request})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return self._save_version(request, serializer.validated_data)
+
+    def retrieve(self, request, pk=None):
+        """Get a specific template version"""
+        template = get_object_or_404(PromptTemplate.objects.visible_to(request.user.id), id=pk)
+        return Response(PromptTemplateSerializer(template).data)
+
+    def update(self, request, pk=None):
+        """Save changes to a template as its next version"""
+        template = self._get_owned(request, pk)
+        serializer = PromptTemplateSerializer(
+            template, data=request.data, partial=True, context={'request': request}
+        )
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = {
+            'name': template.name,
+            'system_prompt': template.system_prompt,
+            'human_template': template.human_template,
+            'is_default': template.is_default,
+            **serializer.validated_data,
+            'is_global': template.user_id is None,
+        }
+        return self._save_version(request, data)
+
+    def partial_update(self, request, pk=None):
+        return self.update(request, pk)
+
+    def destroy(self, request, pk=None):
+        """Delete a template version; threads using it fall back to their stored system message"""
+        self._get_owned(request, pk).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def _get_owned(self, request, pk):
+        templates = PromptTemplate.objects.visible_to(request.user.id)
+        if not request.user.is_staff:
+            templates = templates.filter(user=request.user)
+        return get_object_or_404(templates, id=pk)
+
+    def _save_version(self, request, data):
+        template = PromptTemplate.objects.create_version(
+            None if data['is_global'] else request.user,
+            data['name'],
+            system_prompt=data['system_prompt'],
+            human_template=data['human_template'],
+            is_default=data.get('is_default', False)
+        )
+        return Response(PromptTemplateSerializer(template).data, status=status.HTTP_201_CREATED)
@@ -0,0 +1,169 @@
+"""
+Database-specific full-text queries over SearchEntry.
+
+search_messages() returns a lazy SearchResults object; Django's paginator
+calls count() and slices it, so only the requested page is ranked out of
+the index and only that page's snippets are built.
+"""
+import re
+
+from django.db import connection
+
+from chat.models import ChatThread
+
+from .models import SearchEntry
+
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_STOP = '</mark>'
+MAX_TERMS = 16
+
+TABLE = SearchEntry._meta.db_table
+FTS_TABLE = f'{TABLE}_fts'
+ENTRY_COLUMNS = (
+    'e.id, e.user_id, e.source, e.thread_id, e.chat_message_id, '
+    'e.langchain_message_id, e.role, e.timestamp'
+)
+# Chat threads are deleted by deactivating them, which leaves their entries
+# in place; LangChain threads are deleted outright, entries and all
+ACTIVE_THREAD = (
+    f"NOT (e.source = '{SearchEntry.SOURCE_CHAT}' AND EXISTS ("
+    f"SELECT 1 FROM {ChatThread._meta.db_table} t WHERE t.id = e.thread_id AND NOT t.is_active))"
+)
+
+
+def parse_terms(query: str):
+    """Plain words of a query; operators and punctuation are dropped"""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+class PostgresBackend:
+    """tsvector column generated from content, with a GIN index"""
+    config = 'english'
+
+    def _where(self, source):
+        where = f'e.user_id = %s AND e.search_vector @@ query AND {ACTIVE_THREAD}'
+        if source:
+            where += ' AND e.source = %s'
+        return where
+
+    def _params(self, terms, user_id, source):
+        params = [' '.join(terms), user_id]
+        if source:
+            params.append(source)
+        return params
+
+    def count(self, user_id, terms, source=None):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) FROM {TABLE} e, plainto_tsquery('{self.config}', %s) query "
+                f"WHERE {self._where(source)}",
+                self._params(terms, user_id, source)
+            )
+            return cursor.fetchone()[0]
+
+    def fetch(self, user_id, terms, source, offset, limit):
+        # Rank and limit first, then build headlines only for the page
+        headline_options = (
+            f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, '
+            'MaxFragments=2, MaxWords=24, MinWords=8'
+        )
+        sql = (
+            f"SELECT hits.*, ts_headline('{self.config}', hits.content, hits.query, %s) AS snippet "
+            f"FROM ("
+            f"  SELECT {ENTRY_COLUMNS}, e.content, query, ts_rank_cd(e.search_vector, query) AS rank "
+            f"  FROM {TABLE} e, plainto_tsquery('{self.config}', %s) query "
+            f"  WHERE {self._where(source)} "
+            f"  ORDER BY rank DESC, e.id DESC LIMIT %s OFFSET %s"
+            f") hits ORDER BY hits.rank DESC, hits.id DESC"
+        )
+        params = [headline_options] + self._params(terms, user_id, source) + [limit, offset]
+        return list(SearchEntry.objects.raw(sql, params))
+
+
+class SQLiteBackend:
+    """
+    FTS5 external-content table over SearchEntry.content. The joins are CROSS
+    JOINs because SQLite otherwise prefers to walk the user's rows and probe
+    the full-text index once per row.
+    """
+
+    def _match(self, terms):
+        return ' '.join(f'"{term}"' for term in terms)
+
+    def _where(self, source):
+        where = f'{FTS_TABLE} MATCH %s AND e.user_id = %s AND {ACTIVE_THREAD}'
+        if source:
+            where += ' AND e.source = %s'
+        return where
+
+    def _params(self, terms, user_id, source):
+        params = [self._match(terms), user_id]
+        if source:
+            params.append(source)
+        return params
+
+    def count(self, user_id, terms, source=None):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) FROM {FTS_TABLE} CROSS JOIN {TABLE} e ON e.id = {FTS_TABLE}.rowid "
+                f"WHERE {self._where(source)}",
+                self._params(terms, user_id, source)
+            )
+            return cursor.fetchone()[0]
+
+    def fetch(self, user_id, terms, source, offset, limit):
+        # bm25() is lower for better matches; negate it so rank sorts like Postgres
+        sql = (
+            f"SELECT {ENTRY_COLUMNS}, -bm25({FTS_TABLE}) AS rank, "
+            f"snippet({FTS_TABLE}, 0, %s, %s, '…', 24) AS snippet "
+            f"FROM {FTS_TABLE} CROSS JOIN {TABLE} e ON e.id = {FTS_TABLE}.rowid "
+            f"WHERE {self._where(source)} "
+            f"ORDER BY bm25({FTS_TABLE}), e.id DESC LIMIT %s OFFSET %s"
+        )
+        params = [HIGHLIGHT_START, HIGHLIGHT_STOP] + self._params(terms, user_id, source) + [limit, offset]
+        return list(SearchEntry.objects.raw(sql, params))
+
+
+class SearchResults:
+    """Lazy, sliceable hits for one query"""
+
+    def __init__(self, backend, user_id, terms, source=None):
+        self.backend = backend
+        self.user_id = user_id
+        self.terms = terms
+        self.source = source
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.backend.count(self.user_id, self.terms, self.source) if self.terms else 0
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError('SearchResults only supports slicing without a step')
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+        if not self.terms or stop <= start:
+            return []
+        return self.backend.fetch(self.user_id, self.terms, self.source, start, stop - start)
+
+
+BACKENDS = {
+    'postgresql': PostgresBackend,
+    'sqlite': SQLiteBackend,
+}
+
+
+def get_backend():
+    try:
+        return BACKENDS[connection.vendor]()
+    except KeyError:
+        raise NotImplementedError(f'Full-text search is not supported on {connection.vendor}')
+
+
+def search_messages(user_id: int, query: str, source: str = None) -> SearchResults:
+    return SearchResults(get_backend(), user_id, parse_terms(query), source)
@@ -0,0 +1,107 @@
+"""
+Keeping SearchEntry in step with the message tables. Single saves go
+through the post_save receivers in signals.py; code that writes messages
+with bulk_create() (which sends no signals) should call index_messages(),
+or index_new_messages() for rows it has just inserted.
+"""
+from typing import Iterable, List
+
+from django.db import connection
+
+from chat.models import ChatHistory
+from langchain_chat.models import LangChainMessage
+
+from .models import SearchEntry
+
+# vector_row is written as NULL so the semantic indexer embeds the new content
+UPDATE_FIELDS = ['thread_id', 'role', 'content', 'timestamp', 'vector_row']
+
+
+def entry_for(message) -> SearchEntry:
+    if isinstance(message, ChatHistory):
+        return SearchEntry(
+            user_id=message.user_id,
+            source=SearchEntry.SOURCE_CHAT,
+            thread_id=message.thread_id,
+            chat_message_id=message.pk,
+            role=message.role,
+            content=message.message,
+            timestamp=message.timestamp,
+        )
+    return SearchEntry(
+        user_id=message.user_id,
+        source=SearchEntry.SOURCE_LANGCHAIN,
+        thread_id=message.thread_id,
+        langchain_message_id=message.pk,
+        role=message.role,
+        content=message.content,
+        timestamp=message.timestamp,
+    )
+
+
+def is_indexed(message) -> bool:
+    """System prompts are not part of the conversation and are not searchable"""
+    return not (isinstance(message, LangChainMessage) and message.role == 'system')
+
+
+def index_messages(messages: Iterable, batch_size: int = 500) -> int:
+    """Insert or refresh the index entries of saved messages; returns the count"""
+    chat_entries = []
+    langchain_entries = []
+    for message in messages:
+        if not is_indexed(message):
+            continue
+        if isinstance(message, ChatHistory):
+            chat_entries.append(entry_for(message))
+        else:
+            langchain_entries.append(entry_for(message))
+
+    for entries, unique_field in [
+        (chat_entries, 'chat_message'),
+        (langchain_entries, 'langchain_message'),
+    ]:
+        if entries:
+            SearchEntry.objects.bulk_create(
+                entries,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=[unique_field],
+                update_fields=UPDATE_FIELDS,
+            )
+    return len(chat_entries) + len(langchain_entries)
+
+
+def index_new_messages(message_model, ids: List[int], chunk_size: int = 900) -> int:
+    """
+    Index freshly inserted messages with a single INSERT ... SELECT, so the
+    entries are built by the database rather than as model instances. Unlike
+    index_messages() this is not an upsert: the messages must not have
+    entries yet. Ids are bound chunk_size at a time, below SQLite's limit
+    of 999 variables. Returns the number of entries written.
+    """
+    if not ids:
+        return 0
+    qn = connection.ops.quote_name
+    if message_model is ChatHistory:
+        source, link, content = SearchEntry.SOURCE_CHAT, 'chat_message_id', 'message'
+    else:
+        source, link, content = SearchEntry.SOURCE_LANGCHAIN, 'langchain_message_id', 'content'
+    columns = ', '.join(qn(column) for column in ['user_id', 'source', 'thread_id', link, 'role', 'content', 'timestamp'])
+    # source is one of our own constants, so it is inlined as a literal
+    select = ', '.join([qn('user_id'), f"'{source}'", qn('thread_id'), qn('id'), qn('role'), qn(content), qn('timestamp')])
+    written = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), chunk_size):
+            chunk = list(ids[start:start + chunk_size])
+            placeholders = ', '.join(['%s'] * len(chunk))
+            sql = (
+                f'INSERT INTO {qn(SearchEntry._meta.db_table)} ({columns}) '
+                f'SELECT {select} FROM {qn(message_model._meta.db_table)} WHERE {qn("id")} IN ({placeholders})'
+            )
+            if source == SearchEntry.SOURCE_LANGCHAIN:
+                # System prompts are not indexed (see is_indexed)
+                sql += f' AND {qn("role")} <> %s'
+                chunk.append('system')
+            cursor.execute(sql, chunk)
+            written += cursor.rowcount
+    return written
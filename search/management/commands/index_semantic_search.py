@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from search.semantic import SemanticIndex
+
+
+class Command(BaseCommand):
+    help = 'Embed messages added since the last run into the semantic search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument(
+            '--interval', type=float, default=None,
+            help='Keep running, polling for new messages every INTERVAL seconds'
+        )
+
+    def handle(self, *args, **options):
+        index = SemanticIndex()
+        while True:
+            indexed = index.index_pending(batch_size=options['batch_size'])
+            if indexed:
+                self.stdout.write(f'{indexed} messages embedded')
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Semantic index up to date'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from chat.models import ChatHistory
+from langchain_chat.models import LangChainMessage
+from search.backends import FTS_TABLE
+from search.indexing import index_messages
+
+
+class Command(BaseCommand):
+    help = 'Index existing chat and LangChain messages for full-text search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for label, queryset in [
+            ('chat messages', ChatHistory.objects.all()),
+            ('LangChain messages', LangChainMessage.objects.exclude(role='system')),
+        ]:
+            total = queryset.count()
+            done = 0
+            last_pk = 0
+            while True:
+                batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+                if not batch:
+                    break
+                index_messages(batch, batch_size=batch_size)
+                done += len(batch)
+                last_pk = batch[-1].pk
+                self.stdout.write(f'{done}/{total} {label} indexed')
+
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.7 on 2026-10-19 11:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('chat', '0002_thread_activity'),
+        ('langchain_chat', '0003_knowledge_document'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('chat', 'Chat'), ('langchain', 'LangChain')], max_length=20)),
+                ('thread_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('role', models.CharField(max_length=20)),
+                ('content', models.TextField()),
+                ('timestamp', models.DateTimeField()),
+                ('chat_message', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_entry', to='chat.chathistory')),
+                ('langchain_message', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_entry', to='langchain_chat.langchainmessage')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'source'], name='search_entry_user_source')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations
+
+TABLE = 'search_searchentry'
+FTS_TABLE = 'search_searchentry_fts'
+
+INDEX_SQL = {
+    'postgresql': [
+        f"ALTER TABLE {TABLE} ADD COLUMN search_vector tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('english', content)) STORED",
+        f"CREATE INDEX search_entry_vector_gin ON {TABLE} USING GIN (search_vector)",
+    ],
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+        f"content, content='{TABLE}', content_rowid='id', tokenize='porter unicode61')",
+        f"CREATE TRIGGER {TABLE}_ai AFTER INSERT ON {TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END",
+        f"CREATE TRIGGER {TABLE}_ad AFTER DELETE ON {TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END",
+        f"CREATE TRIGGER {TABLE}_au AFTER UPDATE ON {TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+        f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END",
+    ],
+}
+
+DROP_SQL = {
+    'postgresql': [
+        "DROP INDEX IF EXISTS search_entry_vector_gin",
+        f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS search_vector",
+    ],
+    'sqlite': [
+        f"DROP TRIGGER IF EXISTS {TABLE}_ai",
+        f"DROP TRIGGER IF EXISTS {TABLE}_ad",
+        f"DROP TRIGGER IF EXISTS {TABLE}_au",
+        f"DROP TABLE IF EXISTS {FTS_TABLE}",
+    ],
+}
+
+
+def create_text_index(apps, schema_editor):
+    for sql in INDEX_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_text_index(apps, schema_editor):
+    for sql in DROP_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_text_index, drop_text_index),
+    ]
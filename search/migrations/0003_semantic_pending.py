@@ -0,0 +1,43 @@
+# Generated by Django 5.0.7 on 2026-10-19 12:37
+
+from django.db import migrations, models
+
+TABLE = 'search_searchentry'
+FTS_TABLE = 'search_searchentry_fts'
+
+
+def content_update_trigger(columns):
+    """The SQLite FTS update trigger, firing on updates of the given columns (all when empty)"""
+    of = f' OF {columns}' if columns else ''
+
+    def recreate(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {TABLE}_au")
+        schema_editor.execute(
+            f"CREATE TRIGGER {TABLE}_au AFTER UPDATE{of} ON {TABLE} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+            f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END"
+        )
+    return recreate
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0002_text_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchentry',
+            name='vector_row',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='searchentry',
+            index=models.Index(condition=models.Q(('vector_row__isnull', True)), fields=['id'], name='search_entry_unembedded'),
+        ),
+        # Recording a vector_row must not rewrite the entry's full-text index
+        migrations.RunPython(content_update_trigger('content'), content_update_trigger('')),
+    ]
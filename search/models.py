@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.db import models
+
+
+class SearchEntry(models.Model):
+    """
+    Full-text index row for one chat or LangChain message.
+
+    The text index itself is created per database in the migrations: a
+    generated ``search_vector`` tsvector column with a GIN index on Postgres,
+    an external-content FTS5 table kept in sync by triggers on SQLite. Note
+    that SQLite rebuilds the table (dropping the triggers) for most ALTERs, so
+    later migrations on this model must recreate them.
+
+    ``vector_row`` is the row of the entry's current vector in its user's
+    semantic store (search.semantic); it is cleared whenever the entry is
+    written, so the indexer embeds every entry whose row is missing.
+    """
+    SOURCE_CHAT = 'chat'
+    SOURCE_LANGCHAIN = 'langchain'
+    SOURCE_CHOICES = [
+        (SOURCE_CHAT, 'Chat'),
+        (SOURCE_LANGCHAIN, 'LangChain'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='search_entries'
+    )
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    thread_id = models.PositiveBigIntegerField(null=True, blank=True)
+    chat_message = models.OneToOneField(
+        'chat.ChatHistory',
+        on_delete=models.CASCADE,
+        related_name='search_entry',
+        null=True,
+        blank=True
+    )
+    langchain_message = models.OneToOneField(
+        'langchain_chat.LangChainMessage',
+        on_delete=models.CASCADE,
+        related_name='search_entry',
+        null=True,
+        blank=True
+    )
+    role = models.CharField(max_length=20)
+    content = models.TextField()
+    timestamp = models.DateTimeField()
+    vector_row = models.PositiveBigIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'source'], name='search_entry_user_source'),
+            models.Index(fields=['id'], condition=models.Q(vector_row__isnull=True), name='search_entry_unembedded'),
+        ]
+
+    @property
+    def message_id(self):
+        return self.chat_message_id or self.langchain_message_id
+
+    def __str__(self):
+        return f"{self.source} {self.message_id} - {self.role}"
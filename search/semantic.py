@@ -0,0 +1,344 @@
+"""
+Semantic search over SearchEntry rows.
+
+Each user's vectors live in an append-only pair of files under
+SEMANTIC_INDEX_PATH: ``vectors.f16`` holds L2-normalised float16 rows and
+``ids.i64`` the matching SearchEntry ids. Queries read the vectors through
+a memory map and score them in fixed-size blocks, so memory use is bounded
+by the block size rather than the history size. Users with more than
+SEMANTIC_ANN_THRESHOLD vectors also get an hnswlib graph that is extended
+with new rows rather than rebuilt.
+
+The index is filled by a single background indexer
+(``manage.py index_semantic_search``) which embeds, in batches, every
+SearchEntry without a ``vector_row`` and then records the row its vector
+went to. Saving an entry clears its vector_row, so edited messages are
+embedded again; the superseded row stays in the store and is ignored by
+queries, which only accept a row that is its entry's current vector_row.
+``state.json`` records how many rows of each store are complete.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from chat.models import ChatThread
+from langchain_chat.retrieval import get_embeddings
+
+from .models import SearchEntry
+
+try:
+    import hnswlib
+except ImportError:  # pragma: no cover - hnswlib ships with chromadb
+    hnswlib = None
+
+
+# Loaded ANN graphs, most recently used last. Queries extend a cached graph
+# in memory with rows the indexer has appended since it was saved; only the
+# indexer writes ann.bin.
+_ann_cache = OrderedDict()
+_ann_lock = threading.Lock()
+
+
+class SemanticIndexError(Exception):
+    """Raised when the semantic index cannot be read or updated"""
+    pass
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorStore:
+    """One user's append-only vector files"""
+
+    def __init__(self, root: Path, user_id: int, dimensions: int):
+        self.path = Path(root) / f'user_{user_id}'
+        self.dimensions = dimensions
+        self.vectors_path = self.path / 'vectors.f16'
+        self.ids_path = self.path / 'ids.i64'
+        self.ann_path = self.path / 'ann.bin'
+
+    @property
+    def row_bytes(self) -> int:
+        return self.dimensions * 2
+
+    def count(self) -> int:
+        """Rows present in both files; a partly written tail is ignored"""
+        if not self.vectors_path.exists() or not self.ids_path.exists():
+            return 0
+        return min(
+            self.vectors_path.stat().st_size // self.row_bytes,
+            self.ids_path.stat().st_size // 8
+        )
+
+    def append(self, entry_ids: List[int], vectors: np.ndarray) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.vectors_path, 'ab') as f:
+            f.write(_normalise(vectors).astype(np.float16).tobytes())
+        with open(self.ids_path, 'ab') as f:
+            f.write(np.asarray(entry_ids, dtype=np.int64).tobytes())
+
+    def truncate(self, rows: int) -> None:
+        """Drop rows written after the last recorded checkpoint"""
+        if self.vectors_path.exists():
+            os.truncate(self.vectors_path, rows * self.row_bytes)
+        if self.ids_path.exists():
+            os.truncate(self.ids_path, rows * 8)
+        if self.ann_path.exists():
+            self.ann_path.unlink()
+
+    def _ids(self, rows: int) -> np.ndarray:
+        return np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(rows,))
+
+    def _vectors(self, rows: int) -> np.memmap:
+        return np.memmap(self.vectors_path, dtype=np.float16, mode='r', shape=(rows, self.dimensions))
+
+    def ids(self) -> np.ndarray:
+        return np.fromfile(self.ids_path, dtype=np.int64, count=self.count())
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[int, int, float]]:
+        """(row, entry id, cosine similarity) of the k nearest rows"""
+        rows = self.count()
+        if rows == 0:
+            return []
+        query = _normalise(query)
+        if hnswlib is not None and rows >= settings.SEMANTIC_ANN_THRESHOLD:
+            labels, scores = self._search_ann(query, k, rows)
+        else:
+            labels, scores = self._search_exact(query, k, rows)
+        ids = self._ids(rows)
+        return [(int(label), int(ids[label]), float(score)) for label, score in zip(labels, scores)]
+
+    def _search_exact(self, query, k, rows):
+        vectors = self._vectors(rows)
+        block = settings.SEMANTIC_SEARCH_BLOCK_SIZE
+        best_labels = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, rows, block):
+            scores = vectors[start:start + block].astype(np.float32) @ query
+            labels = np.arange(start, start + len(scores))
+            best_labels = np.concatenate([best_labels, labels])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k)[:k]
+                best_labels, best_scores = best_labels[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        return best_labels[order], best_scores[order]
+
+    def _search_ann(self, query, k, rows):
+        with _ann_lock:
+            index = _ann_cache.pop(self.ann_path, None)
+            if index is None or index.get_current_count() > rows:
+                # Not loaded yet, or the store was cut back by recovery
+                index = self._load_ann(rows)
+            self._extend_ann(index, rows)
+            _ann_cache[self.ann_path] = index
+            while len(_ann_cache) > settings.SEMANTIC_ANN_CACHE_SIZE:
+                _ann_cache.popitem(last=False)
+            index.set_ef(max(k * 2, 64))
+            labels, distances = index.knn_query(query, k=min(k, rows))
+        return labels[0], 1.0 - distances[0]
+
+    def _load_ann(self, rows):
+        index = hnswlib.Index(space='ip', dim=self.dimensions)
+        if self.ann_path.exists():
+            index.load_index(str(self.ann_path), max_elements=rows)
+        else:
+            index.init_index(max_elements=rows, ef_construction=200, M=16)
+        return index
+
+    def _extend_ann(self, index, rows):
+        indexed = index.get_current_count()
+        if indexed >= rows:
+            return False
+        if index.get_max_elements() < rows:
+            index.resize_index(rows)
+        vectors = self._vectors(rows)
+        block = settings.SEMANTIC_SEARCH_BLOCK_SIZE
+        for start in range(indexed, rows, block):
+            stop = min(start + block, rows)
+            index.add_items(vectors[start:stop].astype(np.float32), np.arange(start, stop))
+        return True
+
+    def sync_ann(self):
+        """Add rows the saved ANN graph is missing and save it; used by the indexer"""
+        rows = self.count()
+        index = self._load_ann(rows)
+        if self._extend_ann(index, rows):
+            index.save_index(str(self.ann_path))
+
+
+class SemanticIndex:
+    """The collection of per-user stores plus the indexer's checkpoint"""
+
+    def __init__(self, root=None):
+        self.root = Path(root or settings.SEMANTIC_INDEX_PATH)
+        self.state_path = self.root / 'state.json'
+
+    def load_state(self) -> Dict:
+        if not self.state_path.exists():
+            return {'dimensions': None, 'rows': {}}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def save_state(self, state: Dict) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def store(self, user_id: int, dimensions: int) -> VectorStore:
+        return VectorStore(self.root, user_id, dimensions)
+
+    def recover(self, state: Dict) -> None:
+        """Cut every store back to the rows recorded in the checkpoint"""
+        if not state['dimensions'] or not self.root.exists():
+            return
+        for path in self.root.glob('user_*'):
+            user_id = path.name[len('user_'):]
+            rows = state['rows'].get(user_id, 0)
+            store = self.store(user_id, state['dimensions'])
+            if store.vectors_path.exists() and store.vectors_path.stat().st_size != rows * store.row_bytes:
+                store.truncate(rows)
+            elif store.ids_path.exists() and store.ids_path.stat().st_size != rows * 8:
+                store.truncate(rows)
+
+    def adopt(self, state: Dict) -> None:
+        """
+        Record vector rows for an index without them: a new index (whose
+        entries may still point into a removed one) or one written before
+        vector_row existed, which embedded every entry up to last_entry_id.
+        """
+        if not state['rows']:
+            SearchEntry.objects.filter(vector_row__isnull=False).update(vector_row=None)
+        elif 'last_entry_id' in state:
+            for user_id in state['rows']:
+                rows = {int(entry_id): row for row, entry_id in enumerate(self.store(user_id, state['dimensions']).ids())}
+                entry_ids = SearchEntry.objects.filter(
+                    user_id=user_id, id__lte=state['last_entry_id'], vector_row__isnull=True
+                ).values_list('id', flat=True)
+                SearchEntry.objects.bulk_update(
+                    [SearchEntry(id=entry_id, vector_row=rows[entry_id]) for entry_id in entry_ids if entry_id in rows],
+                    ['vector_row'],
+                    batch_size=500
+                )
+        state.pop('last_entry_id', None)
+        self.save_state(state)
+
+    def index_pending(self, batch_size: int = None, max_batches: int = None) -> int:
+        """Embed SearchEntry rows added or changed since they were last embedded; returns the count"""
+        batch_size = batch_size or settings.SEMANTIC_INDEX_BATCH_SIZE
+        max_length = settings.SEMANTIC_MAX_TEXT_LENGTH
+        embeddings = get_embeddings()
+        fresh = not self.state_path.exists()
+        state = self.load_state()
+        self.recover(state)
+        if fresh or 'last_entry_id' in state:
+            self.adopt(state)
+
+        indexed = 0
+        batches = 0
+        touched = set()
+        while max_batches is None or batches < max_batches:
+            entries = list(
+                SearchEntry.objects.filter(vector_row__isnull=True)
+                .order_by('id').values_list('id', 'user_id', 'content')[:batch_size]
+            )
+            if not entries:
+                break
+            vectors = np.asarray(
+                embeddings.embed_documents([content[:max_length] for _, _, content in entries]),
+                dtype=np.float32
+            )
+            if state['dimensions'] is None:
+                state['dimensions'] = vectors.shape[1]
+            elif vectors.shape[1] != state['dimensions']:
+                raise SemanticIndexError(
+                    f"Embedding size changed from {state['dimensions']} to {vectors.shape[1]}; "
+                    "remove the index directory to rebuild it"
+                )
+
+            by_user = {}
+            for row, (entry_id, user_id, content) in enumerate(entries):
+                by_user.setdefault(user_id, []).append((entry_id, content, row))
+            placed = []
+            for user_id, items in by_user.items():
+                store = self.store(user_id, state['dimensions'])
+                first_row = state['rows'].get(str(user_id), 0)
+                store.append([entry_id for entry_id, _, _ in items], vectors[[row for _, _, row in items]])
+                state['rows'][str(user_id)] = first_row + len(items)
+                placed.extend(
+                    (entry_id, content, first_row + n) for n, (entry_id, content, _) in enumerate(items)
+                )
+                touched.add(user_id)
+            self.save_state(state)
+
+            # Only once the rows are checkpointed; an entry saved again while
+            # it was being embedded keeps no vector_row and goes round again
+            with transaction.atomic():
+                for entry_id, content, vector_row in placed:
+                    SearchEntry.objects.filter(id=entry_id, content=content, vector_row__isnull=True).update(
+                        vector_row=vector_row
+                    )
+            indexed += len(entries)
+            batches += 1
+
+        # Extend the ANN graphs once per run rather than once per batch
+        if hnswlib is not None:
+            for user_id in touched:
+                if state['rows'][str(user_id)] >= settings.SEMANTIC_ANN_THRESHOLD:
+                    self.store(user_id, state['dimensions']).sync_ann()
+        return indexed
+
+    def search(self, user_id: int, query: str, k: int = 10, source: str = None) -> List[SearchEntry]:
+        """The user's k nearest messages, each with a ``score`` attribute"""
+        state = self.load_state()
+        if not state['dimensions']:
+            return []
+        try:
+            vector = np.asarray(get_embeddings().embed_query(query), dtype=np.float32)
+            # Over-fetch to make up for deleted or superseded entries and the source filter
+            candidates = self.store(user_id, state['dimensions']).search(vector, k * 4)
+        except Exception as e:
+            raise SemanticIndexError(f"Failed to search semantic index: {str(e)}")
+
+        entries = SearchEntry.objects.filter(
+            user_id=user_id, id__in=[entry_id for _, entry_id, _ in candidates]
+        ).exclude(
+            # Messages of deleted (deactivated) chat threads
+            source=SearchEntry.SOURCE_CHAT,
+            thread_id__in=ChatThread.objects.filter(user_id=user_id, is_active=False).values('id')
+        )
+        if source:
+            entries = entries.filter(source=source)
+        entries = entries.in_bulk()
+        hits = []
+        for row, entry_id, score in candidates:
+            entry = entries.get(entry_id)
+            # Rows of deleted entries and superseded vectors of edited ones are skipped
+            if entry is not None and entry.vector_row == row:
+                entry.score = score
+                hits.append(entry)
+        return hits[:k]
+
+
+def group_by_thread(hits: List[SearchEntry]) -> List[Dict]:
+    """Collapse message hits into threads, ordered by their best score"""
+    threads = {}
+    for hit in hits:
+        key = (hit.source, hit.thread_id)
+        if key not in threads:
+            threads[key] = {'source': hit.source, 'thread_id': hit.thread_id, 'score': hit.score, 'hits': 0}
+        threads[key]['hits'] += 1
+    return list(threads.values())
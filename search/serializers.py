@@ -0,0 +1,39 @@
+from rest_framework import serializers
+from .models import SearchEntry
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=500)
+    source = serializers.ChoiceField(choices=SearchEntry.SOURCE_CHOICES, required=False)
+
+
+class SearchHitSerializer(serializers.ModelSerializer):
+    """A ranked hit; the snippet marks matched terms with <mark></mark>"""
+    message_id = serializers.IntegerField(read_only=True)
+    rank = serializers.FloatField(read_only=True)
+    snippet = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = SearchEntry
+        fields = ['source', 'thread_id', 'message_id', 'role', 'timestamp', 'rank', 'snippet']
+        read_only_fields = fields
+
+
+class SemanticQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=2000)
+    k = serializers.IntegerField(min_value=1, max_value=50, default=10)
+    source = serializers.ChoiceField(choices=SearchEntry.SOURCE_CHOICES, required=False)
+
+
+class SemanticHitSerializer(serializers.ModelSerializer):
+    message_id = serializers.IntegerField(read_only=True)
+    score = serializers.FloatField(read_only=True)
+    preview = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SearchEntry
+        fields = ['source', 'thread_id', 'message_id', 'role', 'timestamp', 'score', 'preview']
+        read_only_fields = fields
+
+    def get_preview(self, obj):
+        return obj.content[:200]
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from chat.models import ChatHistory
+from langchain_chat.models import LangChainMessage
+
+from .indexing import index_messages
+
+
+@receiver(post_save, sender=ChatHistory, dispatch_uid='search_index_chat_message')
+@receiver(post_save, sender=LangChainMessage, dispatch_uid='search_index_langchain_message')
+def index_saved_message(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_messages([instance])
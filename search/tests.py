@@ -0,0 +1,307 @@
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from io import StringIO
+import tempfile
+import numpy as np
+from chat.models import ChatThread, ChatHistory
+from langchain_chat.models import LangChainThread, LangChainMessage
+from langchain_chat import retrieval
+from .models import SearchEntry
+from .semantic import SemanticIndex
+
+User = get_user_model()
+
+
+class SearchAPITestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpass123',
+            first_name='Test',
+            last_name='User'
+        )
+        self.other_user = User.objects.create_user(
+            email='other@example.com',
+            password='testpass123',
+            first_name='Other',
+            last_name='User'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.chat_thread = ChatThread.objects.create(user=self.user, title='Chat')
+        self.langchain_thread = LangChainThread.objects.create(user=self.user, title='LangChain')
+
+    def search(self, **params):
+        return self.client.get(reverse('search'), params)
+
+    def test_messages_are_indexed_on_write(self):
+        """Test that messages saved through the managers are searchable"""
+        chat_message = ChatHistory.objects.create_in_thread(
+            self.chat_thread, user=self.user, message='How do I rotate the API keys?', role='user'
+        )
+        LangChainMessage.objects.create_in_thread(
+            self.langchain_thread, user=self.user, content='Rotating keys weekly is advised.', role='assistant'
+        )
+        LangChainMessage.objects.create_in_thread(
+            self.langchain_thread, user=self.user, content='You rotate keys for a living.', role='system'
+        )
+
+        response = self.search(q='rotate keys')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        hits = {hit['source']: hit for hit in response.data['results']}
+        self.assertEqual(hits['chat']['message_id'], chat_message.id)
+        self.assertEqual(hits['chat']['thread_id'], self.chat_thread.id)
+        self.assertIn('<mark>rotate</mark>', hits['chat']['snippet'])
+        self.assertEqual(hits['langchain']['role'], 'assistant')
+
+    def test_ranking_and_source_filter(self):
+        """Test that closer matches rank first and source narrows the results"""
+        ChatHistory.objects.create_in_thread(
+            self.chat_thread, user=self.user, role='user',
+            message='Deploy notes. ' + 'Unrelated filler text. ' * 30 + 'The database migration ran.'
+        )
+        best = ChatHistory.objects.create_in_thread(
+            self.chat_thread, user=self.user, role='user', message='Database migration failed'
+        )
+        LangChainMessage.objects.create_in_thread(
+            self.langchain_thread, user=self.user, content='database migration', role='user'
+        )
+
+        response = self.search(q='database migration', source='chat')
+
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['results'][0]['message_id'], best.id)
+        self.assertGreater(response.data['results'][0]['rank'], response.data['results'][1]['rank'])
+
+    def test_pagination(self):
+        """Test that hits are paginated"""
+        for i in range(25):
+            ChatHistory.objects.create_in_thread(
+                self.chat_thread, user=self.user, role='user', message=f'invoice number {i}'
+            )
+
+        first = self.search(q='invoice')
+        second = self.search(q='invoice', page=2)
+
+        self.assertEqual(first.data['count'], 25)
+        self.assertEqual(len(first.data['results']), 20)
+        self.assertIsNotNone(first.data['next'])
+        self.assertEqual(len(second.data['results']), 5)
+        seen = {hit['message_id'] for hit in first.data['results'] + second.data['results']}
+        self.assertEqual(len(seen), 25)
+
+    def test_search_is_scoped_to_user(self):
+        """Test that other users' messages are never returned"""
+        other_thread = ChatThread.objects.create(user=self.other_user, title='Other')
+        ChatHistory.objects.create_in_thread(
+            other_thread, user=self.other_user, role='user', message='secret payroll figures'
+        )
+
+        response = self.search(q='payroll')
+
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(response.data['results'], [])
+
+    def test_deleted_messages_leave_index(self):
+        """Test that deleting a thread removes its messages from the index"""
+        ChatHistory.objects.create_in_thread(
+            self.chat_thread, user=self.user, role='user', message='quarterly forecast'
+        )
+        self.chat_thread.delete()
+
+        self.assertEqual(self.search(q='forecast').data['count'], 0)
+        self.assertFalse(SearchEntry.objects.exists())
+
+    def test_soft_deleted_chat_threads_are_not_searched(self):
+        """Test that messages of a chat thread deleted through the API are no longer returned"""
+        ChatHistory.objects.create_in_thread(
+            self.chat_thread, user=self.user, role='user', message='quarterly forecast'
+        )
+        response = self.client.delete(reverse('thread-detail', args=[self.chat_thread.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertEqual(self.search(q='forecast').data['count'], 0)
+        self.assertEqual(self.search(q='forecast').data['results'], [])
+
+    def test_query_is_required(self):
+        """Test that a missing or punctuation-only query is handled"""
+        self.assertEqual(self.search().status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.search(q='"*) OR (')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 0)
+
+    def test_rebuild_command_indexes_bulk_created_messages(self):
+        """Test that the rebuild command picks up messages saved without signals"""
+        ChatHistory.objects.bulk_create([
+            ChatHistory(user=self.user, thread=self.chat_thread, role='user', message=f'imported backlog item {i}')
+            for i in range(5)
+        ])
+        self.assertEqual(self.search(q='backlog').data['count'], 0)
+
+        call_command('rebuild_search_index', batch_size=2, stdout=StringIO())
+        call_command('rebuild_search_index', stdout=StringIO())
+
+        self.assertEqual(self.search(q='backlog').data['count'], 5)
+        self.assertEqual(SearchEntry.objects.count(), 5)
+
+
+class SemanticSearchTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpass123',
+            first_name='Test',
+            last_name='User'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            SEMANTIC_INDEX_PATH=self.index_dir.name,
+            RAG_EMBEDDINGS='langchain_chat.retrieval.HashingEmbeddings',
+            SEMANTIC_INDEX_BATCH_SIZE=3,
+            SEMANTIC_SEARCH_BLOCK_SIZE=4
+        )
+        self.settings_override.enable()
+        retrieval.get_embeddings.cache_clear()
+
+        self.chat_thread = ChatThread.objects.create(user=self.user, title='Travel')
+        self.langchain_thread = LangChainThread.objects.create(user=self.user, title='Cooking')
+        for text in ['book a flight to lisbon in may', 'hotel near the lisbon old town',
+                     'train tickets from porto to lisbon']:
+            ChatHistory.objects.create_in_thread(self.chat_thread, user=self.user, role='user', message=text)
+        for text in ['slow roast the lamb shoulder', 'bake sourdough bread overnight',
+                     'how long to roast a lamb leg']:
+            LangChainMessage.objects.create_in_thread(self.langchain_thread, user=self.user, role='user', content=text)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        retrieval.get_embeddings.cache_clear()
+        self.index_dir.cleanup()
+
+    def search(self, **params):
+        return self.client.get(reverse('semantic-search'), params)
+
+    def test_nearest_messages_and_threads(self):
+        """Test that the indexer fills the index and queries return the closest hits"""
+        call_command('index_semantic_search', stdout=StringIO())
+
+        response = self.search(q='roast lamb', k=2)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertTrue(all(hit['source'] == 'langchain' for hit in response.data['results']))
+        self.assertIn('lamb', response.data['results'][0]['preview'])
+        self.assertEqual(response.data['threads'][0]['thread_id'], self.langchain_thread.id)
+        self.assertEqual(response.data['threads'][0]['hits'], 2)
+
+        response = self.search(q='roast lamb', k=2, source='chat')
+        self.assertTrue(all(hit['source'] == 'chat' for hit in response.data['results']))
+
+    def test_indexing_is_incremental(self):
+        """Test that only messages added since the last run are embedded"""
+        index = SemanticIndex()
+        self.assertEqual(index.index_pending(), 6)
+        self.assertEqual(index.index_pending(), 0)
+
+        ChatHistory.objects.create_in_thread(self.chat_thread, user=self.user, role='user', message='ferry to sintra')
+        self.assertEqual(index.index_pending(), 1)
+
+        store = index.store(self.user.id, index.load_state()['dimensions'])
+        self.assertEqual(store.count(), 7)
+        self.assertEqual(store.vectors_path.stat().st_size, 7 * store.row_bytes)
+
+    def test_entries_committed_out_of_order_are_embedded(self):
+        """Test that an entry with a lower id than indexed ones is still picked up"""
+        index = SemanticIndex()
+        index.index_pending()
+        entry = SearchEntry.objects.order_by('id').first()
+        entry.delete()
+        entry.content = 'ferry to sintra'
+        entry.vector_row = None
+        entry.save()
+
+        self.assertEqual(index.index_pending(), 1)
+        self.assertEqual(index.search(self.user.id, 'ferry to sintra', k=1)[0].id, entry.id)
+
+    def test_edited_messages_are_embedded_again(self):
+        """Test that an edit replaces the message's vector rather than adding a second hit"""
+        index = SemanticIndex()
+        index.index_pending()
+        message = ChatHistory.objects.get(message='book a flight to lisbon in may')
+        message.message = 'ferry to sintra'
+        message.save()
+
+        self.assertEqual(index.index_pending(), 1)
+        hits = index.search(self.user.id, 'ferry to sintra', k=6)
+        self.assertEqual(hits[0].chat_message_id, message.id)
+        self.assertEqual(len({hit.id for hit in hits}), len(hits))
+        self.assertEqual(index.index_pending(), 0)
+
+    def test_adopts_index_without_vector_rows(self):
+        """Test that an index checkpointed by entry id is taken over without embedding again"""
+        index = SemanticIndex()
+        index.index_pending()
+        state = index.load_state()
+        state['last_entry_id'] = SearchEntry.objects.order_by('-id').first().id
+        index.save_state(state)
+        SearchEntry.objects.update(vector_row=None)
+
+        self.assertEqual(index.index_pending(), 0)
+        self.assertNotIn('last_entry_id', index.load_state())
+        self.assertEqual(len(index.search(self.user.id, 'lisbon', k=6)), 6)
+
+    def test_soft_deleted_chat_threads_are_not_searched(self):
+        """Test that semantic hits skip messages of deactivated chat threads"""
+        SemanticIndex().index_pending()
+        self.chat_thread.is_active = False
+        self.chat_thread.save()
+
+        hits = SemanticIndex().search(self.user.id, 'lisbon hotel', k=6)
+
+        self.assertEqual(len(hits), 3)
+        self.assertTrue(all(hit.source == 'langchain' for hit in hits))
+
+    def test_recovers_from_interrupted_batch(self):
+        """Test that rows written after the last checkpoint are discarded"""
+        index = SemanticIndex()
+        index.index_pending(max_batches=1)
+        state = index.load_state()
+        store = index.store(self.user.id, state['dimensions'])
+        store.append([999], np.ones((1, state['dimensions'])))
+
+        index.index_pending()
+
+        self.assertEqual(store.count(), 6)
+        self.assertEqual(
+            sorted(np.fromfile(store.ids_path, dtype=np.int64).tolist()),
+            sorted(SearchEntry.objects.values_list('id', flat=True))
+        )
+
+    def test_ann_matches_exact_search(self):
+        """Test that the hnswlib graph returns the same nearest hit as a full scan"""
+        index = SemanticIndex()
+        index.index_pending()
+        exact = [hit.id for hit in index.search(self.user.id, 'lisbon hotel', k=1)]
+
+        with override_settings(SEMANTIC_ANN_THRESHOLD=1):
+            ChatHistory.objects.create_in_thread(self.chat_thread, user=self.user, role='user', message='ferry')
+            index.index_pending()
+            store = index.store(self.user.id, index.load_state()['dimensions'])
+            self.assertTrue(store.ann_path.exists())
+            approximate = [hit.id for hit in index.search(self.user.id, 'lisbon hotel', k=1)]
+
+        self.assertEqual(exact, approximate)
+
+    def test_empty_index(self):
+        """Test that searching before anything is indexed returns no hits"""
+        response = self.search(q='anything')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
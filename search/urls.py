@@ -0,0 +1,7 @@
+from django.urls import path
+from .views import SearchView, SemanticSearchView
+
+urlpatterns = [
+    path('', SearchView.as_view(), name='search'),
+    path('semantic/', SemanticSearchView.as_view(), name='semantic-search'),
+]
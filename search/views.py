@@ -0,0 +1,61 @@
+from rest_framework import generics, status
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .backends import search_messages
+from .semantic import SemanticIndex, SemanticIndexError, group_by_thread
+from .serializers import (
+    SearchHitSerializer,
+    SearchQuerySerializer,
+    SemanticHitSerializer,
+    SemanticQuerySerializer,
+)
+
+
+class SearchPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class SearchView(generics.ListAPIView):
+    """Ranked full-text search over the current user's messages"""
+    permission_classes = [IsAuthenticated]
+    serializer_class = SearchHitSerializer
+    pagination_class = SearchPagination
+
+    def get_queryset(self):
+        serializer = SearchQuerySerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return search_messages(
+            self.request.user.id,
+            serializer.validated_data['q'],
+            source=serializer.validated_data.get('source')
+        )
+
+
+class SemanticSearchView(APIView):
+    """Messages and threads closest in meaning to the query"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        serializer = SemanticQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        try:
+            hits = SemanticIndex().search(
+                request.user.id,
+                serializer.validated_data['q'],
+                k=serializer.validated_data['k'],
+                source=serializer.validated_data.get('source')
+            )
+        except SemanticIndexError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        return Response({
+            'results': SemanticHitSerializer(hits, many=True).data,
+            'threads': group_by_thread(hits),
+        })